@@ -1,9 +1,23 @@
 import os
+import hmac
+import time
 import stripe
-from flask import Flask, request, jsonify
+from flask import Flask, Response, request, jsonify
 from dotenv import load_dotenv
-from sheets_service import SheetsService
-from datetime import datetime
+from sheets_service import SheetsNotReadyError
+from event_queue import EventQueue, EventWorkerPool
+from processed_events import ProcessedEventStore
+from dead_letters import DeadLetterStore
+from coalescer import EventCoalescer
+from rate_limiter import QuotaExceededError
+from http_clients import configure_stripe_client
+from coordination import coordinator_from_env, LockTimeoutError
+from webhook_signature import construct_event, parse_event, PayloadTooLargeError, MAX_WEBHOOK_BYTES
+from sharding import sheets_service_from_env
+from sinks import sink_from_env, FanOutSink
+from sheet_snapshot import FIELDS, find_customer, query_snapshots
+from event_handlers import HANDLED_EVENT_TYPES, event_handlers_from_env
+import metrics
 
 load_dotenv()
 
@@ -13,185 +27,394 @@ app = Flask(__name__)
 stripe.api_key = os.getenv('STRIPE_API_KEY')
 STRIPE_WEBHOOK_SECRET = os.getenv('STRIPE_WEBHOOK_SECRET')
 
-# Initialize Sheets Service
-sheets_service = SheetsService()
+# One pooled keep-alive session shared by every request thread
+configure_stripe_client()
+
+# Initialize Sheets Service in the background so /health answers immediately
+# and a Google outage doesn't keep workers from booting
+sheets_service = sheets_service_from_env(connect=False, coordinator=coordinator_from_env())
+sheets_service.start_background_init()
+
+# Where customer rows go: straight to Sheets (default), or a local record
+# that Sheets follows in the background (CUSTOMER_SINKS=local,sheets)
+customer_sink = sink_from_env(sheets_service)
+
+# Optional: merge bursts of events for one customer into a single Sheets write
+COALESCE_ENABLED = os.getenv('COALESCE_ENABLED', 'false').lower() == 'true'
+coalescer = EventCoalescer(customer_sink.upsert_customers) if COALESCE_ENABLED else None
+
+# Event -> row handlers, with the local customer projection and the
+# out-of-order guard (CUSTOMER_STORE_ENABLED, EVENT_ORDER_GUARD_ENABLED)
+handlers = event_handlers_from_env(customer_sink, coalescer)
+customer_store = handlers.customer_store
+customer_cache = handlers.customer_cache
+event_order = handlers.event_order
+
+# Remember handled event IDs so Stripe retries and duplicates are skipped
+PROCESSED_EVENTS_ENABLED = os.getenv('PROCESSED_EVENTS_ENABLED', 'true').lower() == 'true'
+processed_events = ProcessedEventStore() if PROCESSED_EVENTS_ENABLED else None
+
+# Keep failed events for replay.py instead of relying on Stripe's retries alone
+DEAD_LETTERS_ENABLED = os.getenv('DEAD_LETTERS_ENABLED', 'true').lower() == 'true'
+dead_letters = DeadLetterStore() if DEAD_LETTERS_ENABLED else None
+
+# Read-only /customers API over the in-memory sheet snapshot; served only
+# with SHEETS_SNAPSHOT_ENABLED=true and a token to check callers against
+CUSTOMER_API_TOKEN = os.getenv('CUSTOMER_API_TOKEN', '')
+CUSTOMER_API_MAX_LIMIT = 1000
+
+# Optional: acknowledge webhooks immediately and process them in the background
+EVENT_QUEUE_ENABLED = os.getenv('EVENT_QUEUE_ENABLED', 'false').lower() == 'true'
+event_queue = None
+event_workers = None
+
+metrics.registry.gauge(
+    'sheets_ready', 'Whether the Google Sheets connection is established',
+    lambda: 1 if sheets_service.ready else 0
+)
+metrics.registry.gauge(
+    'sheets_quota_remaining', 'Sheets requests that can be made right now without waiting',
+    lambda: {(kind,): value for kind, value in sheets_service.remaining_budget().items()},
+    ('kind',)
+)
+metrics.registry.gauge(
+    'sheets_row_updates_total', 'Updates to existing Sheets rows by result (written, timestamp_only, unchanged)',
+    lambda: {(result,): count for result, count in sheets_service.update_stats().items() if result != 'skip_ratio'},
+    ('result',), type_name='counter'
+)
+metrics.registry.gauge(
+    'sheets_unchanged_skip_ratio', 'Share of row updates skipped because the row already held the values',
+    lambda: sheets_service.update_stats()['skip_ratio']
+)
+metrics.registry.gauge(
+    'stripe_customer_cache_lookups_total', 'Customer cache lookups by result',
+    lambda: {('hit',): customer_cache.stats()['hits'], ('miss',): customer_cache.stats()['misses']},
+    ('result',), type_name='counter'
+)
+metrics.registry.gauge(
+    'stripe_customer_cache_hit_ratio', 'Share of customer lookups served from the cache',
+    lambda: customer_cache.stats()['hit_ratio']
+)
+metrics.registry.gauge(
+    'stripe_customer_cache_size', 'Customers currently cached',
+    lambda: customer_cache.stats()['size']
+)
+if dead_letters is not None:
+    metrics.registry.gauge(
+        'dead_letters', 'Failed events waiting for replay', dead_letters.count
+    )
+if isinstance(customer_sink, FanOutSink):
+    metrics.registry.gauge(
+        'sink_backlog', 'Customer changes not yet applied to each downstream sink',
+        lambda: {(sink,): count for sink, count in customer_sink.local.backlog().items()},
+        ('sink',)
+    )
+if coalescer is not None:
+    metrics.registry.gauge(
+        'coalescer_events_total', 'Events submitted to the coalescing window',
+        lambda: coalescer.stats()['events'], type_name='counter'
+    )
+    metrics.registry.gauge(
+        'coalescer_writes_total', 'Merged rows written after coalescing',
+        lambda: coalescer.stats()['writes'], type_name='counter'
+    )
 
 
 @app.route('/health', methods=['GET'])
 def health_check():
     """Health check endpoint for Render"""
-    return jsonify({'status': 'healthy'}), 200
+    body = {
+        'status': 'healthy',
+        'sheets': sheets_service.status(),
+        'sheets_quota': sheets_service.remaining_budget(),
+        'sheets_updates': sheets_service.update_stats()
+    }
+    if isinstance(customer_sink, FanOutSink):
+        body['sinks'] = customer_sink.status()
+    if event_queue is not None:
+        body['queue'] = event_queue.depth()
+    if dead_letters is not None:
+        body['dead_letters'] = dead_letters.count()
+    return jsonify(body), 200
+
+
+@app.route('/ready', methods=['GET'])
+def readiness_check():
+    """Readiness probe: 200 once writes can be accepted (Sheets connected, or a local sink)"""
+    if customer_sink.ready:
+        return jsonify({'status': 'ready'}), 200
+    return jsonify({'status': 'initializing', 'error': sheets_service.last_error}), 503
+
+
+@app.route('/metrics', methods=['GET'])
+def metrics_endpoint():
+    """Per-stage latency histograms and API counters in Prometheus text format"""
+    return Response(metrics.registry.render(), mimetype='text/plain; version=0.0.4')
+
+
+def customer_snapshots(auth_header):
+    """
+    Check a /customers request and return the snapshots to answer it from
+
+    Returns:
+        (snapshots, None), or (None, error response)
+    """
+    if not CUSTOMER_API_TOKEN:
+        return None, (jsonify({'error': 'Customer API is disabled'}), 404)
+    if not hmac.compare_digest((auth_header or '').encode('utf-8'), f'Bearer {CUSTOMER_API_TOKEN}'.encode('utf-8')):
+        return None, (jsonify({'error': 'Unauthorized'}), 401)
+    try:
+        snapshots = sheets_service.get_snapshots()
+    except (SheetsNotReadyError, QuotaExceededError) as e:
+        return None, (jsonify({'error': f'Snapshot not loaded: {e}'}), 503)
+    if not snapshots:
+        return None, (jsonify({'error': 'Customer API is disabled'}), 404)
+    return snapshots, None
+
+
+def snapshot_staleness(snapshots):
+    """
+    Seconds since the oldest snapshot's last full read
+
+    A snapshot sees this process's own writes at once, but writes by
+    other workers, backfill.py, reconcile.py or by hand only at its next
+    full read, so answers can miss changes made in this window.
+    """
+    ages = [snapshot.age() for snapshot in snapshots if snapshot.age() is not None]
+    return round(max(ages), 1) if ages else None
+
+
+def lookup_customer(customer_id, auth_header):
+    """One customer's row from the snapshot (no Sheets call)"""
+    snapshots, error = customer_snapshots(auth_header)
+    if error is not None:
+        return error
+    row = find_customer(snapshots, customer_id)
+    if row is None:
+        return jsonify({'error': 'Customer not found'}), 404
+    return jsonify(dict(row, stale_up_to_seconds=snapshot_staleness(snapshots))), 200
+
+
+def list_customers(args, auth_header):
+    """
+    Customers matching field filters from the snapshot (no Sheets call)
+
+    Args:
+        args: Query parameters: any of sheet_snapshot.FIELDS as filters,
+            plus limit and offset
+        auth_header: Authorization header value
+    """
+    snapshots, error = customer_snapshots(auth_header)
+    if error is not None:
+        return error
+    filters = {key: value for key, value in args.items() if key not in ('limit', 'offset')}
+    unknown = sorted(set(filters) - set(FIELDS))
+    if unknown:
+        return jsonify({'error': f"Unknown filter: {', '.join(unknown)}"}), 400
+    try:
+        limit = min(int(args.get('limit', 100)), CUSTOMER_API_MAX_LIMIT)
+        offset = int(args.get('offset', 0))
+    except ValueError:
+        return jsonify({'error': 'limit and offset must be integers'}), 400
+    if limit < 0 or offset < 0:
+        return jsonify({'error': 'limit and offset must not be negative'}), 400
+
+    total, rows = query_snapshots(snapshots, filters, offset, limit)
+    return jsonify({
+        'customers': rows, 'total': total, 'offset': offset, 'limit': limit,
+        'stale_up_to_seconds': snapshot_staleness(snapshots),
+    }), 200
+
+
+@app.route('/customers', methods=['GET'])
+def customers_endpoint():
+    """Filtered customer listing, e.g. /customers?status=Past%20Due&plan_tier=Elite"""
+    return list_customers(request.args, request.headers.get('Authorization'))
+
+
+@app.route('/customers/<customer_id>', methods=['GET'])
+def customer_endpoint(customer_id):
+    """One customer's row by Stripe customer ID"""
+    return lookup_customer(customer_id, request.headers.get('Authorization'))
 
 
 @app.route('/webhook', methods=['POST'])
 def stripe_webhook():
     """Handle Stripe webhook events"""
+    if (request.content_length or 0) > MAX_WEBHOOK_BYTES:
+        # Refuse before reading the body
+        metrics.EVENTS.inc(event_type='unknown', outcome='too_large')
+        return jsonify({'error': 'Payload too large'}), 413
     payload = request.data
-    sig_header = request.headers.get('Stripe-Signature')
+    event, error = verify_webhook(payload, request.headers.get('Stripe-Signature'))
+    if error is not None:
+        return error
+
+    with metrics.event_context(event['type']), metrics.stage('request'):
+        response, outcome = handle_verified_event(event, payload)
+    metrics.EVENTS.inc(event_type=event['type'], outcome=outcome)
+    return response
+
+
+def verify_webhook(payload, sig_header):
+    """
+    Check the Stripe signature and parse the event
+
+    Returns:
+        (event dict, None) when valid, or (None, 400/413 Flask response)
+    """
+    started = time.perf_counter()
 
     try:
-        # Verify webhook signature
-        event = stripe.Webhook.construct_event(
-            payload, sig_header, STRIPE_WEBHOOK_SECRET
-        )
+        # Verify the signature over the raw bytes, then parse once into dicts
+        event = construct_event(payload, sig_header, STRIPE_WEBHOOK_SECRET)
+    except PayloadTooLargeError as e:
+        app.logger.error(f'Payload too large: {e}')
+        metrics.EVENTS.inc(event_type='unknown', outcome='too_large')
+        return None, (jsonify({'error': 'Payload too large'}), 413)
     except ValueError as e:
         # Invalid payload
         app.logger.error(f'Invalid payload: {e}')
-        return jsonify({'error': 'Invalid payload'}), 400
+        metrics.EVENTS.inc(event_type='unknown', outcome='invalid_payload')
+        return None, (jsonify({'error': 'Invalid payload'}), 400)
     except stripe.error.SignatureVerificationError as e:
         # Invalid signature
         app.logger.error(f'Invalid signature: {e}')
-        return jsonify({'error': 'Invalid signature'}), 400
+        metrics.EVENTS.inc(event_type='unknown', outcome='invalid_signature')
+        return None, (jsonify({'error': 'Invalid signature'}), 400)
 
     event_type = event['type']
     app.logger.info(f'Received webhook event: {event_type}')
+    metrics.STAGE_SECONDS.observe(time.perf_counter() - started, stage='verify', event_type=event_type)
+    return event, None
 
-    # Handle different Stripe webhook events
-    try:
-        if event_type == 'checkout.session.completed':
-            # New subscription created via Checkout
-            return handle_checkout_completed(event['data']['object'])
-
-        elif event_type == 'customer.subscription.created':
-            # New subscription created (alternative to checkout)
-            return handle_subscription_event(event['data']['object'], 'Active')
 
-        elif event_type == 'customer.subscription.updated':
-            # Subscription updated (plan change, etc.)
-            subscription = event['data']['object']
-            status = map_subscription_status(subscription['status'])
-            return handle_subscription_event(subscription, status)
+def handle_verified_event(event, payload):
+    """
+    Dedupe, then queue or process a verified event
 
-        elif event_type == 'customer.subscription.deleted':
-            # Subscription cancelled/deleted
-            return handle_subscription_event(event['data']['object'], 'Cancelled')
+    Returns:
+        (Flask response, outcome label for webhook_events_total)
+    """
+    event_type = event['type']
+    event_id = event.get('id')
 
-        elif event_type == 'invoice.payment_succeeded':
-            # Payment succeeded - keep Active
-            return handle_invoice_event(event['data']['object'], 'Active')
+    if event_type not in HANDLED_EVENT_TYPES:
+        # Nothing to do: skip dedupe, the queue and dispatch entirely
+        app.logger.info(f'Unhandled event type: {event_type}')
+        return (jsonify({'success': True, 'event': event_type, 'action': 'ignored'}), 200), 'ignored'
 
-        elif event_type == 'invoice.payment_failed':
-            # Payment failed - mark as Past Due
-            return handle_invoice_event(event['data']['object'], 'Past Due')
+    if processed_events is not None and event_id:
+        with metrics.stage('dedupe'):
+            is_new = processed_events.begin(event_id)
+        if not is_new:
+            app.logger.info(f'Duplicate webhook event skipped: {event_id}')
+            return (jsonify({'success': True, 'event': event_type, 'action': 'duplicate'}), 200), 'duplicate'
 
+    try:
+        if event_queue is not None:
+            # Durably store the raw event and let the workers do the slow part
+            with metrics.stage('enqueue'):
+                event_queue.enqueue(payload, event_id, event_type)
+            event_workers.notify()
+            response = jsonify({'success': True, 'event': event_type, 'action': 'queued'}), 200
+            outcome = 'queued'
         else:
-            # Unhandled event type - log and return success
-            app.logger.info(f'Unhandled event type: {event_type}')
-            return jsonify({'success': True, 'event': event_type, 'action': 'ignored'}), 200
-
+            response = dispatch_event(event)
+            outcome = 'processed' if response[1] < 400 else 'rejected'
+    except (SheetsNotReadyError, LockTimeoutError) as e:
+        # Still connecting, or another worker is writing this customer right
+        # now - both pass within seconds, so Stripe's retry is enough
+        app.logger.warning(f'Sheets not available yet for webhook {event_type}: {e}')
+        if processed_events is not None and event_id:
+            processed_events.release(event_id)
+        return (jsonify({'error': 'Google Sheets unavailable, retry later'}), 503), 'unavailable'
+    except QuotaExceededError as e:
+        # Sheets is throttling us, which can last; keep the event for
+        # replay.py as well as letting Stripe retry
+        app.logger.warning(f'Sheets unavailable for webhook {event_type}: {e}')
+        if processed_events is not None and event_id:
+            processed_events.release(event_id)
+        record_dead_letter(event, payload, e)
+        return (jsonify({'error': 'Google Sheets unavailable, retry later'}), 503), 'unavailable'
     except Exception as e:
         app.logger.error(f'Error processing webhook {event_type}: {e}')
-        return jsonify({'error': str(e)}), 500
-
-
-def map_subscription_status(stripe_status):
-    """Map Stripe subscription status to our status labels"""
-    status_mapping = {
-        'active': 'Active',
-        'trialing': 'Trial',
-        'past_due': 'Past Due',
-        'canceled': 'Cancelled',
-        'unpaid': 'Unpaid',
-        'incomplete': 'Incomplete',
-        'incomplete_expired': 'Expired',
-        'paused': 'Paused'
-    }
-    return status_mapping.get(stripe_status.lower(), stripe_status.title())
-
-
-def handle_checkout_completed(session):
-    """Handle checkout.session.completed event"""
-    customer_id = session.get('customer')
-    if not customer_id:
-        app.logger.warning('No customer ID in session')
-        return jsonify({'error': 'No customer ID'}), 400
-
-    customer = stripe.Customer.retrieve(customer_id)
-    company_name = customer.metadata.get('company_name', 'Unknown Company')
-    country = customer.metadata.get('country', '')  # Get country from metadata
-    subscription_id = session.get('subscription')
-
-    customer_data = {
-        'customer_id': customer_id,
-        'company_name': company_name,
-        'email': customer.email,
-        'subscription_id': subscription_id,
-        'status': 'Active',
-        'amount': session.get('amount_total', 0) / 100,
-        'currency': session.get('currency', 'usd').upper(),
-        'timestamp': datetime.utcnow().strftime('%Y-%m-%d %H:%M:%S'),
-        'country': country
-    }
+        if processed_events is not None and event_id:
+            processed_events.release(event_id)
+        record_dead_letter(event, payload, e)
+        return (jsonify({'error': str(e)}), 500), 'error'
 
-    result = sheets_service.upsert_customer(customer_data)
-    app.logger.info(f'Checkout completed - Customer: {customer_id} - {result}')
-    return jsonify({'success': True, 'action': result, 'status': 'Active'}), 200
-
-
-def handle_subscription_event(subscription, status):
-    """Handle subscription-related events"""
-    customer_id = subscription.get('customer')
-    if not customer_id:
-        app.logger.warning('No customer ID in subscription')
-        return jsonify({'error': 'No customer ID'}), 400
-
-    customer = stripe.Customer.retrieve(customer_id)
-    company_name = customer.metadata.get('company_name', 'Unknown Company')
-    country = customer.metadata.get('country', '')  # Get country from metadata
-
-    # Get plan amount if available
-    amount = 0
-    currency = 'USD'
-    if subscription.get('items') and subscription['items'].get('data'):
-        first_item = subscription['items']['data'][0]
-        if first_item.get('price'):
-            amount = first_item['price'].get('unit_amount', 0) / 100
-            currency = first_item['price'].get('currency', 'usd').upper()
-
-    customer_data = {
-        'customer_id': customer_id,
-        'company_name': company_name,
-        'email': customer.email,
-        'subscription_id': subscription.get('id'),
-        'status': status,
-        'amount': amount,
-        'currency': currency,
-        'timestamp': datetime.utcnow().strftime('%Y-%m-%d %H:%M:%S'),
-        'country': country
-    }
+    if processed_events is not None and event_id:
+        processed_events.finish(event_id)
+    return response, outcome
 
-    result = sheets_service.upsert_customer(customer_data)
-    app.logger.info(f'Subscription event - Customer: {customer_id} - Status: {status} - {result}')
-    return jsonify({'success': True, 'action': result, 'status': status}), 200
-
-
-def handle_invoice_event(invoice, status):
-    """Handle invoice-related events"""
-    customer_id = invoice.get('customer')
-    if not customer_id:
-        app.logger.warning('No customer ID in invoice')
-        return jsonify({'error': 'No customer ID'}), 400
-
-    customer = stripe.Customer.retrieve(customer_id)
-    company_name = customer.metadata.get('company_name', 'Unknown Company')
-    country = customer.metadata.get('country', '')  # Get country from metadata
-    subscription_id = invoice.get('subscription')
-
-    customer_data = {
-        'customer_id': customer_id,
-        'company_name': company_name,
-        'email': customer.email,
-        'subscription_id': subscription_id,
-        'status': status,
-        'amount': invoice.get('amount_paid', 0) / 100,
-        'currency': invoice.get('currency', 'usd').upper(),
-        'timestamp': datetime.utcnow().strftime('%Y-%m-%d %H:%M:%S'),
-        'country': country
-    }
 
-    result = sheets_service.upsert_customer(customer_data)
-    app.logger.info(f'Invoice event - Customer: {customer_id} - Status: {status} - {result}')
-    return jsonify({'success': True, 'action': result, 'status': status}), 200
+def record_dead_letter(event, payload, error, attempts=1):
+    """Keep a failed event for replay.py (a store error never hides the original one)"""
+    if dead_letters is None:
+        return
+    try:
+        dead_letters.record(payload, event, error, attempts)
+    except Exception as e:
+        app.logger.error(f"Could not record dead letter for {event.get('id')}: {e}")
+
+
+def dead_letter_queued_event(item, error):
+    """Worker pool hook: move a queued event that ran out of attempts"""
+    record_dead_letter(parse_event(item['payload']), item['payload'], error, item['attempts'])
+
+
+def dispatch_event(event):
+    """Route a verified Stripe event to its handler (raises on processing errors)"""
+    body, status_code = handlers.dispatch_event(event)
+    return jsonify(body), status_code
+
+
+def process_queued_event(item):
+    """
+    Worker entry point: replay a queued payload through the event handlers
+
+    Returns:
+        With coalescing on, the Future of the event's coalesced write; the
+        worker pool settles the event when it resolves instead of holding a
+        worker for the whole window. Otherwise None.
+    """
+    event = parse_event(item['payload'])
+    with handlers.deferred_writes() as coalesced_writes:
+        try:
+            body, status_code = handlers.dispatch_event(event)
+        except Exception:
+            metrics.EVENTS.inc(event_type=event['type'], outcome='worker_retry')
+            raise
+    if status_code >= 400:
+        # Bad payloads (e.g. no customer ID) will never succeed - don't retry
+        app.logger.warning(f"Dropped queued event {item['event_id']}: {body}")
+        metrics.EVENTS.inc(event_type=event['type'], outcome='worker_dropped')
+    elif coalesced_writes:
+        future = coalesced_writes[0]
+        future.add_done_callback(lambda f: metrics.EVENTS.inc(
+            event_type=event['type'],
+            outcome='worker_retry' if f.exception() else 'worker_processed'
+        ))
+        return future
+    else:
+        metrics.EVENTS.inc(event_type=event['type'], outcome='worker_processed')
+
+
+if EVENT_QUEUE_ENABLED:
+    event_queue = EventQueue()
+    # Leave events queued until Sheets is connected and has write budget
+    event_workers = EventWorkerPool(
+        event_queue, process_queued_event,
+        ready=customer_sink.can_write,
+        on_give_up=dead_letter_queued_event if dead_letters is not None else None
+    )
+    event_workers.start()
+    metrics.registry.gauge(
+        'event_queue_depth', 'Events in the local queue by status',
+        lambda: {(status,): count for status, count in event_queue.depth().items()},
+        ('status',)
+    )
 
 
 if __name__ == '__main__':
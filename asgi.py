@@ -0,0 +1,232 @@
+"""
+ASGI entry point: the same routes and handlers on an asyncio event loop
+
+    WEB_CONCURRENCY=2 uvicorn asgi:app
+
+Requests wait on the event loop instead of holding a worker thread each,
+so one process can keep hundreds of webhooks in flight. The Stripe and
+gspread clients are synchronous, so their calls run in a bounded thread
+pool (ASGI_BLOCKING_THREADS) over the same keep-alive sessions the Flask
+app uses; the Stripe customer fetch and the Sheets index load for an
+event run concurrently before the handler is dispatched.
+"""
+
+import os
+import asyncio
+import functools
+import contextvars
+from urllib.parse import parse_qs, unquote
+from concurrent.futures import ThreadPoolExecutor
+
+import app as webhook_app
+import metrics
+from webhook_signature import MAX_WEBHOOK_BYTES
+from event_order import ROW_EVENT_TYPES
+
+
+# Threads available for blocking Stripe/Sheets/SQLite calls. Keep
+# SHEETS_HTTP_POOL_SIZE / STRIPE_HTTP_POOL_SIZE at least this large.
+BLOCKING_THREADS = int(os.getenv('ASGI_BLOCKING_THREADS', '32'))
+
+# Events whose handler looks up data['object']['customer'] and upserts its row
+PREFETCH_EVENT_TYPES = ROW_EVENT_TYPES
+
+flask_app = webhook_app.app
+executor = ThreadPoolExecutor(max_workers=BLOCKING_THREADS, thread_name_prefix='asgi-blocking')
+
+
+async def run_blocking(fn, *args):
+    """Run a blocking call in the pool, keeping contextvars (metrics labels)"""
+    loop = asyncio.get_running_loop()
+    context = contextvars.copy_context()
+    return await loop.run_in_executor(executor, functools.partial(context.run, fn, *args))
+
+
+def _to_asgi(rv):
+    """Flask view return value -> (status, ASGI headers, body)"""
+    response = flask_app.make_response(rv)
+    headers = [(name.lower().encode('latin-1'), value.encode('latin-1'))
+               for name, value in response.headers.items()]
+    return response.status_code, headers, response.get_data()
+
+
+def _call_view(view):
+    with flask_app.app_context():
+        return _to_asgi(view())
+
+
+def _verify(payload, sig_header):
+    with flask_app.app_context():
+        event, error = webhook_app.verify_webhook(payload, sig_header)
+        return event, None if error is None else _to_asgi(error)
+
+
+def _handle(event, payload):
+    with flask_app.app_context():
+        response, outcome = webhook_app.handle_verified_event(event, payload)
+        return _to_asgi(response), outcome
+
+
+async def prefetch(event):
+    """
+    Fetch the customer and load the sheet index at the same time
+
+    Both land in the caches the handler reads (customer_cache and the
+    row index), so the handler itself only does the write. Errors are
+    left for the handler to raise and report. Duplicate and out-of-order
+    events are skipped, since the handler won't fetch anything for them.
+    """
+    if webhook_app.event_queue is not None or event['type'] not in PREFETCH_EVENT_TYPES:
+        return
+    customer_id = event['data']['object'].get('customer')
+    if not customer_id:
+        return
+    processed = webhook_app.processed_events
+    if processed is not None and event.get('id') and await run_blocking(processed.is_processed, event['id']):
+        return
+    order = webhook_app.event_order
+    if order is not None and event.get('created') and \
+            await run_blocking(order.is_stale, customer_id, event['created']):
+        return
+
+    lookups = []
+    if webhook_app.customer_sink is webhook_app.sheets_service:
+        # Only worth it when the webhook writes to the sheet itself
+        lookups.append(webhook_app.sheets_service.prepare_lookup)
+
+    with metrics.stage('prefetch'):
+        await asyncio.gather(
+            run_blocking(webhook_app.customer_cache.get, customer_id),
+            *[run_blocking(lookup, customer_id) for lookup in lookups],
+            return_exceptions=True
+        )
+
+
+async def webhook(scope, body):
+    """POST /webhook"""
+    headers = dict(scope['headers'])
+    sig_header = headers.get(b'stripe-signature', b'').decode('latin-1') or None
+    event, error = await run_blocking(_verify, body, sig_header)
+    if error is not None:
+        return error
+
+    with metrics.event_context(event['type']), metrics.stage('request'):
+        await prefetch(event)
+        response, outcome = await run_blocking(_handle, event, body)
+    metrics.EVENTS.inc(event_type=event['type'], outcome=outcome)
+    return response
+
+
+def _view(view):
+    async def route(scope, body):
+        return await run_blocking(_call_view, view)
+    return route
+
+
+def _authorization(scope):
+    return dict(scope['headers']).get(b'authorization', b'').decode('latin-1')
+
+
+async def customers(scope, body):
+    """GET /customers: listing served from the sheet snapshot"""
+    args = {key: values[-1] for key, values in parse_qs(scope['query_string'].decode('latin-1')).items()}
+    return await run_blocking(_call_view, lambda: webhook_app.list_customers(args, _authorization(scope)))
+
+
+async def customer(scope, body):
+    """GET /customers/<id>: one row from the sheet snapshot"""
+    customer_id = unquote(scope['path'][len('/customers/'):])
+    return await run_blocking(_call_view, lambda: webhook_app.lookup_customer(customer_id, _authorization(scope)))
+
+
+ROUTES = {
+    ('POST', '/webhook'): webhook,
+    ('GET', '/health'): _view(webhook_app.health_check),
+    ('GET', '/ready'): _view(webhook_app.readiness_check),
+    ('GET', '/metrics'): _view(webhook_app.metrics_endpoint),
+    ('GET', '/customers'): customers,
+}
+
+# Paths with a trailing parameter
+PREFIX_ROUTES = {
+    ('GET', '/customers/'): customer,
+}
+
+
+def find_route(method, path):
+    route = ROUTES.get((method, path))
+    if route is None:
+        for (route_method, prefix), prefix_route in PREFIX_ROUTES.items():
+            if method == route_method and path.startswith(prefix) and len(path) > len(prefix):
+                return prefix_route
+    return route
+
+
+def parse_content_length(scope):
+    """Declared body size (0 when absent), or None if the header is malformed"""
+    value = dict(scope['headers']).get(b'content-length', b'0')
+    try:
+        length = int(value or 0)
+    except ValueError:
+        return None
+    return length if length >= 0 else None
+
+
+async def read_body(receive, limit=MAX_WEBHOOK_BYTES):
+    """Request body, or None as soon as it grows past `limit`"""
+    chunks = []
+    size = 0
+    while True:
+        message = await receive()
+        if message['type'] == 'http.disconnect':
+            break
+        chunk = message.get('body', b'')
+        size += len(chunk)
+        if size > limit:
+            return None
+        chunks.append(chunk)
+        if not message.get('more_body'):
+            break
+    return b''.join(chunks)
+
+
+def _too_large():
+    metrics.EVENTS.inc(event_type='unknown', outcome='too_large')
+    return 413, [(b'content-type', b'application/json')], b'{"error":"Payload too large"}'
+
+
+async def lifespan(receive, send):
+    while True:
+        message = await receive()
+        if message['type'] == 'lifespan.startup':
+            await send({'type': 'lifespan.startup.complete'})
+        elif message['type'] == 'lifespan.shutdown':
+            executor.shutdown(wait=False)
+            await send({'type': 'lifespan.shutdown.complete'})
+            return
+
+
+async def app(scope, receive, send):
+    """ASGI application"""
+    if scope['type'] == 'lifespan':
+        await lifespan(receive, send)
+        return
+    if scope['type'] != 'http':
+        return
+
+    route = find_route(scope['method'], scope['path'])
+    content_length = parse_content_length(scope)
+    body = None if content_length is None or content_length > MAX_WEBHOOK_BYTES else await read_body(receive)
+    if content_length is None:
+        status, headers, body = 400, [(b'content-type', b'application/json')], b'{"error":"Invalid Content-Length"}'
+    elif body is None:
+        status, headers, body = _too_large()
+    elif route is None:
+        allowed = any(path == scope['path'] for _, path in ROUTES) or \
+            any(scope['path'].startswith(prefix) for _, prefix in PREFIX_ROUTES)
+        status, headers, body = (405 if allowed else 404), [(b'content-type', b'text/plain')], b''
+    else:
+        status, headers, body = await route(scope, body)
+
+    await send({'type': 'http.response.start', 'status': status, 'headers': headers})
+    await send({'type': 'http.response.body', 'body': body})
@@ -0,0 +1,231 @@
+"""
+Bulk backfill: import existing Stripe subscriptions into the Google Sheet
+Pages through Stripe (customers expanded inline, 100 per request) and writes
+rows in large batches through SheetsService.upsert_customers.
+
+Usage:
+    python backfill.py                     # resume from the last checkpoint
+    python backfill.py --include-canceled  # also mark cancelled customers
+    python backfill.py --restart --chunk-size 2000
+"""
+
+import os
+import sys
+import json
+import time
+import argparse
+from datetime import datetime
+
+import stripe
+from dotenv import load_dotenv
+
+from sheets_service import map_subscription_status
+from sharding import sheets_service_from_env
+from coordination import coordinator_from_env
+
+# Fix Windows console encoding
+if sys.platform == 'win32':
+    sys.stdout.reconfigure(encoding='utf-8')  # type: ignore
+
+DEFAULT_CHECKPOINT_PATH = '.backfill_checkpoint.json'
+
+
+class Checkpoint:
+    """Progress file that lets an interrupted backfill pick up where it stopped"""
+
+    def __init__(self, path=None):
+        self.path = path or os.getenv('BACKFILL_CHECKPOINT_PATH', DEFAULT_CHECKPOINT_PATH)
+        self.starting_after = None
+        self.seen = set()
+        self.written = 0
+
+    def load(self):
+        """Read saved progress, if any (returns self)"""
+        try:
+            with open(self.path) as f:
+                data = json.load(f)
+        except (OSError, ValueError):
+            return self
+        self.starting_after = data.get('starting_after')
+        self.seen = set(data.get('seen', []))
+        self.written = data.get('written', 0)
+        return self
+
+    def save(self, starting_after):
+        """Record that everything up to `starting_after` is in the sheet"""
+        self.starting_after = starting_after
+        tmp_path = f'{self.path}.tmp'
+        with open(tmp_path, 'w') as f:
+            json.dump({
+                'starting_after': starting_after,
+                'seen': sorted(self.seen),
+                'written': self.written,
+                'saved_at': datetime.utcnow().strftime('%Y-%m-%d %H:%M:%S'),
+            }, f)
+        os.replace(tmp_path, self.path)
+
+    def clear(self):
+        try:
+            os.remove(self.path)
+        except OSError:
+            pass
+
+
+def iter_subscriptions(starting_after=None, include_canceled=False):
+    """
+    Every subscription, newest first, with its customer expanded inline
+
+    Args:
+        starting_after: Subscription ID to resume after
+        include_canceled: Also list cancelled subscriptions
+
+    Yields:
+        stripe.Subscription
+    """
+    params = {'limit': 100, 'expand': ['data.customer']}
+    if include_canceled:
+        params['status'] = 'all'
+    if starting_after:
+        params['starting_after'] = starting_after
+    yield from stripe.Subscription.list(**params).auto_paging_iter()
+
+
+def subscription_to_customer_data(subscription, timestamp=None):
+    """
+    Build the same customer_data dict the webhook handlers write
+
+    Args:
+        subscription: Stripe subscription with an expanded customer
+        timestamp: Value for the Last Updated column (defaults to now, UTC)
+
+    Returns:
+        Dictionary for SheetsService.upsert_customers, or None for
+        subscriptions whose customer was deleted
+    """
+    customer = subscription.get('customer')
+    if not customer or isinstance(customer, str) or customer.get('deleted'):
+        return None
+    metadata = customer.get('metadata') or {}
+
+    amount = 0
+    currency = 'USD'
+    items = subscription.get('items') or {}
+    if items.get('data'):
+        price = items['data'][0].get('price')
+        if price:
+            amount = (price.get('unit_amount') or 0) / 100
+            currency = (price.get('currency') or 'usd').upper()
+
+    return {
+        'customer_id': customer['id'],
+        'company_name': metadata.get('company_name', 'Unknown Company'),
+        'email': customer.get('email'),
+        'subscription_id': subscription.get('id'),
+        'status': map_subscription_status(subscription.get('status', '')),
+        'amount': amount,
+        'currency': currency,
+        'timestamp': timestamp or datetime.utcnow().strftime('%Y-%m-%d %H:%M:%S'),
+        'country': metadata.get('country', '')
+    }
+
+
+def run_backfill(sheets, subscriptions, checkpoint, chunk_size=1000, dry_run=False):
+    """
+    Write subscriptions to the sheet in chunks, checkpointing after each
+
+    The newest subscription of each customer wins; older ones are skipped.
+    Sheets quota is enforced by the service's QuotaLimiter, which waits
+    and retries rather than failing the run.
+
+    Args:
+        sheets: SheetsService to write through
+        subscriptions: Iterable of subscriptions, newest first
+        checkpoint: Checkpoint to resume from and update
+        chunk_size: Customers per batch write
+        dry_run: Build rows without writing or checkpointing
+
+    Returns:
+        Dict with 'updated', 'created' and 'skipped' counts
+    """
+    totals = {'updated': 0, 'created': 0, 'skipped': 0}
+    progress = {'customers': checkpoint.written}
+    chunk = []
+    last_id = None
+    started = time.monotonic()
+
+    def flush():
+        if not chunk:
+            return
+        if not dry_run:
+            results = sheets.upsert_customers(chunk)
+            for action in results.values():
+                totals[action] += 1
+            checkpoint.written += len(chunk)
+            checkpoint.save(last_id)
+        progress['customers'] += len(chunk)
+        elapsed = time.monotonic() - started
+        print(f"  {progress['customers']} customers {'read' if dry_run else 'written'} "
+              f"({elapsed:.0f}s, last subscription {last_id})")
+        chunk.clear()
+
+    for subscription in subscriptions:
+        last_id = subscription['id']
+        customer_data = subscription_to_customer_data(subscription)
+        if customer_data is None or customer_data['customer_id'] in checkpoint.seen:
+            totals['skipped'] += 1
+            continue
+        checkpoint.seen.add(customer_data['customer_id'])
+        chunk.append(customer_data)
+        if len(chunk) >= chunk_size:
+            flush()
+    flush()
+    return totals
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Import Stripe subscriptions into the Google Sheet')
+    parser.add_argument('--chunk-size', type=int, default=1000, help='Customers per batch write')
+    parser.add_argument('--include-canceled', action='store_true',
+                        help='Also import cancelled subscriptions')
+    parser.add_argument('--checkpoint', help=f'Progress file (default {DEFAULT_CHECKPOINT_PATH})')
+    parser.add_argument('--restart', action='store_true', help='Ignore any saved checkpoint')
+    parser.add_argument('--dry-run', action='store_true', help='Read Stripe but do not write')
+    args = parser.parse_args(argv)
+
+    load_dotenv()
+    stripe.api_key = os.getenv('STRIPE_API_KEY')
+    # Let stripe-python retry 429s and connection errors while paging
+    stripe.max_network_retries = 3
+
+    checkpoint = Checkpoint(args.checkpoint)
+    if args.restart:
+        checkpoint.clear()
+    else:
+        checkpoint.load()
+    if checkpoint.starting_after:
+        print(f"Resuming after {checkpoint.starting_after} "
+              f"({checkpoint.written} customers already written)")
+
+    print("="*60)
+    print("Stripe → Google Sheets Backfill")
+    print("="*60)
+
+    # A long run should wait out an exhausted quota rather than abort; with
+    # coordination it shares the quota and write locks of the web workers
+    sheets = None if args.dry_run else sheets_service_from_env(
+        max_wait=120, coordinator=coordinator_from_env()
+    )
+    subscriptions = iter_subscriptions(checkpoint.starting_after, args.include_canceled)
+    totals = run_backfill(sheets, subscriptions, checkpoint, args.chunk_size, args.dry_run)
+
+    if not args.dry_run:
+        checkpoint.clear()
+    print("="*60)
+    print(f"✅ Backfill complete: {totals['created']} created, {totals['updated']} updated, "
+          f"{totals['skipped']} older or deleted skipped")
+    print("="*60)
+    return totals
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,416 @@
+"""
+End-to-end load benchmark for the webhook server
+Runs the real Flask app against local Stripe and Google Sheets stand-ins
+(fake_apis.py) and replays a realistic event mix at a target rate.
+
+Usage:
+    python benchmark.py --events 2000 --rps 100 --stripe-latency-ms 80 --sheets-latency-ms 150
+    python benchmark.py --rate-limit-ratio 0.05 --json bench_output.json
+    python benchmark.py --asgi --concurrency 256   # asgi.py under uvicorn
+"""
+
+import os
+import io
+import sys
+import json
+import time
+import random
+import logging
+import argparse
+import tempfile
+import threading
+import contextlib
+from collections import Counter
+from datetime import datetime, timedelta
+from concurrent.futures import ThreadPoolExecutor
+
+import requests
+
+from fake_apis import FakeStripe, FakeSheets, FaultInjector, generate_stripe_signature
+from sinks import FanOutSink
+from sheet_schema import SHEET_HEADER
+
+# Fix Windows console encoding
+if sys.platform == 'win32':
+    sys.stdout.reconfigure(encoding='utf-8')  # type: ignore
+
+WEBHOOK_SECRET = 'whsec_benchmark'
+
+# Share of scenarios in the generated traffic (checkout bursts send 3 events)
+EVENT_MIX = {
+    'renewal': 0.55,          # invoice.payment_succeeded for an existing customer
+    'payment_failed': 0.05,   # invoice.payment_failed for an existing customer
+    'subscription_update': 0.10,
+    'checkout_burst': 0.10,   # checkout + subscription.created + invoice for a new customer
+    'ignored': 0.15,          # event types the app does not handle
+    'duplicate': 0.05,        # Stripe redelivering an event already sent
+}
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description='Webhook load benchmark with local API stand-ins')
+    parser.add_argument('--events', type=int, default=1000, help='Webhook requests to send')
+    parser.add_argument('--rps', type=float, default=50, help='Target requests per second')
+    parser.add_argument('--concurrency', type=int, default=32, help='Max requests in flight')
+    parser.add_argument('--customers', type=int, default=5000, help='Existing rows in the fake sheet')
+    parser.add_argument('--stripe-latency-ms', type=float, default=50)
+    parser.add_argument('--sheets-latency-ms', type=float, default=100)
+    parser.add_argument('--jitter-ms', type=float, default=20, help='Extra random latency per API call')
+    parser.add_argument('--rate-limit-ratio', type=float, default=0.0,
+                        help='Fraction of Sheets calls answered with HTTP 429')
+    parser.add_argument('--sheets-writes-per-minute', type=int, default=0,
+                        help='Client-side Sheets quota (0 = effectively unlimited)')
+    parser.add_argument('--queue', action='store_true', help='Run with EVENT_QUEUE_ENABLED=true')
+    parser.add_argument('--asgi', action='store_true', help='Serve asgi.py with uvicorn instead of Flask')
+    parser.add_argument('--sinks', default='sheets', help="CUSTOMER_SINKS, e.g. 'local,sheets'")
+    parser.add_argument('--payload-kb', type=float, default=4,
+                        help='Approximate event size; real Stripe events carry full nested objects')
+    parser.add_argument('--seed', type=int, default=42)
+    parser.add_argument('--json', dest='json_path', help='Also write the report to this file')
+    return parser.parse_args(argv)
+
+
+class EventGenerator:
+    """Builds signed Stripe-shaped payloads following EVENT_MIX"""
+
+    def __init__(self, existing_customers, rng, payload_kb=0):
+        self.existing = existing_customers
+        self.rng = rng
+        self.payload_kb = payload_kb
+        self.sent = []
+        self._sequence = 0
+        self._new_customers = 0
+
+    @staticmethod
+    def _line_item(n):
+        """One nested line/item object shaped like Stripe's (about 600 bytes)"""
+        return {
+            'id': f'il_bench_{n}', 'object': 'line_item', 'amount': 49900, 'currency': 'usd',
+            'description': 'Standard plan', 'discountable': True, 'livemode': False,
+            'metadata': {}, 'period': {'end': 1735689600, 'start': 1733011200},
+            'plan': {'id': 'plan_bench', 'object': 'plan', 'active': True, 'amount': 49900,
+                     'currency': 'usd', 'interval': 'month', 'interval_count': 1, 'product': 'prod_bench'},
+            'price': {'id': 'price_bench', 'object': 'price', 'active': True, 'currency': 'usd',
+                      'unit_amount': 49900, 'type': 'recurring',
+                      'recurring': {'interval': 'month', 'interval_count': 1, 'usage_type': 'licensed'}},
+            'proration': False, 'quantity': 1, 'type': 'subscription',
+        }
+
+    def _pad(self, obj):
+        """Grow an object toward --payload-kb with Stripe-like nested fields"""
+        obj.update({'object': 'object', 'livemode': False, 'metadata': {}})
+        extra = max(0, int(self.payload_kb * 1024 / 600) - 1)
+        if extra:
+            lines = [self._line_item(n) for n in range(extra)]
+            if 'items' in obj:
+                obj['items']['data'].extend(lines)  # handlers read data[0] only
+            else:
+                obj['lines'] = {'object': 'list', 'data': lines, 'has_more': False}
+        return obj
+
+    def _event(self, event_type, obj):
+        self._sequence += 1
+        event = {
+            'id': f'evt_bench_{self._sequence}',
+            'object': 'event',
+            'api_version': '2023-10-16',
+            'type': event_type,
+            'created': int(time.time()) + self._sequence,
+            'livemode': False,
+            'pending_webhooks': 1,
+            'request': {'id': None, 'idempotency_key': None},
+            'data': {'object': self._pad(obj)},
+        }
+        self.sent.append(event)
+        return event
+
+    def _existing(self):
+        return self.rng.choice(self.existing)
+
+    def scenario(self):
+        """Return the list of events for one randomly chosen scenario"""
+        name = self.rng.choices(list(EVENT_MIX), weights=list(EVENT_MIX.values()))[0]
+        if name == 'renewal':
+            return [self._event('invoice.payment_succeeded', {
+                'customer': self._existing(), 'subscription': 'sub_bench',
+                'amount_paid': 49900, 'currency': 'usd'})]
+        if name == 'payment_failed':
+            return [self._event('invoice.payment_failed', {
+                'customer': self._existing(), 'subscription': 'sub_bench',
+                'amount_paid': 0, 'currency': 'usd'})]
+        if name == 'subscription_update':
+            return [self._event('customer.subscription.updated', {
+                'id': 'sub_bench', 'customer': self._existing(),
+                'status': self.rng.choice(['active', 'past_due', 'trialing']),
+                'items': {'data': [{'price': {'unit_amount': 79900, 'currency': 'usd'}}]}})]
+        if name == 'checkout_burst':
+            self._new_customers += 1
+            customer_id = f'cus_benchnew{self._new_customers}'
+            return [
+                self._event('checkout.session.completed', {
+                    'customer': customer_id, 'subscription': 'sub_new',
+                    'amount_total': 99900, 'currency': 'usd'}),
+                self._event('customer.subscription.created', {
+                    'id': 'sub_new', 'customer': customer_id, 'status': 'active',
+                    'items': {'data': [{'price': {'unit_amount': 99900, 'currency': 'usd'}}]}}),
+                self._event('invoice.payment_succeeded', {
+                    'customer': customer_id, 'subscription': 'sub_new',
+                    'amount_paid': 99900, 'currency': 'usd'}),
+            ]
+        if name == 'ignored':
+            return [self._event(self.rng.choice(['charge.succeeded', 'payment_intent.created']), {
+                'customer': self._existing()})]
+        # duplicate: resend an earlier event unchanged
+        if self.sent:
+            return [self.rng.choice(self.sent)]
+        return self.scenario()
+
+    def take(self, count):
+        events = []
+        while len(events) < count:
+            events.extend(self.scenario())
+        return events[:count]
+
+
+def percentile(sorted_values, pct):
+    """Nearest-rank percentile of an already sorted list"""
+    if not sorted_values:
+        return 0.0
+    rank = max(1, int(round(pct / 100.0 * len(sorted_values))))
+    return sorted_values[min(rank, len(sorted_values)) - 1]
+
+
+def configure_environment(args, workdir):
+    """Point the app at throwaway state files before it is imported"""
+    os.environ['STRIPE_API_KEY'] = 'sk_test_benchmark'
+    os.environ['STRIPE_WEBHOOK_SECRET'] = WEBHOOK_SECRET
+    os.environ['GOOGLE_SHEET_ID'] = FakeSheets.SPREADSHEET_ID
+    os.environ['SHEETS_CONNECTION_CACHE'] = os.path.join(workdir, 'sheets_cache.json')
+    os.environ['PROCESSED_EVENTS_PATH'] = os.path.join(workdir, 'processed_events.db')
+    os.environ['EVENT_QUEUE_PATH'] = os.path.join(workdir, 'event_queue.db')
+    os.environ['CUSTOMER_STORE_PATH'] = os.path.join(workdir, 'customer_store.db')
+    os.environ['LOCAL_SINK_PATH'] = os.path.join(workdir, 'customer_records.db')
+    os.environ['DEAD_LETTERS_PATH'] = os.path.join(workdir, 'dead_letters.db')
+    os.environ['EVENT_ORDER_PATH'] = os.path.join(workdir, 'event_order.db')
+    os.environ['EVENT_QUEUE_ENABLED'] = 'true' if args.queue else 'false'
+    os.environ['CUSTOMER_SINKS'] = args.sinks
+    writes = args.sheets_writes_per_minute or 1000000
+    os.environ['SHEETS_WRITES_PER_MINUTE'] = str(writes)
+    os.environ['SHEETS_READS_PER_MINUTE'] = str(writes)
+    os.environ['SHEETS_QUOTA_BURST'] = str(min(writes, 1000))
+
+
+class _UvicornServer:
+    """uvicorn in a background thread, stopped like a werkzeug server"""
+
+    def __init__(self, asgi_app):
+        import uvicorn
+        self.server = uvicorn.Server(uvicorn.Config(
+            asgi_app, host='127.0.0.1', port=0, log_level='warning', lifespan='off',
+            backlog=1024, limit_concurrency=None
+        ))
+        self.thread = threading.Thread(target=self.server.run, daemon=True)
+        self.thread.start()
+        while not self.server.started:
+            time.sleep(0.01)
+        self.server_port = self.server.servers[0].sockets[0].getsockname()[1]
+
+    def shutdown(self):
+        self.server.should_exit = True
+        self.thread.join(timeout=10)
+
+
+def start_app(fake_sheets, fake_stripe, asgi=False):
+    """Import app.py (or asgi.py) wired to the stand-ins and serve it on a free port"""
+    import stripe
+    import sheets_service
+    from werkzeug.serving import make_server
+
+    # The only seam: authorize against the fake instead of credentials.json
+    sheets_service.SheetsService._authorize = lambda self: fake_sheets.gspread_client()
+
+    import app as webhook_app
+    stripe.api_base = fake_stripe.url
+    if not webhook_app.sheets_service.wait_until_ready(timeout=30):
+        raise RuntimeError(f'Sheets backend never became ready: {webhook_app.sheets_service.last_error}')
+
+    if asgi:
+        import asgi as asgi_app
+        server = _UvicornServer(asgi_app.app)
+    else:
+        logging.getLogger('werkzeug').setLevel(logging.WARNING)
+        server = make_server('127.0.0.1', 0, webhook_app.app, threaded=True)
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+    return webhook_app, server, f'http://127.0.0.1:{server.server_port}/webhook'
+
+
+def run_load(url, events, rps, concurrency):
+    """Open-loop sender: request i is started at i / rps seconds"""
+    local = threading.local()
+    latencies = []
+    outcomes = Counter()
+    lock = threading.Lock()
+
+    def send(event, scheduled_at):
+        delay = scheduled_at - time.perf_counter()
+        if delay > 0:
+            time.sleep(delay)
+        session = getattr(local, 'session', None)
+        if session is None:
+            session = local.session = requests.Session()
+
+        payload = json.dumps(event)
+        headers = {
+            'Content-Type': 'application/json',
+            'Stripe-Signature': generate_stripe_signature(payload, WEBHOOK_SECRET),
+        }
+        started = time.perf_counter()
+        try:
+            response = session.post(url, data=payload, headers=headers, timeout=60)
+            outcome = response.status_code
+        except requests.RequestException as e:
+            outcome = type(e).__name__
+        elapsed = time.perf_counter() - started
+        with lock:
+            latencies.append(elapsed)
+            outcomes[outcome] += 1
+
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        for i, event in enumerate(events):
+            pool.submit(send, event, start + i / rps)
+    duration = time.perf_counter() - start
+    return sorted(latencies), outcomes, duration
+
+
+def wait_for_queue(webhook_app, timeout=300):
+    """
+    Wait until background work is done: queued events (queue mode) and
+    changes not yet copied to the sheet (local sink mode)
+    """
+    fan_out = webhook_app.customer_sink if isinstance(webhook_app.customer_sink, FanOutSink) else None
+    if webhook_app.event_queue is None and fan_out is None:
+        return 0.0
+    start = time.perf_counter()
+    while time.perf_counter() - start < timeout:
+        depth = webhook_app.event_queue.depth() if webhook_app.event_queue is not None else {}
+        backlog = fan_out.local.backlog() if fan_out is not None else {}
+        if not depth.get('pending') and not depth.get('processing') and not any(backlog.values()):
+            break
+        time.sleep(0.1)
+    return time.perf_counter() - start
+
+
+def build_report(args, latencies, outcomes, duration, drain_time, cpu_seconds, fake_stripe, fake_sheets,
+                 update_stats=None):
+    total = sum(outcomes.values())
+    errors = sum(count for outcome, count in outcomes.items()
+                 if not (isinstance(outcome, int) and 200 <= outcome < 300))
+    stripe_calls = fake_stripe.counts['customer_retrieve']
+    sheets_reads = fake_sheets.counts['read'] + fake_sheets.counts['metadata']
+    sheets_writes = fake_sheets.counts['write']
+    return {
+        'config': vars(args),
+        'events': total,
+        'duration_s': round(duration, 3),
+        'queue_drain_s': round(drain_time, 3),
+        'achieved_rps': round(total / duration, 2) if duration else 0.0,
+        # Whole process: app, load generator and the fake APIs
+        'cpu_ms_per_event': round(cpu_seconds * 1000 / total, 3) if total else 0.0,
+        'latency_ms': {
+            'p50': round(percentile(latencies, 50) * 1000, 2),
+            'p95': round(percentile(latencies, 95) * 1000, 2),
+            'p99': round(percentile(latencies, 99) * 1000, 2),
+            'max': round(latencies[-1] * 1000, 2) if latencies else 0.0,
+        },
+        'error_rate': round(errors / total, 4) if total else 0.0,
+        'status_codes': {str(k): v for k, v in sorted(outcomes.items(), key=lambda kv: str(kv[0]))},
+        'api_calls': {
+            'stripe_customer_retrieve': stripe_calls,
+            'sheets_reads': sheets_reads,
+            'sheets_writes': sheets_writes,
+            'sheets_429s': fake_sheets.counts['rate_limited'],
+        },
+        'api_calls_per_event': {
+            'stripe': round(stripe_calls / total, 3) if total else 0.0,
+            'sheets_reads': round(sheets_reads / total, 3) if total else 0.0,
+            'sheets_writes': round(sheets_writes / total, 3) if total else 0.0,
+        },
+        # Updates to existing rows: written, timestamp_only, unchanged (skipped)
+        'row_updates': update_stats or {},
+    }
+
+
+def print_report(report):
+    print("\n" + "="*60)
+    print("Webhook Benchmark Results")
+    print("="*60)
+    print(f"Events sent:      {report['events']} in {report['duration_s']}s "
+          f"({report['achieved_rps']} req/s)")
+    if report['config']['queue'] or report['config']['sinks'] != 'sheets':
+        print(f"Queue drained in: {report['queue_drain_s']}s after the last request")
+    print(f"CPU per event:    {report['cpu_ms_per_event']}ms (app + fakes + load generator)")
+    latency = report['latency_ms']
+    print(f"Latency (ms):     p50={latency['p50']}  p95={latency['p95']}  "
+          f"p99={latency['p99']}  max={latency['max']}")
+    print(f"Error rate:       {report['error_rate'] * 100:.2f}%  {report['status_codes']}")
+    calls = report['api_calls']
+    per_event = report['api_calls_per_event']
+    print(f"Stripe calls:     {calls['stripe_customer_retrieve']} ({per_event['stripe']}/event)")
+    print(f"Sheets reads:     {calls['sheets_reads']} ({per_event['sheets_reads']}/event)")
+    print(f"Sheets writes:    {calls['sheets_writes']} ({per_event['sheets_writes']}/event)")
+    print(f"Sheets 429s:      {calls['sheets_429s']}")
+    updates = report['row_updates']
+    if updates:
+        print(f"Row updates:      {updates['written']} written, {updates['timestamp_only']} timestamp only, "
+              f"{updates['unchanged']} skipped ({updates['skip_ratio'] * 100:.1f}% unchanged)")
+    print("="*60)
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    rng = random.Random(args.seed)
+    random.seed(args.seed)
+    workdir = tempfile.mkdtemp(prefix='webhook-bench-')
+    configure_environment(args, workdir)
+
+    existing = [f'cus_bench{i}' for i in range(args.customers)]
+    # Rows last touched a few hours ago, as for customers with regular renewals
+    last_updated = (datetime.utcnow() - timedelta(hours=3)).strftime('%Y-%m-%d %H:%M:%S')
+    rows = [SHEET_HEADER] + [
+        [cid, f'Company {cid}', 'billing', f'billing@{cid}.example', 'Active',
+         'Standard ($499)', 'TRUE', last_updated, 'USD', 'US']
+        for cid in existing
+    ]
+    fake_stripe = FakeStripe(FaultInjector(args.stripe_latency_ms, args.jitter_ms)).start()
+    fake_sheets = FakeSheets(rows, FaultInjector(
+        args.sheets_latency_ms, args.jitter_ms, rate_limit_ratio=args.rate_limit_ratio
+    )).start()
+
+    print(f"Fake Stripe at {fake_stripe.url}, fake Sheets at {fake_sheets.url} "
+          f"({args.customers} existing rows)")
+
+    # Per-row prints from SheetsService would dominate the run; keep them out
+    with contextlib.redirect_stdout(io.StringIO()):
+        webhook_app, server, url = start_app(fake_sheets, fake_stripe, asgi=args.asgi)
+        fake_stripe.reset_counts()
+        fake_sheets.reset_counts()
+        events = EventGenerator(existing, rng, args.payload_kb).take(args.events)
+        cpu_started = time.process_time()
+        latencies, outcomes, duration = run_load(url, events, args.rps, args.concurrency)
+        drain_time = wait_for_queue(webhook_app)
+        cpu_seconds = time.process_time() - cpu_started
+
+    server.shutdown()
+    report = build_report(args, latencies, outcomes, duration, drain_time, cpu_seconds, fake_stripe, fake_sheets,
+                          webhook_app.sheets_service.update_stats())
+    print_report(report)
+
+    if args.json_path:
+        with open(args.json_path, 'w') as f:
+            json.dump(report, f, indent=2)
+        print(f"Report written to {args.json_path}")
+    return report
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,146 @@
+import os
+import time
+import logging
+import threading
+import itertools
+from concurrent.futures import Future
+
+
+logger = logging.getLogger(__name__)
+
+
+class _PendingCustomer:
+    """Events for one customer waiting for the window to close"""
+
+    def __init__(self, deadline):
+        self.deadline = deadline
+        self.events = []  # (created, sequence, customer_data)
+        self.futures = []  # one per submitted event
+
+
+class EventCoalescer:
+    """
+    Collect writes per customer over a short window and emit one merged write
+
+    Request threads block in submit() until the merged write for their
+    customer has been applied, so errors still reach the webhook (500 ->
+    Stripe retry). Queue workers use submit_async() instead and settle the
+    event when the returned future resolves, so one worker can feed a whole
+    window instead of sleeping through it. Every customer whose window
+    closed at the same time is flushed in one write_many call.
+    """
+
+    def __init__(self, write_many, window=None):
+        """
+        Args:
+            write_many: Callable taking a list of customer_data dicts and
+                returning {customer_id: result} (e.g. SheetsService.upsert_customers)
+            window: Seconds to collect events per customer (defaults to
+                COALESCE_WINDOW_SECONDS)
+        """
+        self.write_many = write_many
+        self.window = window if window is not None else float(os.getenv('COALESCE_WINDOW_SECONDS', '2'))
+        self._pending = {}
+        self._lock = threading.Condition()
+        self._sequence = itertools.count()
+        self._thread = None
+        self.events_received = 0
+        self.writes_emitted = 0
+
+    def submit(self, customer_data, created=None):
+        """
+        Add an event's row state and wait for the merged write
+
+        Args:
+            customer_data: Dictionary as passed to upsert_customer
+            created: Stripe event.created (Unix seconds) used for ordering
+
+        Returns:
+            The write result for this customer ('created' / 'updated' / 'unchanged')
+        """
+        return self.submit_async(customer_data, created).result()
+
+    def submit_async(self, customer_data, created=None):
+        """
+        Add an event's row state without waiting for the window to close
+
+        Args:
+            customer_data: Dictionary as passed to upsert_customer
+            created: Stripe event.created (Unix seconds) used for ordering
+
+        Returns:
+            concurrent.futures.Future resolved with the write result, or with
+            the write's exception, once the merged write has been attempted
+        """
+        key = str(customer_data['customer_id']).strip().lower()
+        future = Future()
+        with self._lock:
+            self._ensure_thread()
+            pending = self._pending.get(key)
+            if pending is None:
+                pending = self._pending[key] = _PendingCustomer(time.monotonic() + self.window)
+                self._lock.notify()
+            pending.events.append((created or 0, next(self._sequence), customer_data))
+            pending.futures.append(future)
+            self.events_received += 1
+        return future
+
+    @staticmethod
+    def merge(events):
+        """
+        Fold events into the final row state, oldest event.created first
+
+        Later events override earlier ones field by field; missing values
+        (None) never erase something an earlier event provided.
+        """
+        merged = {}
+        for _, _, customer_data in sorted(events, key=lambda e: (e[0], e[1])):
+            for field, value in customer_data.items():
+                if value is not None:
+                    merged[field] = value
+        return merged
+
+    def _ensure_thread(self):
+        if self._thread is None or not self._thread.is_alive():
+            self._thread = threading.Thread(target=self._run, name='event-coalescer', daemon=True)
+            self._thread.start()
+
+    def _take_due(self):
+        """Wait until at least one window closes, then detach all due customers"""
+        with self._lock:
+            while True:
+                now = time.monotonic()
+                due = [k for k, p in self._pending.items() if p.deadline <= now]
+                if due:
+                    return [self._pending.pop(k) for k in due]
+                if self._pending:
+                    timeout = min(p.deadline for p in self._pending.values()) - now
+                else:
+                    timeout = None
+                self._lock.wait(timeout)
+
+    def _run(self):
+        while True:
+            batch = self._take_due()
+            merged = [self.merge(p.events) for p in batch]
+            try:
+                results = self.write_many(merged)
+            except Exception as e:
+                logger.error(f'Coalesced write of {len(batch)} customers failed: {e}')
+                for pending in batch:
+                    for future in pending.futures:
+                        future.set_exception(e)
+                continue
+            self.writes_emitted += len(merged)
+            for pending, customer_data in zip(batch, merged):
+                result = results.get(customer_data['customer_id'])
+                for future in pending.futures:
+                    future.set_result(result)
+
+    def stats(self):
+        """Events received vs. rows written"""
+        return {
+            'events': self.events_received,
+            'writes': self.writes_emitted,
+            'pending_customers': len(self._pending),
+        }
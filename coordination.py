@@ -0,0 +1,359 @@
+import os
+import time
+import uuid
+import socket
+import sqlite3
+import logging
+import importlib
+import threading
+from abc import ABC, abstractmethod
+from contextlib import contextmanager
+
+
+logger = logging.getLogger(__name__)
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS leases (
+    lease_key TEXT PRIMARY KEY,
+    token TEXT NOT NULL,
+    expires_at REAL NOT NULL
+);
+CREATE TABLE IF NOT EXISTS sheet_rows (
+    scope TEXT NOT NULL,
+    customer_key TEXT NOT NULL,
+    row_number INTEGER NOT NULL,
+    updated_at REAL NOT NULL,
+    PRIMARY KEY (scope, customer_key)
+);
+CREATE TABLE IF NOT EXISTS index_meta (
+    name TEXT PRIMARY KEY,
+    value REAL NOT NULL
+);
+"""
+
+# SQLite's default limit on bound parameters is 999
+_SQL_CHUNK = 500
+
+# Server processes sharing this host (gunicorn and uvicorn both read it)
+WORKER_PROCESSES = int(os.getenv('WEB_CONCURRENCY', '1'))
+
+
+class LockTimeoutError(Exception):
+    """Raised when customer write locks could not be taken in time"""
+
+
+class Coordinator(ABC):
+    """
+    Per-customer write leases and a shared customer -> row index
+
+    Lets several processes (or hosts) write to one sheet without two of
+    them appending a row for the same new customer. Backends implement
+    try_acquire/release and the row index methods; a backend for another
+    store (Redis, a database) can be plugged in with SHEETS_COORDINATION.
+
+    Row indexes are kept per `scope` (the worksheet title when customers
+    are sharded across worksheets; '' for the single default sheet).
+    """
+
+    def __init__(self, lease_ttl=None, lock_timeout=None):
+        """
+        Args:
+            lease_ttl: Seconds before a lease held by a crashed process
+                expires (SHEETS_LOCK_TTL); live holders renew theirs
+            lock_timeout: Seconds to wait for a lease (SHEETS_LOCK_TIMEOUT)
+        """
+        self.lease_ttl = lease_ttl or float(os.getenv('SHEETS_LOCK_TTL', '60'))
+        self.lock_timeout = lock_timeout or float(os.getenv('SHEETS_LOCK_TIMEOUT', '15'))
+        self.owner = f'{socket.gethostname()}:{os.getpid()}'
+        self._held = {}  # token -> keys of the leases this process holds
+        self._held_lock = threading.Lock()
+        self._renewer = None
+
+    # --- backend primitives -------------------------------------------------
+
+    @abstractmethod
+    def try_acquire(self, keys, token, ttl):
+        """Take leases on every key, or none of them; True on success"""
+
+    @abstractmethod
+    def release(self, keys, token):
+        """Drop the leases on `keys` held under `token`"""
+
+    @abstractmethod
+    def get_rows(self, keys, max_age, scope=''):
+        """Shared row numbers for `keys` written within `max_age` seconds"""
+
+    @abstractmethod
+    def set_rows(self, rows, replace=False, scope=''):
+        """
+        Publish customer -> row numbers
+
+        Args:
+            rows: Dict of normalized customer ID -> row number
+            replace: True when `rows` is a full index from a Column A read
+            scope: Worksheet the rows belong to ('' for the default sheet)
+        """
+
+    @abstractmethod
+    def load_index(self, max_age, scope=''):
+        """The full shared index if it was rebuilt within `max_age`, else None"""
+
+    @abstractmethod
+    def clear_rows(self, scope=''):
+        """Forget the shared index (rows may have moved)"""
+
+    # --- shared logic -----------------------------------------------------
+
+    @contextmanager
+    def lock(self, keys):
+        """
+        Hold write leases on several customers at once
+
+        All keys are taken together or not at all, so two processes
+        locking overlapping batches cannot deadlock. While the block runs
+        (possibly for minutes, waiting out quota or Sheets backoff) the
+        leases are renewed every third of lease_ttl, so they only expire
+        when the holder has crashed.
+
+        Raises:
+            LockTimeoutError: leases not available within lock_timeout
+        """
+        keys = sorted(set(keys))
+        if not keys:
+            yield
+            return
+
+        token = f'{self.owner}:{uuid.uuid4().hex}'
+        deadline = time.monotonic() + self.lock_timeout
+        delay = 0.005
+        while not self.try_acquire(keys, token, self.lease_ttl):
+            if time.monotonic() >= deadline:
+                raise LockTimeoutError(f'Timed out waiting for write lock on {len(keys)} customer(s)')
+            time.sleep(delay)
+            delay = min(delay * 2, 0.1)
+        with self._held_lock:
+            self._held[token] = keys
+            if self._renewer is None or not self._renewer.is_alive():
+                self._renewer = threading.Thread(target=self._renew_leases, name='lease-renewer', daemon=True)
+                self._renewer.start()
+        try:
+            yield
+        finally:
+            with self._held_lock:
+                del self._held[token]
+            self.release(keys, token)
+
+    def _renew_leases(self):
+        """Extend the leases of running lock() blocks; exits once none are held"""
+        while True:
+            time.sleep(self.lease_ttl / 3)
+            # Under the lock, so a block that just exited is not renewed
+            # again after its release
+            with self._held_lock:
+                if not self._held:
+                    self._renewer = None
+                    return
+                for token, keys in self._held.items():
+                    try:
+                        if not self.try_acquire(keys, token, self.lease_ttl):
+                            logger.error(f'Write lease on {len(keys)} customer(s) expired and was taken over')
+                    except Exception as e:
+                        logger.error(f'Could not renew write leases: {e}')
+
+
+class MemoryCoordinator(Coordinator):
+    """In-process stand-in for a shared backend (tests, single worker)"""
+
+    def __init__(self, lease_ttl=None, lock_timeout=None):
+        super().__init__(lease_ttl, lock_timeout)
+        self._leases = {}
+        self._rows = {}              # scope -> {key: (row_number, updated_at)}
+        self._index_loaded_at = {}   # scope -> time of the last full index
+        self._lock = threading.Lock()
+
+    def try_acquire(self, keys, token, ttl):
+        now = time.time()
+        with self._lock:
+            for key in keys:
+                held = self._leases.get(key)
+                if held and held[0] != token and held[1] > now:
+                    return False
+            for key in keys:
+                self._leases[key] = (token, now + ttl)
+            return True
+
+    def release(self, keys, token):
+        with self._lock:
+            for key in keys:
+                if self._leases.get(key, (None,))[0] == token:
+                    del self._leases[key]
+
+    def get_rows(self, keys, max_age, scope=''):
+        cutoff = time.time() - max_age
+        with self._lock:
+            scoped = self._rows.get(scope, {})
+            return {key: scoped[key][0] for key in keys
+                    if key in scoped and scoped[key][1] >= cutoff}
+
+    def set_rows(self, rows, replace=False, scope=''):
+        now = time.time()
+        with self._lock:
+            if replace:
+                self._rows[scope] = {}
+                self._index_loaded_at[scope] = now
+            scoped = self._rows.setdefault(scope, {})
+            for key, row_number in rows.items():
+                scoped[key] = (row_number, now)
+
+    def load_index(self, max_age, scope=''):
+        with self._lock:
+            loaded_at = self._index_loaded_at.get(scope)
+            if loaded_at is None or time.time() - loaded_at > max_age:
+                return None
+            return {key: entry[0] for key, entry in self._rows.get(scope, {}).items()}
+
+    def clear_rows(self, scope=''):
+        with self._lock:
+            self._rows.pop(scope, None)
+            self._index_loaded_at.pop(scope, None)
+
+
+class SQLiteCoordinator(Coordinator):
+    """Coordinator for every worker process on one host, backed by a SQLite file"""
+
+    def __init__(self, path=None, lease_ttl=None, lock_timeout=None):
+        """
+        Args:
+            path: SQLite file path (defaults to SHEETS_COORDINATION_PATH)
+        """
+        super().__init__(lease_ttl, lock_timeout)
+        self.path = path or os.getenv('SHEETS_COORDINATION_PATH', 'sheets_coordination.db')
+        self._local = threading.local()
+        self._conn().executescript(SCHEMA)
+
+    def _conn(self):
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=30, isolation_level=None)
+            conn.execute('PRAGMA journal_mode=WAL')
+            conn.execute('PRAGMA synchronous=NORMAL')
+            self._local.conn = conn
+        return conn
+
+    @staticmethod
+    def _chunks(keys):
+        for start in range(0, len(keys), _SQL_CHUNK):
+            yield keys[start:start + _SQL_CHUNK]
+
+    def try_acquire(self, keys, token, ttl):
+        conn = self._conn()
+        now = time.time()
+        conn.execute('BEGIN IMMEDIATE')
+        try:
+            for chunk in self._chunks(keys):
+                marks = ','.join('?' * len(chunk))
+                held = conn.execute(
+                    f'SELECT 1 FROM leases WHERE lease_key IN ({marks}) '
+                    f'AND token != ? AND expires_at > ? LIMIT 1',
+                    (*chunk, token, now)
+                ).fetchone()
+                if held:
+                    conn.execute('COMMIT')
+                    return False
+            conn.executemany(
+                'INSERT OR REPLACE INTO leases (lease_key, token, expires_at) VALUES (?, ?, ?)',
+                [(key, token, now + ttl) for key in keys]
+            )
+            conn.execute('COMMIT')
+            return True
+        except Exception:
+            conn.execute('ROLLBACK')
+            raise
+
+    def release(self, keys, token):
+        conn = self._conn()
+        for chunk in self._chunks(list(keys)):
+            marks = ','.join('?' * len(chunk))
+            conn.execute(
+                f'DELETE FROM leases WHERE lease_key IN ({marks}) AND token = ?',
+                (*chunk, token)
+            )
+
+    def get_rows(self, keys, max_age, scope=''):
+        conn = self._conn()
+        cutoff = time.time() - max_age
+        rows = {}
+        for chunk in self._chunks(list(keys)):
+            marks = ','.join('?' * len(chunk))
+            rows.update(conn.execute(
+                f'SELECT customer_key, row_number FROM sheet_rows '
+                f'WHERE scope = ? AND customer_key IN ({marks}) AND updated_at >= ?',
+                (scope, *chunk, cutoff)
+            ).fetchall())
+        return rows
+
+    def set_rows(self, rows, replace=False, scope=''):
+        conn = self._conn()
+        now = time.time()
+        conn.execute('BEGIN IMMEDIATE')
+        try:
+            if replace:
+                conn.execute('DELETE FROM sheet_rows WHERE scope = ?', (scope,))
+                conn.execute(
+                    'INSERT OR REPLACE INTO index_meta (name, value) VALUES (?, ?)',
+                    (f'loaded_at:{scope}', now)
+                )
+            conn.executemany(
+                'INSERT OR REPLACE INTO sheet_rows (scope, customer_key, row_number, updated_at) '
+                'VALUES (?, ?, ?, ?)',
+                [(scope, key, row_number, now) for key, row_number in rows.items()]
+            )
+            conn.execute('COMMIT')
+        except Exception:
+            conn.execute('ROLLBACK')
+            raise
+
+    def load_index(self, max_age, scope=''):
+        conn = self._conn()
+        row = conn.execute(
+            'SELECT value FROM index_meta WHERE name = ?', (f'loaded_at:{scope}',)
+        ).fetchone()
+        if row is None or time.time() - row[0] > max_age:
+            return None
+        return dict(conn.execute(
+            'SELECT customer_key, row_number FROM sheet_rows WHERE scope = ?', (scope,)
+        ).fetchall())
+
+    def clear_rows(self, scope=''):
+        conn = self._conn()
+        conn.execute('BEGIN IMMEDIATE')
+        try:
+            conn.execute('DELETE FROM sheet_rows WHERE scope = ?', (scope,))
+            conn.execute('DELETE FROM index_meta WHERE name = ?', (f'loaded_at:{scope}',))
+            conn.execute('COMMIT')
+        except Exception:
+            conn.execute('ROLLBACK')
+            raise
+
+
+def coordinator_from_env():
+    """
+    Build the coordinator selected by SHEETS_COORDINATION
+
+    'none', 'sqlite', 'memory', or 'package.module:ClassName' for a
+    custom Coordinator subclass. Defaults to 'sqlite' when
+    WEB_CONCURRENCY starts more than one process, else 'none'.
+
+    Returns:
+        Coordinator or None
+    """
+    default = 'sqlite' if WORKER_PROCESSES > 1 else 'none'
+    backend = (os.getenv('SHEETS_COORDINATION') or default).strip()
+    if backend == 'none':
+        return None
+    if backend == 'sqlite':
+        return SQLiteCoordinator()
+    if backend == 'memory':
+        return MemoryCoordinator()
+    module_name, _, class_name = backend.partition(':')
+    return getattr(importlib.import_module(module_name), class_name)()
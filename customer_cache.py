@@ -0,0 +1,112 @@
+import os
+import time
+import threading
+from collections import OrderedDict
+
+
+class _Flight:
+    """A fetch in progress that concurrent callers can wait on"""
+
+    def __init__(self):
+        self.done = threading.Event()
+        self.result = None
+        self.error = None
+
+
+class CustomerCache:
+    """Bounded TTL + LRU cache for Stripe customer lookups with single-flight misses"""
+
+    def __init__(self, fetch, max_size=None, ttl=None):
+        """
+        Args:
+            fetch: Callable taking a customer ID (e.g. stripe.Customer.retrieve)
+            max_size: Max cached customers (defaults to STRIPE_CUSTOMER_CACHE_SIZE)
+            ttl: Seconds an entry stays fresh (defaults to STRIPE_CUSTOMER_CACHE_TTL);
+                0 disables caching but still collapses concurrent misses
+        """
+        self.fetch = fetch
+        self.max_size = max_size if max_size is not None else int(
+            os.getenv('STRIPE_CUSTOMER_CACHE_SIZE', '1024')
+        )
+        self.ttl = ttl if ttl is not None else int(os.getenv('STRIPE_CUSTOMER_CACHE_TTL', '300'))
+        self._entries = OrderedDict()  # customer_id -> (expires_at, customer)
+        self._inflight = {}            # customer_id -> _Flight
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, customer_id):
+        """
+        Return the customer, fetching it at most once across concurrent callers
+
+        Args:
+            customer_id: Stripe Customer ID
+
+        Returns:
+            Customer object as returned by `fetch`
+        """
+        with self._lock:
+            entry = self._entries.get(customer_id)
+            if entry is not None:
+                if entry[0] > time.monotonic():
+                    self._entries.move_to_end(customer_id)
+                    self.hits += 1
+                    return entry[1]
+                del self._entries[customer_id]
+
+            self.misses += 1
+            flight = self._inflight.get(customer_id)
+            leader = flight is None
+            if leader:
+                flight = self._inflight[customer_id] = _Flight()
+
+        if not leader:
+            flight.done.wait()
+            if flight.error is not None:
+                raise flight.error
+            return flight.result
+
+        try:
+            flight.result = self.fetch(customer_id)
+        except Exception as e:
+            flight.error = e
+            raise
+        finally:
+            with self._lock:
+                # An invalidate() during the fetch detaches the flight; don't cache then
+                if self._inflight.get(customer_id) is flight:
+                    del self._inflight[customer_id]
+                    if flight.error is None and self.ttl > 0 and self.max_size > 0:
+                        self._store(customer_id, flight.result)
+            flight.done.set()
+
+        return flight.result
+
+    def _store(self, customer_id, customer):
+        self._entries[customer_id] = (time.monotonic() + self.ttl, customer)
+        self._entries.move_to_end(customer_id)
+        while len(self._entries) > self.max_size:
+            self._entries.popitem(last=False)
+
+    def invalidate(self, customer_id):
+        """Forget a customer (e.g. after customer.updated / customer.deleted)"""
+        with self._lock:
+            self._entries.pop(customer_id, None)
+            self._inflight.pop(customer_id, None)
+
+    def clear(self):
+        """Forget every cached customer"""
+        with self._lock:
+            self._entries.clear()
+            self._inflight.clear()
+
+    def stats(self):
+        """Hit/miss counters and current size"""
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                'size': len(self._entries),
+                'hits': self.hits,
+                'misses': self.misses,
+                'hit_ratio': round(self.hits / lookups, 4) if lookups else 0.0,
+            }
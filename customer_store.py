@@ -0,0 +1,185 @@
+"""
+Local projection of the Stripe customer fields the sheet needs
+Fed by customer.* webhooks plus a one-time warm-up:
+
+    python customer_store.py --warm-up
+"""
+
+import os
+import sys
+import json
+import time
+import sqlite3
+import argparse
+import threading
+from collections import namedtuple
+
+import stripe
+from dotenv import load_dotenv
+
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS customers (
+    customer_id TEXT PRIMARY KEY,
+    email TEXT,
+    metadata TEXT NOT NULL,
+    deleted INTEGER NOT NULL DEFAULT 0,
+    version REAL NOT NULL,
+    updated_at REAL NOT NULL
+);
+"""
+
+# Same attributes the handlers read from a stripe.Customer
+StoredCustomer = namedtuple('StoredCustomer', 'id email metadata deleted')
+
+
+class CustomerProjectionStore:
+    """
+    SQLite table of customer ID -> email and metadata
+
+    Shared by all workers on the host and kept across restarts, so the
+    webhook hot path only calls Stripe for customers it has never seen.
+    Each write carries a version (the event's `created` time) and older
+    versions never overwrite newer ones, so out-of-order deliveries of
+    customer.updated are harmless.
+    """
+
+    def __init__(self, path=None):
+        """
+        Args:
+            path: SQLite file path (defaults to CUSTOMER_STORE_PATH)
+        """
+        self.path = path or os.getenv('CUSTOMER_STORE_PATH', 'customer_store.db')
+        self._local = threading.local()
+        self._conn().executescript(SCHEMA)
+
+    def _conn(self):
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=30, isolation_level=None)
+            conn.execute('PRAGMA journal_mode=WAL')
+            conn.execute('PRAGMA synchronous=NORMAL')
+            self._local.conn = conn
+        return conn
+
+    @staticmethod
+    def _row(customer, version, deleted):
+        metadata = customer.get('metadata') or {}
+        return (
+            customer['id'],
+            customer.get('email'),
+            json.dumps(dict(metadata)),
+            1 if deleted or customer.get('deleted') else 0,
+            version,
+            time.time(),
+        )
+
+    def get(self, customer_id):
+        """
+        Look up a projected customer
+
+        Deleted customers keep their last known details, so late invoice
+        events for them still get a company name.
+
+        Returns:
+            StoredCustomer, or None if this customer was never seen
+        """
+        row = self._conn().execute(
+            'SELECT customer_id, email, metadata, deleted FROM customers WHERE customer_id = ?',
+            (customer_id,)
+        ).fetchone()
+        if row is None:
+            return None
+        return StoredCustomer(row[0], row[1], json.loads(row[2]), bool(row[3]))
+
+    def upsert(self, customer, version=None, deleted=False):
+        """
+        Store a customer object (from a webhook or the Stripe API)
+
+        Args:
+            customer: stripe.Customer or dict with id, email and metadata
+            version: Event `created` timestamp; API reads use 0 so they never
+                overwrite webhook data and any webhook supersedes them
+            deleted: Mark the customer as deleted (customer.deleted)
+
+        Returns:
+            True if stored, False if a newer version was already present
+        """
+        return self.upsert_many([customer], version, deleted) == 1
+
+    def upsert_many(self, customers, version=None, deleted=False):
+        """
+        Store many customers in one transaction
+
+        Returns:
+            Number of customers written
+        """
+        version = version or 0
+        rows = [self._row(customer, version, deleted) for customer in customers]
+        if not rows:
+            return 0
+        conn = self._conn()
+        conn.execute('BEGIN IMMEDIATE')
+        try:
+            before = conn.total_changes
+            conn.executemany(
+                'INSERT INTO customers (customer_id, email, metadata, deleted, version, updated_at) '
+                'VALUES (?, ?, ?, ?, ?, ?) '
+                'ON CONFLICT (customer_id) DO UPDATE SET '
+                'email = excluded.email, metadata = excluded.metadata, deleted = excluded.deleted, '
+                'version = excluded.version, updated_at = excluded.updated_at '
+                'WHERE excluded.version >= customers.version',
+                rows
+            )
+            written = conn.total_changes - before
+            conn.execute('COMMIT')
+        except Exception:
+            conn.execute('ROLLBACK')
+            raise
+        return written
+
+    def count(self):
+        """Number of customers in the projection"""
+        return self._conn().execute('SELECT COUNT(*) FROM customers').fetchone()[0]
+
+    def warm_up(self, customers, batch_size=100):
+        """
+        Load every customer from an iterable (e.g. Stripe auto-pagination)
+
+        Customers already written by a webhook (possibly while the
+        warm-up ran) are left as they are.
+
+        Returns:
+            Number of customers written
+        """
+        written = 0
+        batch = []
+        for customer in customers:
+            batch.append(customer)
+            if len(batch) >= batch_size:
+                written += self.upsert_many(batch)
+                batch = []
+        written += self.upsert_many(batch)
+        return written
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Manage the local Stripe customer projection')
+    parser.add_argument('--warm-up', action='store_true', help='Load every customer from Stripe')
+    args = parser.parse_args(argv)
+
+    # Fix Windows console encoding
+    if sys.platform == 'win32':
+        sys.stdout.reconfigure(encoding='utf-8')  # type: ignore
+    load_dotenv()
+    store = CustomerProjectionStore()
+    if args.warm_up:
+        stripe.api_key = os.getenv('STRIPE_API_KEY')
+        stripe.max_network_retries = 3
+        written = store.warm_up(stripe.Customer.list(limit=100).auto_paging_iter())
+        print(f"✅ Loaded {written} customers into {store.path}")
+    print(f"{store.count()} customers in the projection")
+
+
+if __name__ == "__main__":
+    main()
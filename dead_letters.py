@@ -0,0 +1,120 @@
+"""
+Dead-letter store: webhook events whose processing failed
+
+Every failed event is kept with its raw payload, last error and number of
+failed attempts, so replay.py can catch up right after an outage instead
+of waiting on Stripe's retry schedule (which backs off for up to three
+days). Repeat failures of the same event ID update one entry.
+"""
+
+import os
+import time
+import sqlite3
+import threading
+
+from event_order import event_customer_id
+
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS dead_letters (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    event_id TEXT UNIQUE,
+    event_type TEXT,
+    customer_id TEXT,
+    event_created INTEGER,
+    payload TEXT NOT NULL,
+    error TEXT,
+    attempts INTEGER NOT NULL,
+    first_failed_at REAL NOT NULL,
+    last_failed_at REAL NOT NULL
+);
+"""
+
+_COLUMNS = ('id', 'event_id', 'event_type', 'customer_id', 'event_created',
+            'payload', 'error', 'attempts', 'first_failed_at', 'last_failed_at')
+
+
+class DeadLetterStore:
+    """Failed webhook events waiting for replay (SQLite in WAL mode)"""
+
+    def __init__(self, path=None):
+        """
+        Args:
+            path: SQLite file path (defaults to DEAD_LETTERS_PATH)
+        """
+        self.path = path or os.getenv('DEAD_LETTERS_PATH', 'dead_letters.db')
+        self._local = threading.local()
+        self._conn().executescript(SCHEMA)
+
+    def _conn(self):
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=30, isolation_level=None)
+            conn.execute('PRAGMA journal_mode=WAL')
+            conn.execute('PRAGMA synchronous=NORMAL')
+            self._local.conn = conn
+        return conn
+
+    def record(self, payload, event, error, attempts=1):
+        """
+        Store a failed event, or count another failure of a stored one
+
+        Args:
+            payload: Raw request body (bytes or str)
+            event: The parsed event
+            error: The exception (or message) it failed with
+            attempts: Failed attempts this call stands for (queue workers
+                give up after several)
+        """
+        if isinstance(payload, bytes):
+            payload = payload.decode('utf-8')
+        now = time.time()
+        self._conn().execute(
+            'INSERT INTO dead_letters (event_id, event_type, customer_id, event_created, payload, '
+            'error, attempts, first_failed_at, last_failed_at) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?) '
+            'ON CONFLICT (event_id) DO UPDATE SET attempts = attempts + excluded.attempts, '
+            'error = excluded.error, last_failed_at = excluded.last_failed_at',
+            (event.get('id'), event.get('type'), event_customer_id(event), event.get('created'),
+             payload, str(error), attempts, now, now)
+        )
+
+    def pending(self, limit=500, after_id=0):
+        """
+        Stored events in failure order
+
+        Args:
+            limit: Max entries returned
+            after_id: Only entries with a larger id (to page past entries
+                that failed again)
+
+        Returns:
+            List of dicts with id, event_id, event_type, customer_id,
+            event_created, payload, error, attempts, first_failed_at,
+            last_failed_at
+        """
+        rows = self._conn().execute(
+            f'SELECT {", ".join(_COLUMNS)} FROM dead_letters WHERE id > ? ORDER BY id LIMIT ?',
+            (after_id, limit)
+        ).fetchall()
+        return [dict(zip(_COLUMNS, row)) for row in rows]
+
+    def resolve(self, ids):
+        """Remove entries that were replayed (or no longer need to be)"""
+        self._conn().executemany('DELETE FROM dead_letters WHERE id = ?', [(i,) for i in ids])
+
+    def record_failures(self, failures):
+        """
+        Count failed replays
+
+        Args:
+            failures: (id, error) pairs
+        """
+        now = time.time()
+        self._conn().executemany(
+            'UPDATE dead_letters SET attempts = attempts + 1, error = ?, last_failed_at = ? WHERE id = ?',
+            [(str(error), now, i) for i, error in failures]
+        )
+
+    def count(self):
+        """Number of events waiting for replay"""
+        return self._conn().execute('SELECT COUNT(*) FROM dead_letters').fetchone()[0]
@@ -0,0 +1,345 @@
+"""
+Stripe event -> customer row handling, shared by app.py and replay.py
+
+Importing this module starts no threads and opens no connections; each
+caller builds EventHandlers around the sink and stores it uses.
+"""
+
+import os
+import logging
+import threading
+import contextlib
+from datetime import datetime
+
+import stripe
+
+import metrics
+from customer_cache import CustomerCache
+from customer_store import CustomerProjectionStore
+from event_order import EventOrderIndex, ROW_EVENT_TYPES, event_customer_id
+from sheets_service import map_subscription_status
+
+
+logger = logging.getLogger(__name__)
+
+# Every type route_event has a handler for; anything else is acknowledged and dropped
+HANDLED_EVENT_TYPES = frozenset({
+    'checkout.session.completed',
+    'customer.subscription.created',
+    'customer.subscription.updated',
+    'customer.subscription.deleted',
+    'invoice.payment_succeeded',
+    'invoice.payment_failed',
+    'customer.created',
+    'customer.updated',
+    'customer.deleted',
+})
+
+STALE_EVENTS = metrics.registry.counter(
+    'stale_events_dropped_total',
+    'Row events dropped because a newer event for the customer was already applied',
+    ('event_type',)
+)
+
+
+def retrieve_customer(customer_id):
+    """Fetch a customer from Stripe, timed and counted for /metrics"""
+    with metrics.stage('stripe_customer_retrieve'):
+        try:
+            customer = stripe.Customer.retrieve(customer_id)
+        except stripe.error.StripeError as e:
+            metrics.record_api_call('stripe', 'customer_retrieve', e.http_status or 'error')
+            raise
+    metrics.record_api_call('stripe', 'customer_retrieve', 200)
+    return customer
+
+
+class EventHandlers:
+    """
+    Route verified Stripe events to customer row writes
+
+    Handlers return (body dict, HTTP status): app.py turns them into
+    responses, replay.py only looks at the status.
+    """
+
+    def __init__(self, customer_sink, customer_store=None, event_order=None, coalescer=None):
+        """
+        Args:
+            customer_sink: CustomerSink rows are written to
+            customer_store: Optional CustomerProjectionStore, fed by
+                customer.* events and read before calling Stripe
+            event_order: Optional EventOrderIndex; row events older than
+                the newest one applied for their customer are dropped
+            coalescer: Optional EventCoalescer in front of customer_sink
+        """
+        self.customer_sink = customer_sink
+        self.customer_store = customer_store
+        self.event_order = event_order
+        self.coalescer = coalescer
+        # One checkout fires several events for the same customer within seconds
+        self.customer_cache = CustomerCache(self.load_customer)
+        self._local = threading.local()
+
+    def load_customer(self, customer_id):
+        """Projection first; Stripe only for customers the store has never seen"""
+        if self.customer_store is not None:
+            customer = self.customer_store.get(customer_id)
+            if customer is not None:
+                return customer
+        customer = retrieve_customer(customer_id)
+        if self.customer_store is not None:
+            self.customer_store.upsert(customer)
+        return customer
+
+    def claim_event_order(self, event):
+        """
+        Claim a row event as its customer's newest
+
+        Returns:
+            False if a newer event for the customer was already applied
+        """
+        if self.event_order is None or event['type'] not in ROW_EVENT_TYPES or not event.get('created'):
+            return True
+        customer_id = event_customer_id(event)
+        if not customer_id:
+            return True
+        return self.event_order.claim(customer_id, event['created'])
+
+    def dispatch_event(self, event):
+        """Route a verified Stripe event to its handler (raises on processing errors)"""
+        with metrics.event_context(event['type']), metrics.stage('dispatch'):
+            if not self.claim_event_order(event):
+                # Checked before the customer fetch and the Sheets write
+                STALE_EVENTS.inc(event_type=event['type'])
+                logger.info(f"Out-of-order event skipped: {event.get('id')}")
+                return {'success': True, 'event': event['type'], 'action': 'stale'}, 200
+            return self.route_event(event)
+
+    def route_event(self, event):
+        """The per-type handler chain behind dispatch_event"""
+        event_type = event['type']
+        created = event.get('created')
+
+        # Handle different Stripe webhook events
+        if event_type == 'checkout.session.completed':
+            # New subscription created via Checkout
+            return self.handle_checkout_completed(event['data']['object'], created)
+
+        elif event_type == 'customer.subscription.created':
+            # New subscription created (alternative to checkout)
+            return self.handle_subscription_event(event['data']['object'], 'Active', created)
+
+        elif event_type == 'customer.subscription.updated':
+            # Subscription updated (plan change, etc.)
+            subscription = event['data']['object']
+            status = map_subscription_status(subscription['status'])
+            return self.handle_subscription_event(subscription, status, created)
+
+        elif event_type == 'customer.subscription.deleted':
+            # Subscription cancelled/deleted
+            return self.handle_subscription_event(event['data']['object'], 'Cancelled', created)
+
+        elif event_type == 'invoice.payment_succeeded':
+            # Payment succeeded - keep Active
+            return self.handle_invoice_event(event['data']['object'], 'Active', created)
+
+        elif event_type == 'invoice.payment_failed':
+            # Payment failed - mark as Past Due
+            return self.handle_invoice_event(event['data']['object'], 'Past Due', created)
+
+        elif event_type in ('customer.created', 'customer.updated', 'customer.deleted'):
+            # Customer details changed - update the projection, drop the cached copy
+            customer = event['data']['object']
+            action = 'invalidated'
+            if self.customer_store is not None:
+                stored = self.customer_store.upsert(customer, created, deleted=event_type == 'customer.deleted')
+                action = 'projected' if stored else 'stale'
+            self.customer_cache.invalidate(customer['id'])
+            return {'success': True, 'event': event_type, 'action': action}, 200
+
+        else:
+            # Unhandled event type - log and return success
+            logger.info(f'Unhandled event type: {event_type}')
+            return {'success': True, 'event': event_type, 'action': 'ignored'}, 200
+
+    @contextlib.contextmanager
+    def deferred_writes(self):
+        """
+        Within the block, coalesced writes don't wait for their window
+
+        Yields the list the writes' futures are appended to, so a queue
+        worker can settle its event when the merged write lands instead of
+        waiting for it (see EventWorkerPool).
+        """
+        self._local.deferred = futures = []
+        try:
+            yield futures
+        finally:
+            self._local.deferred = None
+
+    def write_customer(self, customer_data, created=None):
+        """Upsert a customer row, through the coalescing window when enabled"""
+        with metrics.stage('sheets_upsert'):
+            if self.coalescer is not None:
+                deferred = getattr(self._local, 'deferred', None)
+                if deferred is not None:
+                    # Queue worker: hand the write over and move on to the next event
+                    deferred.append(self.coalescer.submit_async(customer_data, created))
+                    return 'coalescing'
+                return self.coalescer.submit(customer_data, created)
+            return self.customer_sink.upsert_customer(customer_data)
+
+    def customer_data_for_event(self, event):
+        """
+        Row an event writes, built without writing it (replay.py batches these)
+
+        Returns:
+            customer_data, or None for events that don't write a row or have
+            no customer ID
+        """
+        event_type = event['type']
+        obj = event['data']['object']
+        if event_type == 'checkout.session.completed':
+            return self.checkout_customer_data(obj)
+        if event_type == 'customer.subscription.created':
+            return self.subscription_customer_data(obj, 'Active')
+        if event_type == 'customer.subscription.updated':
+            return self.subscription_customer_data(obj, map_subscription_status(obj['status']))
+        if event_type == 'customer.subscription.deleted':
+            return self.subscription_customer_data(obj, 'Cancelled')
+        if event_type == 'invoice.payment_succeeded':
+            return self.invoice_customer_data(obj, 'Active')
+        if event_type == 'invoice.payment_failed':
+            return self.invoice_customer_data(obj, 'Past Due')
+        return None
+
+    def checkout_customer_data(self, session):
+        """Row for checkout.session.completed, or None without a customer ID"""
+        customer_id = session.get('customer')
+        if not customer_id:
+            return None
+
+        customer = self.customer_cache.get(customer_id)
+        company_name = customer.metadata.get('company_name', 'Unknown Company')
+        country = customer.metadata.get('country', '')  # Get country from metadata
+        subscription_id = session.get('subscription')
+
+        customer_data = {
+            'customer_id': customer_id,
+            'company_name': company_name,
+            'email': customer.email,
+            'subscription_id': subscription_id,
+            'status': 'Active',
+            'amount': session.get('amount_total', 0) / 100,
+            'currency': session.get('currency', 'usd').upper(),
+            'timestamp': datetime.utcnow().strftime('%Y-%m-%d %H:%M:%S'),
+            'country': country
+        }
+        return customer_data
+
+    def handle_checkout_completed(self, session, created=None):
+        """Handle checkout.session.completed event"""
+        customer_data = self.checkout_customer_data(session)
+        if customer_data is None:
+            logger.warning('No customer ID in session')
+            return {'error': 'No customer ID'}, 400
+
+        result = self.write_customer(customer_data, created)
+        logger.info(f"Checkout completed - Customer: {customer_data['customer_id']} - {result}")
+        return {'success': True, 'action': result, 'status': 'Active'}, 200
+
+    def subscription_customer_data(self, subscription, status):
+        """Row for a subscription event, or None without a customer ID"""
+        customer_id = subscription.get('customer')
+        if not customer_id:
+            return None
+
+        customer = self.customer_cache.get(customer_id)
+        company_name = customer.metadata.get('company_name', 'Unknown Company')
+        country = customer.metadata.get('country', '')  # Get country from metadata
+
+        # Get plan amount if available
+        amount = 0
+        currency = 'USD'
+        if subscription.get('items') and subscription['items'].get('data'):
+            first_item = subscription['items']['data'][0]
+            if first_item.get('price'):
+                amount = first_item['price'].get('unit_amount', 0) / 100
+                currency = first_item['price'].get('currency', 'usd').upper()
+
+        customer_data = {
+            'customer_id': customer_id,
+            'company_name': company_name,
+            'email': customer.email,
+            'subscription_id': subscription.get('id'),
+            'status': status,
+            'amount': amount,
+            'currency': currency,
+            'timestamp': datetime.utcnow().strftime('%Y-%m-%d %H:%M:%S'),
+            'country': country
+        }
+        return customer_data
+
+    def handle_subscription_event(self, subscription, status, created=None):
+        """Handle subscription-related events"""
+        customer_data = self.subscription_customer_data(subscription, status)
+        if customer_data is None:
+            logger.warning('No customer ID in subscription')
+            return {'error': 'No customer ID'}, 400
+
+        result = self.write_customer(customer_data, created)
+        logger.info(f"Subscription event - Customer: {customer_data['customer_id']} - Status: {status} - {result}")
+        return {'success': True, 'action': result, 'status': status}, 200
+
+    def invoice_customer_data(self, invoice, status):
+        """Row for an invoice event, or None without a customer ID"""
+        customer_id = invoice.get('customer')
+        if not customer_id:
+            return None
+
+        customer = self.customer_cache.get(customer_id)
+        company_name = customer.metadata.get('company_name', 'Unknown Company')
+        country = customer.metadata.get('country', '')  # Get country from metadata
+        subscription_id = invoice.get('subscription')
+
+        customer_data = {
+            'customer_id': customer_id,
+            'company_name': company_name,
+            'email': customer.email,
+            'subscription_id': subscription_id,
+            'status': status,
+            'amount': invoice.get('amount_paid', 0) / 100,
+            'currency': invoice.get('currency', 'usd').upper(),
+            'timestamp': datetime.utcnow().strftime('%Y-%m-%d %H:%M:%S'),
+            'country': country
+        }
+        return customer_data
+
+    def handle_invoice_event(self, invoice, status, created=None):
+        """Handle invoice-related events"""
+        customer_data = self.invoice_customer_data(invoice, status)
+        if customer_data is None:
+            logger.warning('No customer ID in invoice')
+            return {'error': 'No customer ID'}, 400
+
+        result = self.write_customer(customer_data, created)
+        logger.info(f"Invoice event - Customer: {customer_data['customer_id']} - Status: {status} - {result}")
+        return {'success': True, 'action': result, 'status': status}, 200
+
+
+def event_handlers_from_env(customer_sink, coalescer=None):
+    """
+    EventHandlers with the stores enabled in the environment
+
+    CUSTOMER_STORE_ENABLED (default true) keeps a local projection of
+    customer details so the hot path doesn't call Stripe;
+    EVENT_ORDER_GUARD_ENABLED (default true) drops row events older than
+    the newest one already applied for the customer.
+    """
+    customer_store = None
+    if os.getenv('CUSTOMER_STORE_ENABLED', 'true').lower() == 'true':
+        customer_store = CustomerProjectionStore()
+    event_order = None
+    if os.getenv('EVENT_ORDER_GUARD_ENABLED', 'true').lower() == 'true':
+        event_order = EventOrderIndex()
+    return EventHandlers(customer_sink, customer_store, event_order, coalescer)
@@ -0,0 +1,171 @@
+"""
+Out-of-order guard: newest applied event.created per customer
+
+Stripe doesn't deliver events in order. A late invoice.payment_failed
+must not overwrite the Active written by a newer event, and it shouldn't
+cost a Stripe fetch and a Sheets write either. Each customer's newest
+applied `created` time is kept in a small SQLite table shared by all
+workers on the host; row events older than it are dropped before any
+outbound call.
+"""
+
+import os
+import time
+import sqlite3
+import threading
+
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS last_applied (
+    customer_key TEXT PRIMARY KEY,
+    created INTEGER NOT NULL
+) WITHOUT ROWID;
+CREATE INDEX IF NOT EXISTS idx_last_applied_created ON last_applied (created);
+"""
+
+# Events that write the customer's row. customer.* events are versioned by
+# the projection store (customer_store.py) instead.
+ROW_EVENT_TYPES = frozenset({
+    'checkout.session.completed',
+    'customer.subscription.created',
+    'customer.subscription.updated',
+    'customer.subscription.deleted',
+    'invoice.payment_succeeded',
+    'invoice.payment_failed',
+})
+
+
+def event_customer_id(event):
+    """Customer an event is about (customer.* events carry it as the object ID)"""
+    obj = (event.get('data') or {}).get('object') or {}
+    event_type = event.get('type', '')
+    if event_type.startswith('customer.') and not event_type.startswith('customer.subscription.'):
+        return obj.get('id')
+    return obj.get('customer')
+
+
+class EventOrderIndex:
+    """
+    Customer -> newest event.created applied to their row
+
+    Events created in the same second as the newest one still apply
+    (Stripe timestamps have one-second resolution); only strictly older
+    events are stale. Entries older than the retention window are pruned:
+    by then any late delivery is newer than them anyway.
+    """
+
+    def __init__(self, path=None, retention=None):
+        """
+        Args:
+            path: SQLite file path (defaults to EVENT_ORDER_PATH)
+            retention: Seconds an entry is kept (defaults to
+                EVENT_ORDER_RETENTION; Stripe retries for up to 3 days)
+        """
+        self.path = path or os.getenv('EVENT_ORDER_PATH', 'event_order.db')
+        self.retention = retention or int(os.getenv('EVENT_ORDER_RETENTION', str(7 * 24 * 3600)))
+        self.prune_interval = 3600
+        self._last_prune = 0.0
+        self._local = threading.local()
+        self._conn().executescript(SCHEMA)
+
+    def _conn(self):
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=30, isolation_level=None)
+            conn.execute('PRAGMA journal_mode=WAL')
+            conn.execute('PRAGMA synchronous=NORMAL')
+            self._local.conn = conn
+        return conn
+
+    @staticmethod
+    def normalize_customer_id(customer_id):
+        return str(customer_id).strip().lower()
+
+    def claim(self, customer_id, created):
+        """
+        Record an event as the customer's newest, unless a newer one was
+
+        Claimed before the event is processed, so an older event arriving
+        while a newer one is still being written is dropped too. If the
+        newer event then fails, its retry still applies (same `created`).
+
+        Args:
+            customer_id: Stripe customer ID
+            created: The event's `created` (Unix seconds)
+
+        Returns:
+            True to process the event, False if it is stale
+        """
+        now = time.time()
+        self._maybe_prune(now)
+        conn = self._conn()
+        before = conn.total_changes
+        conn.execute(
+            'INSERT INTO last_applied (customer_key, created) VALUES (?, ?) '
+            'ON CONFLICT (customer_key) DO UPDATE SET created = excluded.created '
+            'WHERE excluded.created >= last_applied.created',
+            (self.normalize_customer_id(customer_id), int(created))
+        )
+        return conn.total_changes - before == 1
+
+    def claim_many(self, events):
+        """
+        Claim the newest of several events per customer in one transaction
+
+        Args:
+            events: (customer_id, created) pairs
+
+        Returns:
+            Dict of normalized customer ID -> newest claimed created, for
+            customers whose events are not all stale (an event for such a
+            customer is stale if older than that value)
+        """
+        newest = {}
+        for customer_id, created in events:
+            key = self.normalize_customer_id(customer_id)
+            newest[key] = max(newest.get(key, created), int(created))
+        claimed = {}
+        conn = self._conn()
+        conn.execute('BEGIN IMMEDIATE')
+        try:
+            for key, created in newest.items():
+                before = conn.total_changes
+                conn.execute(
+                    'INSERT INTO last_applied (customer_key, created) VALUES (?, ?) '
+                    'ON CONFLICT (customer_key) DO UPDATE SET created = excluded.created '
+                    'WHERE excluded.created >= last_applied.created',
+                    (key, created)
+                )
+                if conn.total_changes - before == 1:
+                    claimed[key] = created
+            conn.execute('COMMIT')
+        except Exception:
+            conn.execute('ROLLBACK')
+            raise
+        return claimed
+
+    def is_stale(self, customer_id, created):
+        """True if a newer event was already applied (read-only check)"""
+        row = self._conn().execute(
+            'SELECT created FROM last_applied WHERE customer_key = ?',
+            (self.normalize_customer_id(customer_id),)
+        ).fetchone()
+        return row is not None and int(created) < row[0]
+
+    def prune(self, now=None):
+        """
+        Delete entries older than the retention window
+
+        Returns:
+            Number of rows removed
+        """
+        now = now or time.time()
+        cursor = self._conn().execute(
+            'DELETE FROM last_applied WHERE created < ?', (now - self.retention,)
+        )
+        self._last_prune = now
+        return cursor.rowcount
+
+    def _maybe_prune(self, now):
+        if now - self._last_prune >= self.prune_interval:
+            self.prune(now)
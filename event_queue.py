@@ -0,0 +1,324 @@
+import os
+import time
+import sqlite3
+import logging
+import threading
+from concurrent.futures import Future
+
+
+logger = logging.getLogger(__name__)
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS events (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    event_id TEXT,
+    event_type TEXT,
+    payload TEXT NOT NULL,
+    status TEXT NOT NULL DEFAULT 'pending',
+    attempts INTEGER NOT NULL DEFAULT 0,
+    next_attempt_at REAL NOT NULL,
+    claimed_at REAL,
+    last_error TEXT,
+    created_at REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS idx_events_ready ON events (status, next_attempt_at);
+"""
+
+
+class EventQueue:
+    """Crash-safe local queue of verified webhook payloads (SQLite in WAL mode)"""
+
+    def __init__(self, path=None, visibility_timeout=None):
+        """
+        Open (or create) the queue database
+
+        Args:
+            path: SQLite file path (defaults to EVENT_QUEUE_PATH)
+            visibility_timeout: Seconds before an event claimed by a crashed
+                worker is handed out again (live workers renew their
+                claims, see EventWorkerPool)
+        """
+        self.path = path or os.getenv('EVENT_QUEUE_PATH', 'event_queue.db')
+        self.visibility_timeout = visibility_timeout or int(
+            os.getenv('EVENT_QUEUE_VISIBILITY_TIMEOUT', '300')
+        )
+        self._local = threading.local()
+        self._conn().executescript(SCHEMA)
+
+    def _conn(self):
+        """One connection per thread; SQLite handles cross-process locking"""
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=30, isolation_level=None)
+            conn.execute('PRAGMA journal_mode=WAL')
+            # FULL fsyncs each commit so an acknowledged event survives power loss
+            conn.execute('PRAGMA synchronous=FULL')
+            self._local.conn = conn
+        return conn
+
+    def enqueue(self, payload, event_id=None, event_type=None):
+        """
+        Durably store a raw webhook payload
+
+        Args:
+            payload: Raw request body (bytes or str)
+            event_id: Stripe event ID, for visibility
+            event_type: Stripe event type, for visibility
+
+        Returns:
+            Queue row ID
+        """
+        if isinstance(payload, bytes):
+            payload = payload.decode('utf-8')
+        now = time.time()
+        cursor = self._conn().execute(
+            'INSERT INTO events (event_id, event_type, payload, next_attempt_at, created_at) '
+            'VALUES (?, ?, ?, ?, ?)',
+            (event_id, event_type, payload, now, now)
+        )
+        return cursor.lastrowid
+
+    def claim(self):
+        """
+        Take the oldest ready event, or one abandoned by a crashed worker
+
+        Returns:
+            Dict with id, event_id, event_type, payload, attempts - or None
+        """
+        conn = self._conn()
+        now = time.time()
+        conn.execute('BEGIN IMMEDIATE')
+        try:
+            row = conn.execute(
+                "SELECT id, event_id, event_type, payload, attempts FROM events "
+                "WHERE (status = 'pending' AND next_attempt_at <= ?) "
+                "OR (status = 'processing' AND claimed_at <= ?) "
+                "ORDER BY id LIMIT 1",
+                (now, now - self.visibility_timeout)
+            ).fetchone()
+            if row is None:
+                conn.execute('COMMIT')
+                return None
+            conn.execute(
+                "UPDATE events SET status = 'processing', claimed_at = ?, "
+                "attempts = attempts + 1 WHERE id = ?",
+                (now, row[0])
+            )
+            conn.execute('COMMIT')
+        except Exception:
+            conn.execute('ROLLBACK')
+            raise
+
+        return {
+            'id': row[0],
+            'event_id': row[1],
+            'event_type': row[2],
+            'payload': row[3],
+            'attempts': row[4] + 1,
+        }
+
+    def renew(self, queue_ids):
+        """Restart the visibility timeout of events still being processed"""
+        queue_ids = list(queue_ids)
+        if not queue_ids:
+            return
+        marks = ','.join('?' * len(queue_ids))
+        self._conn().execute(
+            f"UPDATE events SET claimed_at = ? WHERE status = 'processing' AND id IN ({marks})",
+            (time.time(), *queue_ids)
+        )
+
+    def complete(self, queue_id):
+        """Remove a successfully processed event"""
+        self._conn().execute('DELETE FROM events WHERE id = ?', (queue_id,))
+
+    def retry(self, queue_id, error, delay):
+        """Put an event back to be retried after `delay` seconds"""
+        self._conn().execute(
+            "UPDATE events SET status = 'pending', claimed_at = NULL, "
+            "next_attempt_at = ?, last_error = ? WHERE id = ?",
+            (time.time() + delay, str(error), queue_id)
+        )
+
+    def fail(self, queue_id, error):
+        """Park an event that ran out of attempts (kept for inspection)"""
+        self._conn().execute(
+            "UPDATE events SET status = 'failed', claimed_at = NULL, "
+            "last_error = ? WHERE id = ?",
+            (str(error), queue_id)
+        )
+
+    def depth(self):
+        """
+        Count queued events by status
+
+        Returns:
+            Dict like {'pending': 3, 'processing': 1, 'failed': 0}
+        """
+        counts = {'pending': 0, 'processing': 0, 'failed': 0}
+        rows = self._conn().execute(
+            'SELECT status, COUNT(*) FROM events GROUP BY status'
+        ).fetchall()
+        for status, count in rows:
+            counts[status] = count
+        return counts
+
+
+class EventWorkerPool:
+    """
+    Background threads that drain an EventQueue into a handler
+
+    While a handler runs (possibly for minutes, waiting out Sheets
+    backoff) its claim is renewed every third of the visibility timeout,
+    so no other worker or process picks the event up as abandoned.
+
+    A handler may also return a concurrent.futures.Future (e.g. from
+    EventCoalescer.submit_async) instead of blocking. The worker moves on to
+    the next event right away; the claim stays renewed until the future
+    resolves, and the event is then completed or retried as if the handler
+    had returned or raised.
+    """
+
+    def __init__(self, queue, handler, workers=None, max_attempts=None,
+                 poll_interval=0.5, max_backoff=300, ready=None, on_give_up=None):
+        """
+        Args:
+            queue: EventQueue to drain
+            handler: Callable taking a claimed queue item; raises to retry,
+                or returns a Future that settles the event when it resolves
+            workers: Number of threads (defaults to EVENT_QUEUE_WORKERS)
+            max_attempts: Attempts before an event is parked as failed
+            poll_interval: Seconds to sleep when the queue is empty
+            max_backoff: Upper bound on retry delay in seconds
+            ready: Optional callable; while it returns False workers leave
+                events queued (e.g. no Sheets write budget left)
+            on_give_up: Optional callable taking (item, error) for an event
+                out of attempts; once it returns, the event leaves the queue
+                instead of being parked as failed (e.g. dead-letter store)
+        """
+        self.queue = queue
+        self.handler = handler
+        self.workers = workers or int(os.getenv('EVENT_QUEUE_WORKERS', '2'))
+        self.max_attempts = max_attempts or int(os.getenv('EVENT_QUEUE_MAX_ATTEMPTS', '8'))
+        self.poll_interval = poll_interval
+        self.max_backoff = max_backoff
+        self.ready = ready
+        self.on_give_up = on_give_up
+        self._wakeup = threading.Event()
+        self._stopping = threading.Event()
+        self._threads = []
+        self._in_flight = set()  # queue IDs claimed by this pool's handlers
+        self._in_flight_lock = threading.Lock()
+
+    def start(self):
+        """Start the worker threads (idempotent)"""
+        if self._threads:
+            return
+        self._stopping.clear()
+        for i in range(self.workers):
+            thread = threading.Thread(
+                target=self._run, name=f'event-worker-{i}', daemon=True
+            )
+            thread.start()
+            self._threads.append(thread)
+        renewer = threading.Thread(target=self._renew_claims, name='event-claim-renewer', daemon=True)
+        renewer.start()
+        self._threads.append(renewer)
+
+    def stop(self, timeout=5):
+        """Ask workers to exit after their current event"""
+        self._stopping.set()
+        self._wakeup.set()
+        for thread in self._threads:
+            thread.join(timeout)
+        self._threads = []
+
+    def notify(self):
+        """Wake idle workers right away (called after enqueue)"""
+        self._wakeup.set()
+
+    def backoff(self, attempts):
+        """Exponential retry delay: 2s, 4s, 8s ... capped at max_backoff"""
+        return min(self.max_backoff, 2 ** attempts)
+
+    def run_once(self):
+        """
+        Claim and process a single event
+
+        Returns:
+            True if an event was claimed, False if the queue was empty
+            or the pool is deferring work
+        """
+        if self.ready is not None and not self.ready():
+            return False
+
+        item = self.queue.claim()
+        if item is None:
+            return False
+
+        with self._in_flight_lock:
+            self._in_flight.add(item['id'])
+        try:
+            result = self.handler(item)
+        except Exception as e:
+            self._settle(item, e)
+            return True
+
+        if isinstance(result, Future):
+            result.add_done_callback(lambda future: self._settle(item, future.exception()))
+        else:
+            self._settle(item, None)
+        return True
+
+    def _settle(self, item, error):
+        """Complete, retry or give up on a claimed event once its handler finished"""
+        try:
+            if error is None:
+                self.queue.complete(item['id'])
+            elif item['attempts'] >= self.max_attempts:
+                logger.error(f"Event {item['event_id']} failed permanently: {error}")
+                self._give_up(item, error)
+            else:
+                # Honor the upstream's hint (e.g. Sheets Retry-After) when there is one
+                delay = getattr(error, 'retry_after', None) or self.backoff(item['attempts'])
+                logger.warning(
+                    f"Event {item['event_id']} failed (attempt {item['attempts']}), "
+                    f"retrying in {delay}s: {error}"
+                )
+                self.queue.retry(item['id'], error, delay)
+        finally:
+            with self._in_flight_lock:
+                self._in_flight.discard(item['id'])
+
+    def _give_up(self, item, error):
+        if self.on_give_up is not None:
+            try:
+                self.on_give_up(item, error)
+            except Exception as e:
+                logger.error(f"Could not hand off event {item['event_id']}: {e}")
+            else:
+                self.queue.complete(item['id'])
+                return
+        self.queue.fail(item['id'], error)
+
+    def _renew_claims(self):
+        """Keep the claims of running handlers from timing out"""
+        while not self._stopping.wait(self.queue.visibility_timeout / 3):
+            with self._in_flight_lock:
+                queue_ids = list(self._in_flight)
+            try:
+                self.queue.renew(queue_ids)
+            except Exception as e:
+                logger.error(f'Could not renew event claims: {e}')
+
+    def _run(self):
+        while not self._stopping.is_set():
+            try:
+                claimed = self.run_once()
+            except Exception as e:
+                logger.error(f'Event worker error: {e}')
+                claimed = False
+
+            if not claimed:
+                self._wakeup.wait(self.poll_interval)
+                self._wakeup.clear()
@@ -0,0 +1,365 @@
+"""
+Local stand-ins for the Stripe Customer API and the Google Sheets/Drive API
+Used by benchmark.py; no credentials or network access needed
+"""
+
+import re
+import hmac
+import json
+import time
+import random
+import hashlib
+import threading
+from collections import Counter
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+from urllib.parse import urlparse, parse_qs, unquote
+
+import gspread
+import google.oauth2.credentials
+from gspread.utils import a1_to_rowcol
+
+from http_clients import mount_connection_pool, serialize_token_refresh
+
+
+def generate_stripe_signature(payload, secret):
+    """Stripe-Signature header value for a payload, as Stripe signs it"""
+    timestamp = str(int(time.time()))
+    signature = hmac.new(
+        secret.encode('utf-8'), f'{timestamp}.{payload}'.encode('utf-8'), hashlib.sha256
+    ).hexdigest()
+    return f't={timestamp},v1={signature}'
+
+
+class FaultInjector:
+    """Configurable latency and HTTP 429 injection shared by the fake servers"""
+
+    def __init__(self, latency_ms=0.0, jitter_ms=0.0, rate_limit_ratio=0.0, retry_after=1):
+        """
+        Args:
+            latency_ms: Base latency added to every request
+            jitter_ms: Extra uniformly distributed latency
+            rate_limit_ratio: Fraction of requests answered with HTTP 429
+            retry_after: Retry-After header value sent with 429s
+        """
+        self.latency_ms = latency_ms
+        self.jitter_ms = jitter_ms
+        self.rate_limit_ratio = rate_limit_ratio
+        self.retry_after = retry_after
+
+    def delay(self):
+        total = self.latency_ms + random.uniform(0, self.jitter_ms)
+        if total > 0:
+            time.sleep(total / 1000.0)
+
+    def should_throttle(self):
+        return self.rate_limit_ratio > 0 and random.random() < self.rate_limit_ratio
+
+
+class _FakeHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'  # keep-alive, like the real APIs
+
+    def log_message(self, format, *args):
+        pass
+
+    def _send_json(self, status, body, headers=None):
+        data = json.dumps(body).encode('utf-8')
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(data)))
+        for name, value in (headers or {}).items():
+            self.send_header(name, str(value))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def _read_body(self):
+        length = int(self.headers.get('Content-Length') or 0)
+        if not length:
+            return {}
+        raw = self.rfile.read(length)
+        try:
+            return json.loads(raw)
+        except ValueError:
+            return parse_qs(raw.decode('utf-8'))
+
+    def _handle(self, method):
+        fake = self.server.fake
+        parsed = urlparse(self.path)
+        body = self._read_body() if method == 'POST' else {}
+        fake.faults.delay()
+
+        if fake.faults.should_throttle():
+            fake.count('rate_limited')
+            self._send_json(
+                429, {'error': {'code': 429, 'message': 'Rate limit exceeded', 'status': 'RESOURCE_EXHAUSTED'}},
+                {'Retry-After': fake.faults.retry_after}
+            )
+            return
+
+        status, response = fake.route(method, parsed.path, parse_qs(parsed.query), body)
+        self._send_json(status, response)
+
+    def do_GET(self):
+        self._handle('GET')
+
+    def do_POST(self):
+        self._handle('POST')
+
+
+class _ThreadingServer(ThreadingHTTPServer):
+    daemon_threads = True
+    request_queue_size = 256  # default backlog of 5 resets connections under bursts
+
+
+class _FakeServer:
+    """Base class: runs a ThreadingHTTPServer on a free localhost port"""
+
+    def __init__(self, faults=None):
+        self.faults = faults or FaultInjector()
+        self.counts = Counter()
+        self._lock = threading.Lock()
+        self._server = _ThreadingServer(('127.0.0.1', 0), _FakeHandler)
+        self._server.fake = self
+        self._thread = None
+
+    @property
+    def url(self):
+        host, port = self._server.server_address
+        return f'http://{host}:{port}'
+
+    def count(self, kind):
+        with self._lock:
+            self.counts[kind] += 1
+
+    def reset_counts(self):
+        with self._lock:
+            self.counts.clear()
+
+    def start(self):
+        self._thread = threading.Thread(target=self._server.serve_forever, daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._server.shutdown()
+        self._server.server_close()
+
+    def route(self, method, path, query, body):
+        raise NotImplementedError
+
+
+class FakeStripe(_FakeServer):
+    """
+    Serves GET /v1/customers/<id> with company_name/country metadata, and
+    GET /v1/subscriptions (paginated, customer always expanded)
+    """
+
+    def __init__(self, faults=None, subscriptions=None):
+        """
+        Args:
+            faults: FaultInjector for latency and 429s
+            subscriptions: (subscription_id, customer_id, status) tuples, newest first
+        """
+        super().__init__(faults)
+        self.subscriptions = list(subscriptions or [])
+
+    @staticmethod
+    def customer(customer_id):
+        return {
+            'id': customer_id,
+            'object': 'customer',
+            'email': f'billing@{customer_id.lower()}.example',
+            'metadata': {
+                'company_name': f'Company {customer_id}',
+                'country': 'US',
+            },
+        }
+
+    def route(self, method, path, query, body):
+        match = re.match(r'^/v1/customers/([^/]+)$', path)
+        if method == 'GET' and match:
+            self.count('customer_retrieve')
+            return 200, self.customer(unquote(match.group(1)))
+
+        if method == 'GET' and path == '/v1/subscriptions':
+            self.count('subscription_list')
+            status = query.get('status', [None])[0]
+            rows = [s for s in self.subscriptions
+                    if status == 'all' or (s[2] != 'canceled' if status is None else s[2] == status)]
+            after = query.get('starting_after', [None])[0]
+            if after:
+                ids = [s[0] for s in rows]
+                rows = rows[ids.index(after) + 1:] if after in ids else []
+            limit = int(query.get('limit', ['10'])[0])
+            page = [{
+                'id': subscription_id,
+                'object': 'subscription',
+                'customer': self.customer(customer_id),
+                'status': sub_status,
+                'items': {'object': 'list', 'data': [
+                    {'price': {'unit_amount': 49900, 'currency': 'usd'}}
+                ]},
+            } for subscription_id, customer_id, sub_status in rows[:limit]]
+            return 200, {'object': 'list', 'url': '/v1/subscriptions',
+                         'has_more': len(rows) > limit, 'data': page}
+
+        self.count('unknown')
+        return 404, {'error': {'message': f'No such route: {method} {path}'}}
+
+
+class FakeSheets(_FakeServer):
+    """
+    In-memory spreadsheet behind the Sheets v4 values API and Drive file search
+
+    Implements the endpoints gspread uses here: spreadsheet metadata,
+    values get / batchGet / batchUpdate / append, and Drive files list.
+    """
+
+    SPREADSHEET_ID = 'bench-spreadsheet'
+    TITLE = 'Sheet1'
+
+    def __init__(self, rows=None, faults=None, column_count=26):
+        super().__init__(faults)
+        self.rows = [list(row) for row in (rows or [])]
+        self.column_count = column_count
+        self._data_lock = threading.Lock()
+
+    # --- A1 helpers -------------------------------------------------------
+
+    @staticmethod
+    def _split_range(a1):
+        a1 = unquote(a1)
+        if '!' in a1:
+            a1 = a1.split('!', 1)[1]
+        elif a1.strip("'") == FakeSheets.TITLE:
+            return None
+        return a1
+
+    @staticmethod
+    def _parse_cell(label, default_row):
+        match = re.match(r'^([A-Za-z]*)(\d*)$', label)
+        letters, digits = match.groups()
+        col = a1_to_rowcol(f'{letters}1')[1] if letters else 1
+        row = int(digits) if digits else default_row
+        return row, col
+
+    def _bounds(self, a1):
+        """(first_row, first_col, last_row, last_col), 1-based and inclusive"""
+        a1 = self._split_range(a1)
+        last_row = max(len(self.rows), 1)
+        if a1 is None:
+            return 1, 1, last_row, self.column_count
+        start, _, end = a1.partition(':')
+        r1, c1 = self._parse_cell(start, 1)
+        if not end:
+            return r1, c1, r1, c1
+        r2, c2 = self._parse_cell(end, last_row)
+        if not re.search(r'[A-Za-z]', end):
+            c2 = self.column_count
+        return r1, c1, r2, c2
+
+    def _read(self, a1, major_dimension='ROWS'):
+        r1, c1, r2, c2 = self._bounds(a1)
+        values = []
+        for row in self.rows[r1 - 1:r2]:
+            values.append([str(v) for v in row[c1 - 1:c2]])
+        while values and not any(values[-1]):
+            values.pop()
+        if major_dimension == 'COLUMNS':
+            width = max((len(r) for r in values), default=0)
+            columns = [[r[i] if i < len(r) else '' for r in values] for i in range(width)]
+            for column in columns:
+                while column and column[-1] == '':
+                    column.pop()
+            values = columns
+        return {'range': a1, 'majorDimension': major_dimension, 'values': values}
+
+    def _write(self, a1, values):
+        r1, c1, _, _ = self._bounds(a1)
+        for r, row_values in enumerate(values):
+            while len(self.rows) < r1 + r:
+                self.rows.append([])
+            row = self.rows[r1 + r - 1]
+            for c, value in enumerate(row_values):
+                while len(row) < c1 + c:
+                    row.append('')
+                row[c1 + c - 1] = value
+
+    # --- routes -----------------------------------------------------------
+
+    def route(self, method, path, query, body):
+        if method == 'GET' and path.startswith('/drive/v3/files'):
+            self.count('drive_search')
+            return 200, {'files': [{'id': self.SPREADSHEET_ID, 'name': 'Benchmark Tracker'}]}
+
+        match = re.match(r'^/v4/spreadsheets/([^/:]+)(.*)$', path)
+        if not match:
+            self.count('unknown')
+            return 404, {'error': {'code': 404, 'message': f'No such route: {path}'}}
+        rest = match.group(2)
+
+        with self._data_lock:
+            if method == 'GET' and rest == '':
+                self.count('metadata')
+                return 200, {
+                    'spreadsheetId': self.SPREADSHEET_ID,
+                    'properties': {'title': 'Benchmark Tracker'},
+                    'sheets': [{'properties': {
+                        'sheetId': 0, 'title': self.TITLE, 'index': 0,
+                        'gridProperties': {'rowCount': max(1000, len(self.rows)), 'columnCount': self.column_count},
+                    }}],
+                }
+
+            if method == 'GET' and rest == '/values:batchGet':
+                self.count('read')
+                dimension = query.get('majorDimension', ['ROWS'])[0]
+                return 200, {'valueRanges': [self._read(r, dimension) for r in query.get('ranges', [])]}
+
+            if method == 'GET' and rest.startswith('/values/'):
+                self.count('read')
+                dimension = query.get('majorDimension', ['ROWS'])[0]
+                return 200, self._read(rest[len('/values/'):], dimension)
+
+            if method == 'POST' and rest == '/values:batchUpdate':
+                self.count('write')
+                for entry in body.get('data', []):
+                    self._write(entry['range'], entry['values'])
+                return 200, {'totalUpdatedCells': sum(len(e['values']) for e in body.get('data', []))}
+
+            if method == 'POST' and rest.startswith('/values/') and rest.endswith(':append'):
+                self.count('write')
+                first_row = len(self.rows) + 1
+                values = body.get('values', [])
+                for row in values:
+                    self.rows.append(list(row))
+                last_row = first_row + len(values) - 1
+                width = max((len(r) for r in values), default=1)
+                end_col = re.sub(r'\d+$', '', gspread.utils.rowcol_to_a1(1, width))
+                return 200, {
+                    'spreadsheetId': self.SPREADSHEET_ID,
+                    'updates': {
+                        'updatedRange': f"'{self.TITLE}'!A{first_row}:{end_col}{last_row}",
+                        'updatedRows': len(values),
+                    },
+                }
+
+        self.count('unknown')
+        return 404, {'error': {'code': 404, 'message': f'No such route: {method} {path}'}}
+
+    # --- gspread wiring ---------------------------------------------------
+
+    def gspread_client(self, pool_size=16):
+        """A real gspread.Client whose requests are routed to this server"""
+        base_url = self.url
+
+        class LocalHTTPClient(gspread.HTTPClient):
+            def request(self, method, endpoint, *args, **kwargs):
+                endpoint = endpoint.replace('https://sheets.googleapis.com', base_url)
+                endpoint = endpoint.replace('https://www.googleapis.com', base_url)
+                return super().request(method, endpoint, *args, **kwargs)
+
+        # A token without expiry never needs refreshing
+        credentials = google.oauth2.credentials.Credentials('fake-token')
+        client = gspread.Client(auth=credentials, http_client=LocalHTTPClient)
+        mount_connection_pool(client.http_client.session, pool_size)
+        serialize_token_refresh(client.http_client.auth)
+        return client
@@ -0,0 +1,19 @@
+"""
+Gunicorn settings (loaded automatically by `gunicorn app:app`)
+
+Webhooks spend most of their time waiting on Stripe and Google, so each
+worker process runs several threads instead of handling one request at
+a time. Keep SHEETS_HTTP_POOL_SIZE / STRIPE_HTTP_POOL_SIZE at least as
+large as `threads`.
+
+One process by default. With WEB_CONCURRENCY > 1, SHEETS_COORDINATION
+defaults to sqlite so the processes share write locks, the row index
+and the Sheets quota (see coordination.py).
+"""
+
+import os
+
+workers = int(os.getenv('WEB_CONCURRENCY', '1'))
+worker_class = os.getenv('GUNICORN_WORKER_CLASS', 'gthread')
+threads = int(os.getenv('GUNICORN_THREADS', '8'))
+timeout = int(os.getenv('GUNICORN_TIMEOUT', '60'))
@@ -0,0 +1,80 @@
+import os
+import threading
+import stripe
+import gspread
+import requests
+from requests.adapters import HTTPAdapter
+
+
+# Keep-alive connections kept per host; size these to the number of threads
+# that may call each API at once (gunicorn threads + queue workers)
+SHEETS_HTTP_POOL_SIZE = int(os.getenv('SHEETS_HTTP_POOL_SIZE', '16'))
+STRIPE_HTTP_POOL_SIZE = int(os.getenv('STRIPE_HTTP_POOL_SIZE', '16'))
+STRIPE_HTTP_TIMEOUT = int(os.getenv('STRIPE_HTTP_TIMEOUT', '80'))
+
+
+def mount_connection_pool(session, pool_size):
+    """
+    Replace a requests session's adapters with larger keep-alive pools
+
+    urllib3 pools are thread-safe, so one session can be shared by every
+    thread; without this, threads beyond the default 10 connections would
+    open and discard a new TLS connection per request.
+    """
+    adapter = HTTPAdapter(pool_connections=4, pool_maxsize=pool_size)
+    session.mount('https://', adapter)
+    session.mount('http://', adapter)
+    return session
+
+
+def serialize_token_refresh(credentials):
+    """
+    Let only one thread refresh an expired OAuth token
+
+    google-auth refreshes inside each request without a lock, so under
+    many threads every in-flight request would fetch its own token.
+    Threads that were waiting reuse the token the first one obtained.
+    """
+    lock = threading.Lock()
+    refresh = credentials.refresh
+
+    def locked_refresh(request):
+        seen_token = credentials.token
+        with lock:
+            if credentials.token != seen_token and credentials.valid:
+                return
+            refresh(request)
+
+    credentials.refresh = locked_refresh
+    return credentials
+
+
+def authorize_gspread(credentials, pool_size=None):
+    """
+    Build a gspread client that is safe to share between threads
+
+    Args:
+        credentials: oauth2client or google-auth service account credentials
+        pool_size: Keep-alive connections to Google (defaults to SHEETS_HTTP_POOL_SIZE)
+
+    Returns:
+        gspread.Client
+    """
+    client = gspread.authorize(credentials)
+    mount_connection_pool(client.http_client.session, pool_size or SHEETS_HTTP_POOL_SIZE)
+    serialize_token_refresh(client.http_client.auth)
+    return client
+
+
+def configure_stripe_client(pool_size=None, timeout=None):
+    """
+    Route every Stripe API call through one pooled, shared requests session
+
+    The stripe module's global configuration is read-only after startup,
+    so concurrent calls from many threads only contend on the pool.
+    """
+    session = mount_connection_pool(requests.Session(), pool_size or STRIPE_HTTP_POOL_SIZE)
+    stripe.default_http_client = stripe.RequestsClient(
+        session=session, timeout=timeout or STRIPE_HTTP_TIMEOUT
+    )
+    return stripe.default_http_client
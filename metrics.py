@@ -0,0 +1,251 @@
+import time
+import bisect
+import threading
+import contextvars
+from contextlib import contextmanager
+
+
+# Seconds; covers a sub-millisecond index hit up to a fully throttled Sheets call
+DEFAULT_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5,
+                   1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+
+# Event type being handled by the current thread/task, used to label stages
+current_event_type = contextvars.ContextVar('current_event_type', default='none')
+
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def _format_labels(names, values, extra=None):
+    pairs = [f'{name}="{_escape(value)}"' for name, value in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return '{' + ','.join(pairs) + '}' if pairs else ''
+
+
+def _format_value(value):
+    if value == float('inf'):
+        return '+Inf'
+    if isinstance(value, float) and value.is_integer():
+        return str(int(value))
+    return repr(value) if isinstance(value, float) else str(value)
+
+
+class Counter:
+    """Monotonic counter with optional labels"""
+
+    type_name = 'counter'
+
+    def __init__(self, name, help_text, labelnames=()):
+        self.name = name
+        self.help = help_text
+        self.labelnames = tuple(labelnames)
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def inc(self, amount=1, **labels):
+        key = tuple(str(labels.get(name, '')) for name in self.labelnames)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def value(self, **labels):
+        key = tuple(str(labels.get(name, '')) for name in self.labelnames)
+        with self._lock:
+            return self._values.get(key, 0)
+
+    def render(self):
+        with self._lock:
+            items = sorted(self._values.items())
+        return [f'{self.name}{_format_labels(self.labelnames, key)} {_format_value(value)}'
+                for key, value in items]
+
+
+class Histogram:
+    """
+    Fixed-bucket histogram with optional labels
+
+    observe() is a bisect and three additions under a lock; buckets are
+    only made cumulative when rendered.
+    """
+
+    type_name = 'histogram'
+
+    def __init__(self, name, help_text, labelnames=(), buckets=DEFAULT_BUCKETS):
+        self.name = name
+        self.help = help_text
+        self.labelnames = tuple(labelnames)
+        self.buckets = tuple(sorted(buckets))
+        self._series = {}
+        self._lock = threading.Lock()
+
+    def observe(self, value, **labels):
+        key = tuple(str(labels.get(name, '')) for name in self.labelnames)
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            series = self._series.get(key)
+            if series is None:
+                series = self._series[key] = [[0] * (len(self.buckets) + 1), 0.0, 0]
+            series[0][index] += 1
+            series[1] += value
+            series[2] += 1
+
+    def count(self, **labels):
+        key = tuple(str(labels.get(name, '')) for name in self.labelnames)
+        with self._lock:
+            series = self._series.get(key)
+            return series[2] if series else 0
+
+    def render(self):
+        with self._lock:
+            items = sorted((key, (list(s[0]), s[1], s[2])) for key, s in self._series.items())
+        lines = []
+        for key, (counts, total, count) in items:
+            cumulative = 0
+            for bound, bucket_count in zip(self.buckets + (float('inf'),), counts):
+                cumulative += bucket_count
+                le = f'le="{_format_value(float(bound))}"'
+                lines.append(f'{self.name}_bucket{_format_labels(self.labelnames, key, le)} {cumulative}')
+            labels = _format_labels(self.labelnames, key)
+            lines.append(f'{self.name}_sum{labels} {_format_value(total)}')
+            lines.append(f'{self.name}_count{labels} {count}')
+        return lines
+
+
+class Gauge:
+    """
+    Value read from a callback at scrape time
+
+    The callback returns a number, or a dict mapping label value tuples
+    to numbers.
+    """
+
+    def __init__(self, name, help_text, callback, labelnames=(), type_name='gauge'):
+        self.name = name
+        self.help = help_text
+        self.callback = callback
+        self.labelnames = tuple(labelnames)
+        # 'counter' for monotonic totals kept by another component
+        self.type_name = type_name
+
+    def render(self):
+        values = self.callback()
+        if not isinstance(values, dict):
+            values = {(): values}
+        return [f'{self.name}{_format_labels(self.labelnames, key)} {_format_value(value)}'
+                for key, value in sorted(values.items())]
+
+
+class MetricsRegistry:
+    """Collection of metrics rendered together in Prometheus text format"""
+
+    def __init__(self):
+        self._metrics = {}
+        self._lock = threading.Lock()
+
+    def _register(self, metric):
+        with self._lock:
+            existing = self._metrics.get(metric.name)
+            if existing is not None and not isinstance(metric, Gauge):
+                return existing
+            self._metrics[metric.name] = metric
+            return metric
+
+    def counter(self, name, help_text, labelnames=()):
+        return self._register(Counter(name, help_text, labelnames))
+
+    def histogram(self, name, help_text, labelnames=(), buckets=DEFAULT_BUCKETS):
+        return self._register(Histogram(name, help_text, labelnames, buckets))
+
+    def gauge(self, name, help_text, callback, labelnames=(), type_name='gauge'):
+        """Register (or replace) a metric computed by `callback` on each scrape"""
+        return self._register(Gauge(name, help_text, callback, labelnames, type_name))
+
+    def get(self, name):
+        return self._metrics.get(name)
+
+    def render(self):
+        """
+        Render every metric in Prometheus text exposition format
+
+        Returns:
+            str ending in a newline
+        """
+        with self._lock:
+            metrics = list(self._metrics.values())
+        lines = []
+        for metric in metrics:
+            try:
+                samples = metric.render()
+            except Exception:
+                # A broken gauge callback must not take down the whole scrape
+                continue
+            lines.append(f'# HELP {metric.name} {metric.help}')
+            lines.append(f'# TYPE {metric.name} {metric.type_name}')
+            lines.extend(samples)
+        return '\n'.join(lines) + '\n'
+
+
+registry = MetricsRegistry()
+
+STAGE_SECONDS = registry.histogram(
+    'webhook_stage_seconds',
+    'Time spent in each webhook pipeline stage',
+    ('stage', 'event_type')
+)
+STAGE_ERRORS = registry.counter(
+    'webhook_stage_errors_total',
+    'Pipeline stages that raised',
+    ('stage', 'event_type')
+)
+EVENTS = registry.counter(
+    'webhook_events_total',
+    'Webhook events by type and outcome',
+    ('event_type', 'outcome')
+)
+API_CALLS = registry.counter(
+    'external_api_calls_total',
+    'HTTP calls made to Stripe and Google Sheets, by result status',
+    ('api', 'kind', 'status')
+)
+API_THROTTLED = registry.counter(
+    'external_api_throttled_total',
+    'HTTP 429 responses received from Stripe and Google Sheets',
+    ('api', 'kind')
+)
+
+
+@contextmanager
+def stage(name):
+    """
+    Time a pipeline stage into webhook_stage_seconds
+
+    Labeled with the event type of the enclosing event_context(), so a
+    slow stage can be traced back to the events that pay for it.
+    """
+    event_type = current_event_type.get()
+    started = time.perf_counter()
+    try:
+        yield
+    except BaseException:
+        STAGE_ERRORS.inc(stage=name, event_type=event_type)
+        raise
+    finally:
+        STAGE_SECONDS.observe(time.perf_counter() - started, stage=name, event_type=event_type)
+
+
+@contextmanager
+def event_context(event_type):
+    """Label stages timed inside this block with `event_type`"""
+    token = current_event_type.set(event_type)
+    try:
+        yield
+    finally:
+        current_event_type.reset(token)
+
+
+def record_api_call(api, kind, status):
+    """Count one Stripe/Sheets HTTP call and whether it was rate limited"""
+    API_CALLS.inc(api=api, kind=kind, status=status)
+    if str(status) == '429':
+        API_THROTTLED.inc(api=api, kind=kind)
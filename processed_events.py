@@ -0,0 +1,129 @@
+import os
+import time
+import sqlite3
+import threading
+
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS processed_events (
+    event_id TEXT PRIMARY KEY,
+    state TEXT NOT NULL,
+    updated_at REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS idx_processed_events_age ON processed_events (updated_at);
+"""
+
+
+class ProcessedEventStore:
+    """
+    Persistent set of Stripe event IDs that were already handled
+
+    Backed by a SQLite file so duplicates are caught across gunicorn
+    workers and restarts. Entries older than the retention window are
+    pruned; Stripe stops retrying an event after three days.
+    """
+
+    def __init__(self, path=None, retention=None, lease=None):
+        """
+        Args:
+            path: SQLite file path (defaults to PROCESSED_EVENTS_PATH)
+            retention: Seconds to remember an event (defaults to PROCESSED_EVENTS_RETENTION)
+            lease: Seconds an in-progress claim blocks duplicates before it
+                is considered abandoned (e.g. the worker crashed)
+        """
+        self.path = path or os.getenv('PROCESSED_EVENTS_PATH', 'processed_events.db')
+        self.retention = retention or int(os.getenv('PROCESSED_EVENTS_RETENTION', str(7 * 24 * 3600)))
+        self.lease = lease or int(os.getenv('PROCESSED_EVENTS_LEASE', '300'))
+        self.prune_interval = 3600
+        self._last_prune = 0.0
+        self._local = threading.local()
+        self._conn().executescript(SCHEMA)
+
+    def _conn(self):
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=30, isolation_level=None)
+            conn.execute('PRAGMA journal_mode=WAL')
+            conn.execute('PRAGMA synchronous=NORMAL')
+            self._local.conn = conn
+        return conn
+
+    def begin(self, event_id):
+        """
+        Claim an event for processing
+
+        Args:
+            event_id: Stripe event ID (event['id'])
+
+        Returns:
+            True if the caller should process the event, False if it is a
+            duplicate (already done, or being handled elsewhere right now)
+        """
+        conn = self._conn()
+        now = time.time()
+        self._maybe_prune(now)
+
+        conn.execute('BEGIN IMMEDIATE')
+        try:
+            row = conn.execute(
+                'SELECT state, updated_at FROM processed_events WHERE event_id = ?',
+                (event_id,)
+            ).fetchone()
+
+            if row is not None:
+                state, updated_at = row
+                if state == 'done' or updated_at > now - self.lease:
+                    conn.execute('COMMIT')
+                    return False
+
+            conn.execute(
+                "INSERT OR REPLACE INTO processed_events (event_id, state, updated_at) "
+                "VALUES (?, 'processing', ?)",
+                (event_id, now)
+            )
+            conn.execute('COMMIT')
+            return True
+        except Exception:
+            conn.execute('ROLLBACK')
+            raise
+
+    def finish(self, event_id):
+        """Mark a claimed event as handled; later deliveries are duplicates"""
+        self._conn().execute(
+            "UPDATE processed_events SET state = 'done', updated_at = ? WHERE event_id = ?",
+            (time.time(), event_id)
+        )
+
+    def release(self, event_id):
+        """Drop a claim after a failure so Stripe's retry is processed"""
+        self._conn().execute(
+            "DELETE FROM processed_events WHERE event_id = ? AND state = 'processing'",
+            (event_id,)
+        )
+
+    def is_processed(self, event_id):
+        """Check whether an event has been fully handled"""
+        row = self._conn().execute(
+            "SELECT 1 FROM processed_events WHERE event_id = ? AND state = 'done'",
+            (event_id,)
+        ).fetchone()
+        return row is not None
+
+    def prune(self, now=None):
+        """
+        Delete entries older than the retention window
+
+        Returns:
+            Number of rows removed
+        """
+        now = now or time.time()
+        cursor = self._conn().execute(
+            'DELETE FROM processed_events WHERE updated_at < ?',
+            (now - self.retention,)
+        )
+        self._last_prune = now
+        return cursor.rowcount
+
+    def _maybe_prune(self, now):
+        if now - self._last_prune >= self.prune_interval:
+            self.prune(now)
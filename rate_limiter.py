@@ -0,0 +1,303 @@
+import os
+import time
+import random
+import sqlite3
+import logging
+import threading
+from contextlib import contextmanager
+
+import metrics
+
+
+logger = logging.getLogger(__name__)
+
+# HTTP statuses from Google that are worth retrying
+RETRYABLE_STATUS_CODES = {429, 500, 502, 503, 504}
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS quota_buckets (
+    name TEXT PRIMARY KEY,
+    tokens REAL NOT NULL,
+    updated_at REAL NOT NULL,
+    paused_until REAL NOT NULL
+);
+"""
+
+
+class QuotaExceededError(Exception):
+    """Raised when the Sheets quota stays exhausted past the allowed wait"""
+
+    def __init__(self, message, retry_after=None):
+        super().__init__(message)
+        self.retry_after = retry_after
+
+
+class TokenBucket:
+    """Thread-safe token bucket refilled continuously at a fixed rate"""
+
+    def __init__(self, rate_per_minute, burst):
+        """
+        Args:
+            rate_per_minute: Sustained requests per minute
+            burst: Maximum tokens that can accumulate
+        """
+        self.rate = rate_per_minute / 60.0
+        self.capacity = float(burst)
+        self._tokens = float(burst)
+        self._updated_at = time.monotonic()
+        self._paused_until = 0.0
+        self._lock = threading.Lock()
+
+    def _refill(self, now):
+        if now < self._paused_until:
+            self._updated_at = now
+            return
+        start = max(self._updated_at, self._paused_until)
+        self._tokens = min(self.capacity, self._tokens + (now - start) * self.rate)
+        self._updated_at = now
+
+    @contextmanager
+    def _state(self):
+        """Hold the bucket's state for a read-modify-write; yields the time"""
+        with self._lock:
+            yield time.monotonic()
+
+    def try_acquire(self):
+        """Take a token if one is available right now"""
+        return self._take()
+
+    def _take(self):
+        with self._state() as now:
+            self._refill(now)
+            if self._tokens >= 1:
+                self._tokens -= 1
+                return True
+            return False
+
+    def wait_time(self):
+        """Seconds until a token is available (0.0 if one is available now)"""
+        with self._state() as now:
+            self._refill(now)
+            if now < self._paused_until:
+                return self._paused_until - now + max(0.0, 1 - self._tokens) / self.rate
+            if self._tokens >= 1:
+                return 0.0
+            return (1 - self._tokens) / self.rate
+
+    def acquire(self, max_wait):
+        """
+        Block until a token is available
+
+        Args:
+            max_wait: Give up after this many seconds
+
+        Returns:
+            True if a token was taken, False on timeout
+        """
+        deadline = time.monotonic() + max_wait
+        while True:
+            if self._take():
+                return True
+            wait = self.wait_time()
+            if time.monotonic() + wait > deadline:
+                return False
+            time.sleep(max(wait, 0.01))
+
+    def pause(self, seconds):
+        """Stop handing out tokens for `seconds` (after a 429) and empty the bucket"""
+        with self._state() as now:
+            self._paused_until = max(self._paused_until, now + seconds)
+            self._tokens = 0.0
+
+    def remaining(self):
+        """Whole tokens available right now"""
+        with self._state() as now:
+            self._refill(now)
+            if now < self._paused_until:
+                return 0
+            return int(self._tokens)
+
+
+class SharedTokenBucket(TokenBucket):
+    """
+    Token bucket kept in a SQLite file, so every process using the file
+    (gunicorn workers, backfill, reconcile) draws from one budget and a
+    429 seen by one of them pauses all of them
+    """
+
+    def __init__(self, path, name, rate_per_minute, burst):
+        """
+        Args:
+            path: SQLite file path (the coordinator's, see SQLiteCoordinator)
+            name: Bucket name, e.g. 'read'
+            rate_per_minute: Sustained requests per minute
+            burst: Maximum tokens that can accumulate
+        """
+        super().__init__(rate_per_minute, burst)
+        self.path = path
+        self.name = name
+        self._local = threading.local()
+        conn = self._conn()
+        conn.executescript(SCHEMA)
+        conn.execute(
+            'INSERT OR IGNORE INTO quota_buckets (name, tokens, updated_at, paused_until) VALUES (?, ?, ?, 0)',
+            (name, self.capacity, time.time())
+        )
+
+    def _conn(self):
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=30, isolation_level=None)
+            conn.execute('PRAGMA journal_mode=WAL')
+            conn.execute('PRAGMA synchronous=NORMAL')
+            self._local.conn = conn
+        return conn
+
+    @contextmanager
+    def _state(self):
+        """Load the bucket in a write transaction and save it on exit"""
+        conn = self._conn()
+        with self._lock:
+            conn.execute('BEGIN IMMEDIATE')
+            try:
+                self._tokens, self._updated_at, self._paused_until = conn.execute(
+                    'SELECT tokens, updated_at, paused_until FROM quota_buckets WHERE name = ?', (self.name,)
+                ).fetchone()
+                # Wall clock: monotonic clocks aren't comparable across processes
+                yield time.time()
+                conn.execute(
+                    'UPDATE quota_buckets SET tokens = ?, updated_at = ?, paused_until = ? WHERE name = ?',
+                    (self._tokens, self._updated_at, self._paused_until, self.name)
+                )
+                conn.execute('COMMIT')
+            except BaseException:
+                conn.execute('ROLLBACK')
+                raise
+
+
+class QuotaLimiter:
+    """
+    Read/write token buckets sized to the Sheets API per-user quota, plus
+    jittered exponential backoff that honors Retry-After on 429/5xx
+    """
+
+    def __init__(self, read_per_minute=None, write_per_minute=None, burst=None,
+                 max_retries=None, max_wait=None, base_delay=1.0, max_delay=64.0, path=None):
+        """
+        Args:
+            read_per_minute: Read requests per minute (SHEETS_READS_PER_MINUTE)
+            write_per_minute: Write requests per minute (SHEETS_WRITES_PER_MINUTE)
+            burst: Requests allowed back-to-back before throttling (SHEETS_QUOTA_BURST)
+            max_retries: Retries after a retryable error (SHEETS_MAX_RETRIES)
+            max_wait: Seconds a call may wait for budget before failing (SHEETS_QUOTA_MAX_WAIT)
+            base_delay: First backoff delay in seconds
+            max_delay: Backoff ceiling in seconds
+            path: SQLite file to keep the buckets in, shared with every other
+                process using it; None keeps them in this process
+        """
+        read_per_minute = read_per_minute or int(os.getenv('SHEETS_READS_PER_MINUTE', '60'))
+        write_per_minute = write_per_minute or int(os.getenv('SHEETS_WRITES_PER_MINUTE', '60'))
+        burst = burst or int(os.getenv('SHEETS_QUOTA_BURST', '10'))
+        if path:
+            self.buckets = {
+                'read': SharedTokenBucket(path, 'read', read_per_minute, burst),
+                'write': SharedTokenBucket(path, 'write', write_per_minute, burst),
+            }
+        else:
+            self.buckets = {
+                'read': TokenBucket(read_per_minute, burst),
+                'write': TokenBucket(write_per_minute, burst),
+            }
+        self.max_retries = max_retries if max_retries is not None else int(os.getenv('SHEETS_MAX_RETRIES', '5'))
+        self.max_wait = max_wait if max_wait is not None else float(os.getenv('SHEETS_QUOTA_MAX_WAIT', '10'))
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.throttled = 0
+
+    def remaining(self):
+        """
+        Requests that can be made right now without waiting
+
+        Returns:
+            Dict like {'read': 8, 'write': 3}
+        """
+        return {kind: bucket.remaining() for kind, bucket in self.buckets.items()}
+
+    def has_budget(self, kind='write'):
+        """True if a `kind` request can be made without waiting"""
+        return self.buckets[kind].remaining() >= 1
+
+    def backoff(self, attempt, retry_after=None):
+        """Full-jitter exponential delay, never shorter than Retry-After"""
+        delay = random.uniform(0, min(self.max_delay, self.base_delay * 2 ** attempt))
+        if retry_after is not None:
+            delay = max(delay, retry_after)
+        return delay
+
+    @staticmethod
+    def _status_and_retry_after(error):
+        response = getattr(error, 'response', None)
+        status = getattr(response, 'status_code', None)
+        retry_after = None
+        headers = getattr(response, 'headers', None) or {}
+        if headers.get('Retry-After'):
+            try:
+                retry_after = float(headers['Retry-After'])
+            except ValueError:
+                retry_after = None
+        return status, retry_after
+
+    def call(self, kind, fn, *args, idempotent=True, **kwargs):
+        """
+        Run a Sheets API call within the `kind` ('read' or 'write') budget
+
+        Args:
+            kind: 'read' or 'write'
+            fn: The gspread call to make
+            idempotent: False for calls that must not be repeated after a
+                5xx (appends); those are only retried on 429
+
+        Raises:
+            QuotaExceededError: budget not available within max_wait, or
+                still rate limited after max_retries
+        """
+        with metrics.stage(f'sheets_{kind}'):
+            return self._call(kind, fn, args, kwargs, idempotent)
+
+    def _call(self, kind, fn, args, kwargs, idempotent):
+        bucket = self.buckets[kind]
+        attempt = 0
+        while True:
+            with metrics.stage('sheets_quota_wait'):
+                acquired = bucket.acquire(self.max_wait)
+            if not acquired:
+                raise QuotaExceededError(
+                    f'Sheets {kind} quota exhausted', retry_after=bucket.wait_time()
+                )
+            try:
+                result = fn(*args, **kwargs)
+                metrics.record_api_call('sheets', kind, 200)
+                return result
+            except Exception as e:
+                status, retry_after = self._status_and_retry_after(e)
+                metrics.record_api_call('sheets', kind, status or 'error')
+                if status not in RETRYABLE_STATUS_CODES or (status != 429 and not idempotent):
+                    raise
+
+                delay = self.backoff(attempt, retry_after)
+                if status == 429:
+                    self.throttled += 1
+                    # Every thread sharing this bucket backs off, not just this one
+                    bucket.pause(delay)
+
+                if attempt >= self.max_retries:
+                    if status == 429:
+                        raise QuotaExceededError(
+                            f'Sheets {kind} quota exceeded after {attempt + 1} attempts',
+                            retry_after=delay
+                        ) from e
+                    raise
+
+                logger.warning(f'Sheets {kind} call got HTTP {status}, retrying in {delay:.1f}s')
+                attempt += 1
+                time.sleep(delay)
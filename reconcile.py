@@ -0,0 +1,134 @@
+"""
+Reconciliation: fix Subscription Status cells that drifted from Stripe
+Takes one snapshot of the sheet's Customer ID and Status columns, streams
+subscription states from Stripe and writes every correction in one batch,
+after checking under the customers' write lock that the rows still hold them.
+
+Usage (e.g. as an hourly cron job):
+    python reconcile.py
+    python reconcile.py --dry-run
+"""
+
+import os
+import sys
+import argparse
+from datetime import datetime
+
+import stripe
+from dotenv import load_dotenv
+
+from sheets_service import SheetsService, map_subscription_status
+from sharding import sheets_service_from_env
+from coordination import coordinator_from_env
+
+# Fix Windows console encoding
+if sys.platform == 'win32':
+    sys.stdout.reconfigure(encoding='utf-8')  # type: ignore
+
+
+def iter_subscription_states():
+    """
+    (customer_id, stripe_status) for every subscription, newest first
+
+    Customers are not expanded; the ID is all reconciliation needs.
+    """
+    for subscription in stripe.Subscription.list(limit=100, status='all').auto_paging_iter():
+        customer = subscription.get('customer')
+        if isinstance(customer, dict):
+            customer = customer.get('id')
+        if customer:
+            yield customer, subscription.get('status', '')
+
+
+def compute_corrections(snapshot, subscription_states):
+    """
+    Diff the sheet snapshot against Stripe
+
+    Matched customers are removed from `snapshot` as they are seen, so each
+    is judged by its newest subscription and memory only shrinks while
+    Stripe is streamed.
+
+    Args:
+        snapshot: Dict from SheetsService.snapshot_statuses (consumed)
+        subscription_states: Iterable of (customer_id, stripe_status), newest first
+
+    Returns:
+        (corrections, counts): corrections is a list of
+        (row_number, customer_id, sheet_status, stripe_label); counts has
+        'checked', 'skipped' (older subscriptions, customers missing from
+        the sheet) and 'no_subscription'
+    """
+    corrections = []
+    counts = {'checked': 0, 'skipped': 0, 'no_subscription': 0}
+
+    for customer_id, stripe_status in subscription_states:
+        entry = snapshot.pop(SheetsService.normalize_customer_id(customer_id), None)
+        if entry is None:
+            # Not in the sheet, or an older subscription of a customer already checked
+            counts['skipped'] += 1
+            continue
+        counts['checked'] += 1
+        row_number, sheet_status = entry
+        expected = map_subscription_status(stripe_status)
+        if sheet_status != expected:
+            corrections.append((row_number, customer_id, sheet_status, expected))
+
+    # Whatever is left (besides the header row) has no subscription in Stripe
+    counts['no_subscription'] = sum(1 for row_number, _ in snapshot.values() if row_number > 1)
+    return corrections, counts
+
+
+def reconcile(sheets, subscription_states, dry_run=False, timestamp=None):
+    """
+    Run one reconciliation pass
+
+    Args:
+        sheets: Connected SheetsService
+        subscription_states: Iterable of (customer_id, stripe_status), newest first
+        dry_run: Report drift without writing
+        timestamp: Last Updated value for corrected rows (defaults to now, UTC)
+
+    Returns:
+        Dict with 'checked', 'fixed', 'skipped', 'no_subscription'
+        and the list of 'corrections' (those written, unless dry_run)
+    """
+    snapshot = sheets.snapshot_statuses()
+    corrections, counts = compute_corrections(snapshot, subscription_states)
+
+    if corrections and not dry_run:
+        timestamp = timestamp or datetime.utcnow().strftime('%Y-%m-%d %H:%M:%S')
+        # The snapshot is as old as the Stripe stream; rows are checked again
+        corrections = sheets.apply_corrections(corrections, timestamp)
+
+    return dict(counts, fixed=0 if dry_run else len(corrections), corrections=corrections)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Fix sheet statuses that drifted from Stripe')
+    parser.add_argument('--dry-run', action='store_true', help='Report drift without writing')
+    args = parser.parse_args(argv)
+
+    load_dotenv()
+    stripe.api_key = os.getenv('STRIPE_API_KEY')
+    stripe.max_network_retries = 3
+
+    print("="*60)
+    print("Stripe ↔ Google Sheets Reconciliation")
+    print("="*60)
+
+    sheets = sheets_service_from_env(max_wait=120, coordinator=coordinator_from_env())
+    report = reconcile(sheets, iter_subscription_states(), dry_run=args.dry_run)
+
+    for row_number, customer_id, sheet_status, expected in report['corrections']:
+        print(f"  Row {row_number} {customer_id}: {sheet_status or '(empty)'} → {expected}")
+    verb = 'would fix' if args.dry_run else 'fixed'
+    print("="*60)
+    print(f"✅ Checked {report['checked']} customers, {verb} {len(report['corrections'])} rows "
+          f"({report['skipped']} older or unknown subscriptions skipped, "
+          f"{report['no_subscription']} sheet rows without a subscription)")
+    print("="*60)
+    return report
+
+
+if __name__ == "__main__":
+    main()
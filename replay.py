@@ -0,0 +1,278 @@
+"""
+Replay failed webhook events from the dead-letter store
+
+Events are taken in failure order, a batch at a time. Each customer's
+events in a batch are merged in event.created order (as the coalescer
+does) and all merged rows go out in one batched upsert, so a backlog of
+thousands of events costs a few Sheets calls per batch. --rate caps the
+events replayed per second, leaving quota for live webhooks.
+
+Usage (e.g. once Google is back after an outage):
+    python replay.py
+    python replay.py --rate 50 --batch-size 500
+    python replay.py --list
+"""
+
+import os
+import sys
+import time
+import argparse
+import itertools
+
+import stripe
+from dotenv import load_dotenv
+
+from coalescer import EventCoalescer
+from dead_letters import DeadLetterStore
+from processed_events import ProcessedEventStore
+from event_order import ROW_EVENT_TYPES, event_customer_id
+from event_handlers import event_handlers_from_env
+from http_clients import configure_stripe_client
+from coordination import coordinator_from_env
+from sharding import sheets_service_from_env
+from sinks import LocalSink, sink_names
+from webhook_signature import parse_event
+
+# Fix Windows console encoding
+if sys.platform == 'win32':
+    sys.stdout.reconfigure(encoding='utf-8')  # type: ignore
+
+# Events replayed per second, and per batched write
+REPLAY_RATE = float(os.getenv('DEAD_LETTERS_REPLAY_RATE', '20'))
+REPLAY_BATCH_SIZE = int(os.getenv('DEAD_LETTERS_REPLAY_BATCH_SIZE', '200'))
+
+
+def replay_batch(entries, build, dispatch, write_many, processed=None, order=None):
+    """
+    Replay one batch of dead letters
+
+    Args:
+        entries: Dicts from DeadLetterStore.pending
+        build: Callable event -> customer_data, or None for events that
+            don't write a row (EventHandlers.customer_data_for_event)
+        dispatch: Callable handling one event that doesn't write a row
+            (customer.* projection updates, payloads without a customer);
+            raises to retry later, returns False if the event can never
+            succeed (it is dropped)
+        write_many: Callable taking a list of customer_data dicts
+            (CustomerSink.upsert_customers)
+        processed: Optional ProcessedEventStore. Events it has seen
+            handled (e.g. by a Stripe retry) are skipped; replayed ones are
+            marked so later Stripe retries are duplicates.
+        order: Optional EventOrderIndex. Row events older than the newest
+            one applied for their customer are dropped as stale, before
+            they are built.
+
+    Returns:
+        Dict with 'resolved' (ids to remove), 'failed' ((id, error)
+        pairs), 'write_error' (the batched write's exception or None) and
+        counts 'replayed', 'rows', 'skipped', 'stale', 'dropped', 'busy'
+    """
+    report = {'resolved': [], 'failed': [], 'write_error': None,
+              'replayed': 0, 'rows': 0, 'skipped': 0, 'stale': 0, 'dropped': 0, 'busy': 0}
+    claimed = set()
+    by_customer = {}
+    sequence = itertools.count()
+
+    def settle(entry, error=None):
+        if processed is not None and entry['event_id'] in claimed:
+            if error is None:
+                processed.finish(entry['event_id'])
+            else:
+                processed.release(entry['event_id'])
+        if error is None:
+            report['resolved'].append(entry['id'])
+        else:
+            report['failed'].append((entry['id'], error))
+
+    for entry in entries:
+        event_id = entry['event_id']
+        if processed is not None and event_id:
+            if not processed.begin(event_id):
+                if processed.is_processed(event_id):
+                    report['resolved'].append(entry['id'])
+                    report['skipped'] += 1
+                else:
+                    report['busy'] += 1  # being handled right now; try next run
+                continue
+            claimed.add(event_id)
+
+        try:
+            event = parse_event(entry['payload'])
+            if order is not None and _is_stale(order, event):
+                report['stale'] += 1
+                settle(entry)
+                continue
+            customer_data = build(event)
+            handled = dispatch(event) if customer_data is None else None
+        except Exception as e:
+            settle(entry, e)
+            continue
+        if customer_data is None:
+            report['dropped' if handled is False else 'replayed'] += 1
+            settle(entry)
+            continue
+        key = str(customer_data['customer_id']).strip().lower()
+        by_customer.setdefault(key, []).append((event.get('created') or 0, next(sequence), customer_data, entry))
+
+    if by_customer and order is not None:
+        # Claim each customer's newest event; a live webhook may have
+        # applied a newer one since the check above
+        newest = {key: max(created for created, _, _, _ in events)
+                  for key, events in by_customer.items()}
+        applied = order.claim_many((key, created) for key, created in newest.items() if created)
+        for key in [key for key, created in newest.items() if created and key not in applied]:
+            for _, _, _, entry in by_customer.pop(key):
+                report['stale'] += 1
+                settle(entry)
+
+    if by_customer:
+        merged = [EventCoalescer.merge([(created, seq, data) for created, seq, data, _ in events])
+                  for events in by_customer.values()]
+        try:
+            write_many(merged)
+        except Exception as e:
+            report['write_error'] = e
+        for events in by_customer.values():
+            for _, _, _, entry in events:
+                settle(entry, report['write_error'])
+        if report['write_error'] is None:
+            report['replayed'] += sum(len(events) for events in by_customer.values())
+            report['rows'] += len(merged)
+    return report
+
+
+def _is_stale(order, event):
+    customer_id = event_customer_id(event)
+    return (event['type'] in ROW_EVENT_TYPES and customer_id and event.get('created')
+            and order.is_stale(customer_id, event['created']))
+
+
+def replay(store, build, dispatch, write_many, processed=None, order=None, rate=None,
+           batch_size=None, limit=None, sleep=time.sleep):
+    """
+    Drain the dead-letter store at a fixed rate
+
+    Events that fail again stay stored (with their attempt count bumped)
+    and are passed over for the rest of the run. A failed batched write
+    stops the run: the destination is still down.
+
+    Args:
+        store: DeadLetterStore
+        build, dispatch, write_many, processed, order: See replay_batch
+        rate: Max events per second (DEAD_LETTERS_REPLAY_RATE); 0 for no limit
+        batch_size: Events per batch (DEAD_LETTERS_REPLAY_BATCH_SIZE)
+        limit: Stop after this many events
+
+    Returns:
+        Totals: 'replayed', 'rows', 'skipped', 'stale', 'dropped', 'busy', 'failed',
+        'remaining' and 'stopped' (the write error that ended the run, or None)
+    """
+    rate = REPLAY_RATE if rate is None else rate
+    batch_size = batch_size or REPLAY_BATCH_SIZE
+    totals = {'replayed': 0, 'rows': 0, 'skipped': 0, 'stale': 0, 'dropped': 0, 'busy': 0,
+              'failed': 0, 'stopped': None}
+    after_id = 0
+    taken = 0
+
+    while limit is None or taken < limit:
+        entries = store.pending(batch_size if limit is None else min(batch_size, limit - taken), after_id)
+        if not entries:
+            break
+        started = time.monotonic()
+        after_id = entries[-1]['id']
+        taken += len(entries)
+
+        report = replay_batch(entries, build, dispatch, write_many, processed, order)
+        store.resolve(report['resolved'])
+        store.record_failures(report['failed'])
+        for key in ('replayed', 'rows', 'skipped', 'stale', 'dropped', 'busy'):
+            totals[key] += report[key]
+        totals['failed'] += len(report['failed'])
+        print(f"  Batch of {len(entries)}: {report['replayed']} replayed as {report['rows']} rows, "
+              f"{report['skipped']} already handled, {report['stale']} stale, {len(report['failed'])} failed")
+
+        if report['write_error'] is not None:
+            totals['stopped'] = report['write_error']
+            break
+        if rate:
+            sleep(max(0.0, len(entries) / rate - (time.monotonic() - started)))
+
+    totals['remaining'] = store.count()
+    return totals
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Replay failed webhook events from the dead-letter store')
+    parser.add_argument('--rate', type=float, default=REPLAY_RATE,
+                        help='Max events replayed per second (0 = no limit)')
+    parser.add_argument('--batch-size', type=int, default=REPLAY_BATCH_SIZE,
+                        help='Events merged into each batched write')
+    parser.add_argument('--limit', type=int, help='Stop after this many events')
+    parser.add_argument('--list', action='store_true', help='Show stored events without replaying')
+    args = parser.parse_args(argv)
+
+    load_dotenv()
+    store = DeadLetterStore()
+
+    print("="*60)
+    print("Dead-Letter Replay")
+    print("="*60)
+
+    if args.list:
+        for entry in store.pending(args.limit or 1000):
+            print(f"  {entry['event_id']} {entry['event_type']} {entry['customer_id']} "
+                  f"x{entry['attempts']}: {entry['error']}")
+        print(f"{store.count()} events waiting")
+        return None
+
+    stripe.api_key = os.getenv('STRIPE_API_KEY')
+    configure_stripe_client()
+
+    names = sink_names()
+    if names[0] == 'local':
+        # The local record is authoritative: replayed rows go there, and the
+        # webhook server's sync threads carry them on to the other sinks
+        sink = LocalSink(outbox_sinks=names[1:])
+    else:
+        sink = sheets_service_from_env(connect=False, coordinator=coordinator_from_env())
+        sink.start_background_init()
+        if not sink.wait_until_ready(timeout=120):
+            print(f"❌ Google Sheets not ready: {sink.last_error}")
+            return None
+
+    # The webhook's own event -> row mapping, customer lookups and stores
+    handlers = event_handlers_from_env(sink)
+    processed = None
+    if os.getenv('PROCESSED_EVENTS_ENABLED', 'true').lower() == 'true':
+        processed = ProcessedEventStore()
+
+    def dispatch(event):
+        body, status_code = handlers.dispatch_event(event)
+        if status_code >= 400:
+            print(f"  Dropped {event.get('id')}: {body}")
+        return status_code < 400
+
+    totals = replay(
+        store, handlers.customer_data_for_event, dispatch, sink.upsert_customers,
+        processed=processed, order=handlers.event_order,
+        rate=args.rate, batch_size=args.batch_size, limit=args.limit
+    )
+
+    if isinstance(sink, LocalSink) and any(sink.backlog().values()):
+        backlog = ', '.join(f'{count} for {name}' for name, count in sink.backlog().items())
+        print(f"  Rows waiting in the local record ({backlog}); the webhook server syncs them")
+
+    print("="*60)
+    if totals['stopped'] is not None:
+        print(f"❌ Stopped: write failed ({totals['stopped']})")
+    print(f"✅ Replayed {totals['replayed']} events as {totals['rows']} row writes "
+          f"({totals['skipped']} already handled, {totals['stale']} stale, {totals['dropped']} dropped, "
+          f"{totals['failed']} failed, "
+          f"{totals['remaining']} still stored)")
+    print("="*60)
+    return totals
+
+
+if __name__ == "__main__":
+    main()
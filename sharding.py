@@ -0,0 +1,576 @@
+"""
+Route customers across several worksheets (or spreadsheets)
+
+One worksheet slows down and eventually hits the 10M-cell spreadsheet
+limit as the customer base grows, and every Column A read grows with it.
+With SHEETS_SHARDING set, each customer is routed to a shard worksheet by
+a configurable key and remembered in a directory, so lookups and writes
+only ever touch that customer's (small) shard.
+
+Rebuild the directory from the shard worksheets (e.g. after losing the
+directory file, or to adopt rows added by hand):
+
+    python sharding.py --rebuild-directory
+"""
+
+import os
+import sys
+import json
+import time
+import zlib
+import sqlite3
+import argparse
+import importlib
+import threading
+
+import gspread
+from dotenv import load_dotenv
+
+from sheets_service import SheetsService, SheetsNotReadyError
+from rate_limiter import QuotaLimiter
+from coordination import coordinator_from_env
+from sinks import CustomerSink
+
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS shard_directory (
+    customer_key TEXT PRIMARY KEY,
+    shard TEXT NOT NULL,
+    assigned_at REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS shard_directory_shard ON shard_directory (shard);
+"""
+
+# SQLite's default limit on bound parameters is 999
+_SQL_CHUNK = 500
+
+
+def sharding_strategy():
+    """SHEETS_SHARDING, or 'none' (a single worksheet) when unset"""
+    return os.getenv('SHEETS_SHARDING', 'none').strip() or 'none'
+
+
+class ShardRouter:
+    """
+    Pick the shard worksheet for a customer that isn't in the directory yet
+
+    Strategies (SHEETS_SHARDING):
+        hash     crc32 of the customer ID modulo SHEETS_SHARD_COUNT
+        country  the customer's country metadata ('Unknown' when empty)
+        year     the year the customer first reached the sheet
+        module:callable  custom function of customer_data -> shard name
+
+    The directory pins each customer to its first shard, so a customer
+    whose country changes (or who renews in a new year) keeps their row.
+    """
+
+    def __init__(self, strategy=None, shard_count=None, prefix=None):
+        """
+        Args:
+            strategy: See above (defaults to SHEETS_SHARDING)
+            shard_count: Number of hash shards (SHEETS_SHARD_COUNT)
+            prefix: Worksheet title prefix (SHEETS_SHARD_PREFIX)
+
+        Raises:
+            ValueError: unknown strategy, or sharding is off ('none')
+        """
+        self.strategy = (strategy or sharding_strategy()).strip()
+        self.shard_count = shard_count or int(os.getenv('SHEETS_SHARD_COUNT', '4'))
+        self.prefix = prefix or os.getenv('SHEETS_SHARD_PREFIX', 'Customers')
+        self._custom = None
+        if ':' in self.strategy:
+            module_name, _, attr = self.strategy.partition(':')
+            self._custom = getattr(importlib.import_module(module_name), attr)
+        elif self.strategy in ('', 'none'):
+            raise ValueError('Sharding is off (SHEETS_SHARDING=none); pass a strategy')
+        elif self.strategy not in ('hash', 'country', 'year'):
+            raise ValueError(f'Unknown sharding strategy: {self.strategy}')
+
+    def shard_for(self, customer_data):
+        """Worksheet title for a new customer"""
+        if self._custom is not None:
+            return self._custom(customer_data)
+        if self.strategy == 'hash':
+            key = SheetsService.normalize_customer_id(customer_data['customer_id'])
+            return f'{self.prefix} {zlib.crc32(key.encode()) % self.shard_count + 1}'
+        if self.strategy == 'country':
+            country = (customer_data.get('country') or '').strip().upper()
+            return f'{self.prefix} {country or "Unknown"}'
+        # 'timestamp' is 'YYYY-MM-DD HH:MM:SS' in every handler
+        return f'{self.prefix} {str(customer_data.get("timestamp") or "")[:4] or "Unknown"}'
+
+    def known_shards(self):
+        """Shards that exist up front (hash); others appear as customers arrive"""
+        if self.strategy == 'hash':
+            return [f'{self.prefix} {n + 1}' for n in range(self.shard_count)]
+        return []
+
+
+class ShardDirectory:
+    """
+    SQLite table of customer ID -> shard, shared by all workers on the host
+
+    The first assignment wins: concurrent workers routing the same new
+    customer differently (say, one event carried a country and one
+    didn't) all end up writing to the shard that was stored first.
+    """
+
+    def __init__(self, path=None):
+        """
+        Args:
+            path: SQLite file path (defaults to SHEETS_SHARD_DIRECTORY_PATH)
+        """
+        self.path = path or os.getenv('SHEETS_SHARD_DIRECTORY_PATH', 'shard_directory.db')
+        self._local = threading.local()
+        self._conn().executescript(SCHEMA)
+
+    def _conn(self):
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=30, isolation_level=None)
+            conn.execute('PRAGMA journal_mode=WAL')
+            conn.execute('PRAGMA synchronous=NORMAL')
+            self._local.conn = conn
+        return conn
+
+    @staticmethod
+    def _chunks(keys):
+        for start in range(0, len(keys), _SQL_CHUNK):
+            yield keys[start:start + _SQL_CHUNK]
+
+    def get_many(self, keys):
+        """Dict of normalized customer ID -> shard for the keys that are known"""
+        conn = self._conn()
+        shards = {}
+        for chunk in self._chunks(list(keys)):
+            marks = ','.join('?' * len(chunk))
+            shards.update(conn.execute(
+                f'SELECT customer_key, shard FROM shard_directory WHERE customer_key IN ({marks})',
+                chunk
+            ).fetchall())
+        return shards
+
+    def assign_many(self, assignments):
+        """
+        Store customer -> shard for customers that don't have one yet
+
+        Args:
+            assignments: Dict of normalized customer ID -> proposed shard
+
+        Returns:
+            Dict of the same keys -> the shard actually stored
+        """
+        if not assignments:
+            return {}
+        conn = self._conn()
+        now = time.time()
+        conn.execute('BEGIN IMMEDIATE')
+        try:
+            conn.executemany(
+                'INSERT OR IGNORE INTO shard_directory (customer_key, shard, assigned_at) VALUES (?, ?, ?)',
+                [(key, shard, now) for key, shard in assignments.items()]
+            )
+            conn.execute('COMMIT')
+        except Exception:
+            conn.execute('ROLLBACK')
+            raise
+        return self.get_many(assignments)
+
+    def shards(self):
+        """Every shard with at least one customer"""
+        return [row[0] for row in self._conn().execute('SELECT DISTINCT shard FROM shard_directory')]
+
+    def count(self):
+        """Number of customers in the directory"""
+        return self._conn().execute('SELECT COUNT(*) FROM shard_directory').fetchone()[0]
+
+
+class ShardedSheetsService(CustomerSink):
+    """
+    SheetsService-compatible facade over one SheetsService per shard
+
+    Each shard has its own worksheet, Column A index and (with a
+    coordinator) shared row index; all shards share one quota limiter,
+    since Google's per-user quota covers every worksheet.
+    """
+
+    name = 'sheets'
+
+    def __init__(self, router, directory, limiter=None, coordinator=None, connect=True,
+                 spreadsheets=None, worksheet_factory=None):
+        """
+        Args:
+            router: ShardRouter for customers not in the directory
+            directory: ShardDirectory
+            limiter: Optional QuotaLimiter shared with other services
+            coordinator: Optional Coordinator shared with other processes
+            connect: Authorize now (blocking); see start_background_init
+            spreadsheets: Dict of shard -> spreadsheet ID for shards kept in
+                their own spreadsheet (SHEETS_SHARD_SPREADSHEETS)
+            worksheet_factory: Optional function of (shard name, create) ->
+                opened worksheet (skips authentication); raises
+                gspread.exceptions.WorksheetNotFound when `create` is False
+                and the worksheet does not exist
+        """
+        self.scope = [
+            'https://spreadsheets.google.com/feeds',
+            'https://www.googleapis.com/auth/drive'
+        ]
+        self.router = router
+        self.directory = directory
+        self.limiter = limiter or QuotaLimiter()
+        self.coordinator = coordinator
+        self.spreadsheets = spreadsheets or {}
+        self.worksheet_factory = worksheet_factory
+        self.client = None
+        self.last_error = None
+        self._shards = {}
+        self._shards_lock = threading.Lock()
+        self._opening = {}  # shard name -> lock held while it is opened
+        self._ready = threading.Event()
+        self._init_thread = None
+
+        if worksheet_factory is not None:
+            self._ready.set()
+        elif connect:
+            self._connect()
+
+    normalize_customer_id = staticmethod(SheetsService.normalize_customer_id)
+
+    def _authorize(self):
+        return SheetsService._authorize(self)
+
+    def _connect(self):
+        """Authorize once; shard worksheets are opened on first use"""
+        self.client = self._authorize()
+        self.last_error = None
+        self._ready.set()
+
+    def start_background_init(self, initial_delay=1.0, max_delay=60.0):
+        """Authorize in a daemon thread, retrying with exponential backoff"""
+        if self._ready.is_set() or self._init_thread is not None:
+            return
+
+        def run():
+            delay = initial_delay
+            while not self._ready.is_set():
+                try:
+                    self._connect()
+                    print("Google Sheets backend ready")
+                except Exception as e:
+                    self.last_error = str(e)
+                    print(f"Google Sheets init failed, retrying in {delay:.0f}s: {e}")
+                    time.sleep(delay)
+                    delay = min(max_delay, delay * 2)
+
+        self._init_thread = threading.Thread(target=run, name='sheets-init', daemon=True)
+        self._init_thread.start()
+
+    @property
+    def ready(self):
+        """True once the client is authorized"""
+        return self._ready.is_set()
+
+    def wait_until_ready(self, timeout=None):
+        """Block until initialization finishes; returns readiness"""
+        return self._ready.wait(timeout)
+
+    def can_write(self):
+        """Authorized and with write quota left right now"""
+        return self.ready and self.limiter.has_budget('write')
+
+    def status(self):
+        """Readiness summary for health checks"""
+        if self.ready:
+            return {'state': 'ready', 'shards': sorted(self._shards)}
+        return {'state': 'initializing', 'last_error': self.last_error}
+
+    def remaining_budget(self):
+        """Sheets requests available right now, e.g. {'read': 8, 'write': 3}"""
+        return self.limiter.remaining()
+
+    def get_snapshots(self):
+        """
+        Snapshot of every shard that has customers (see SheetsService.get_snapshot)
+
+        Reads never create worksheets: hash shards nobody was routed to yet
+        are left out, and so is a shard whose worksheet was never created.
+        """
+        snapshots = []
+        for shard in sorted(set(self.directory.shards()) | set(self._shards)):
+            try:
+                service = self.shard(shard, create=False)
+            except gspread.exceptions.WorksheetNotFound:
+                continue
+            snapshot = service.get_snapshot()
+            if snapshot is not None:
+                snapshots.append(snapshot)
+        return snapshots
+
+    def update_stats(self):
+        """Row update results summed over the open shards (see SheetsService.update_stats)"""
+        stats = {'written': 0, 'timestamp_only': 0, 'unchanged': 0}
+        for service in list(self._shards.values()):
+            for result, count in service.update_stats().items():
+                if result in stats:
+                    stats[result] += count
+        total = sum(stats.values())
+        stats['skip_ratio'] = round(stats['unchanged'] / total, 4) if total else 0.0
+        return stats
+
+    def shard(self, name, create=True):
+        """
+        The SheetsService for one shard, opening (or creating) its worksheet
+
+        Args:
+            name: Shard worksheet title
+            create: Create the worksheet if it doesn't exist yet
+
+        Raises:
+            SheetsNotReadyError: not authorized yet
+            gspread.exceptions.WorksheetNotFound: missing and `create` is False
+        """
+        service = self._shards.get(name)
+        if service is not None:
+            return service
+        if not self.ready:
+            raise SheetsNotReadyError('Google Sheets backend is still initializing')
+
+        # Opening a worksheet takes a few API calls; only callers of the
+        # same shard wait for it, so it is opened (or created) once
+        with self._shards_lock:
+            opening = self._opening.setdefault(name, threading.Lock())
+        with opening:
+            service = self._shards.get(name)
+            if service is not None:
+                return service
+            if self.worksheet_factory is not None:
+                service = SheetsService(
+                    worksheet=self.worksheet_factory(name, create), limiter=self.limiter,
+                    coordinator=self.coordinator, worksheet_title=name
+                )
+            else:
+                service = SheetsService(
+                    limiter=self.limiter, coordinator=self.coordinator, worksheet_title=name,
+                    spreadsheet_id=self.spreadsheets.get(name), client=self.client,
+                    create_worksheet=create
+                )
+            with self._shards_lock:
+                self._shards[name] = service
+        return service
+
+    def shard_names(self):
+        """Every shard known to the router, the directory or this process"""
+        return sorted(set(self.router.known_shards()) | set(self.directory.shards()) | set(self._shards))
+
+    def route(self, customers):
+        """
+        Shard of each customer, assigning new customers through the router
+
+        Returns:
+            Dict of normalized customer ID -> shard name
+        """
+        latest = {self.normalize_customer_id(data['customer_id']): data for data in customers}
+        shards = self.directory.get_many(latest)
+        proposed = {key: self.router.shard_for(data) for key, data in latest.items() if key not in shards}
+        if proposed:
+            shards.update(self.directory.assign_many(proposed))
+        return shards
+
+    def find_customer_row(self, customer_id):
+        """
+        Row number of a customer within its shard (see SheetsService.find_customer_row)
+
+        Returns:
+            Row number, or None if not found; see locate_customer for the shard
+        """
+        location = self.locate_customer(customer_id)
+        return location[1] if location else None
+
+    def locate_customer(self, customer_id):
+        """
+        Shard and row of a customer
+
+        Returns:
+            (shard, row_number), or None if the customer is not in the sheet
+        """
+        key = self.normalize_customer_id(customer_id)
+        shard = self.directory.get_many([key]).get(key)
+        if shard is None:
+            return None
+        row_number = self.shard(shard).find_customer_row(customer_id)
+        return (shard, row_number) if row_number else None
+
+    def prepare_lookup(self, customer_id):
+        """Load the index of the customer's shard (see SheetsService.prepare_lookup)"""
+        key = self.normalize_customer_id(customer_id)
+        shard = self.directory.get_many([key]).get(key)
+        if shard is None:
+            # New customers are routed (and their shard opened) by the upsert
+            return None
+        return self.shard(shard).prepare_lookup(customer_id)
+
+    def upsert_customer(self, customer_data):
+        """Upsert into the customer's shard (see SheetsService.upsert_customer)"""
+        key = self.normalize_customer_id(customer_data['customer_id'])
+        shard = self.route([customer_data])[key]
+        return self.shard(shard).upsert_customer(customer_data)
+
+    def upsert_customers(self, customers):
+        """Batched upsert: one batch per shard (see SheetsService.upsert_customers)"""
+        shards = self.route(customers)
+        by_shard = {}
+        for customer_data in customers:
+            shard = shards[self.normalize_customer_id(customer_data['customer_id'])]
+            by_shard.setdefault(shard, []).append(customer_data)
+
+        results = {}
+        for shard, shard_customers in by_shard.items():
+            results.update(self.shard(shard).upsert_customers(shard_customers))
+        return results
+
+    def snapshot_statuses(self):
+        """
+        Customer ID and Status columns of every shard (one read per shard)
+
+        Customers found in a shard but missing from the directory (added
+        by hand) are adopted into it, so batch_update_customers can route
+        corrections for them. Shard worksheets that don't exist yet are
+        skipped, not created.
+
+        Returns:
+            Dict of normalized customer ID -> (row_number, status)
+        """
+        snapshot = {}
+        for shard in self.shard_names():
+            try:
+                service = self.shard(shard, create=False)
+            except gspread.exceptions.WorksheetNotFound:
+                continue  # a hash shard nobody was routed to yet
+            shard_snapshot = service.snapshot_statuses()
+            self.directory.assign_many({
+                key: shard for key, (row_number, _) in shard_snapshot.items() if row_number > 1
+            })
+            for key, entry in shard_snapshot.items():
+                snapshot.setdefault(key, entry)
+        return snapshot
+
+    def batch_update_customers(self, updates):
+        """
+        Update existing rows, one batch_update per shard
+
+        Args:
+            updates: Iterable of (row_number, customer_data) pairs; each
+                customer_data needs 'customer_id' to find its shard
+
+        Returns:
+            Number of rows written
+        """
+        updates = list(updates)
+        shards = self.directory.get_many(
+            self.normalize_customer_id(data['customer_id']) for _, data in updates
+        )
+        by_shard = {}
+        for row_number, data in updates:
+            shard = shards.get(self.normalize_customer_id(data['customer_id']))
+            if shard is None:
+                raise KeyError(f"Customer {data['customer_id']} has no shard")
+            by_shard.setdefault(shard, []).append((row_number, data))
+        return sum(self.shard(shard).batch_update_customers(rows) for shard, rows in by_shard.items())
+
+    def apply_corrections(self, corrections, timestamp):
+        """Check and write reconciliation fixes shard by shard (see SheetsService.apply_corrections)"""
+        shards = self.directory.get_many(self.normalize_customer_id(c[1]) for c in corrections)
+        by_shard = {}
+        for correction in corrections:
+            shard = shards.get(self.normalize_customer_id(correction[1]))
+            if shard is None:
+                raise KeyError(f"Customer {correction[1]} has no shard")
+            by_shard.setdefault(shard, []).append(correction)
+
+        applied = []
+        for shard, shard_corrections in by_shard.items():
+            applied.extend(self.shard(shard, create=False).apply_corrections(shard_corrections, timestamp))
+        return applied
+
+    def invalidate_index(self):
+        """Drop every loaded shard's index"""
+        for service in list(self._shards.values()):
+            service.invalidate_index()
+
+    def rebuild_directory(self, shard_names=None):
+        """
+        Re-read Column A of each shard and record its customers
+
+        Existing assignments are kept; a customer found in two shards
+        stays with the one recorded first. Shard worksheets that don't
+        exist are skipped, not created.
+
+        Returns:
+            Number of customers newly added to the directory
+        """
+        before = self.directory.count()
+        for shard in shard_names or self.shard_names():
+            try:
+                service = self.shard(shard, create=False)
+            except gspread.exceptions.WorksheetNotFound:
+                continue
+            index = service.refresh_index()
+            self.directory.assign_many({key: shard for key, row_number in index.items() if row_number > 1})
+        return self.directory.count() - before
+
+    def discover_shards(self):
+        """Shard worksheets present in the main spreadsheet plus mapped spreadsheets"""
+        sheet_id = os.getenv('GOOGLE_SHEET_ID')
+        if sheet_id:
+            spreadsheet = self.client.open_by_key(sheet_id)
+        else:
+            spreadsheet = self.client.open(os.getenv('TARGET_SHEET_NAME', 'Trucking Automation Client Tracker'))
+        titles = [ws.title for ws in spreadsheet.worksheets() if ws.title.startswith(f'{self.router.prefix} ')]
+        return sorted(set(titles) | set(self.spreadsheets))
+
+
+def sheets_service_from_env(limiter=None, connect=True, coordinator=None, max_wait=None):
+    """
+    SheetsService, or ShardedSheetsService when SHEETS_SHARDING is set
+
+    SHEETS_SHARDING: 'none' (default), 'hash', 'country', 'year' or
+    'package.module:function' (see ShardRouter).
+
+    Without a `limiter`, one is built with `max_wait`; processes that
+    coordinate through a SQLite file share its Sheets quota too.
+    """
+    if limiter is None:
+        limiter = QuotaLimiter(max_wait=max_wait, path=getattr(coordinator, 'path', None))
+    strategy = sharding_strategy()
+    if strategy == 'none':
+        return SheetsService(limiter=limiter, connect=connect, coordinator=coordinator)
+    return ShardedSheetsService(
+        ShardRouter(strategy), ShardDirectory(), limiter=limiter, coordinator=coordinator,
+        connect=connect, spreadsheets=json.loads(os.getenv('SHEETS_SHARD_SPREADSHEETS') or '{}')
+    )
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Manage the customer -> shard directory')
+    parser.add_argument('--rebuild-directory', action='store_true',
+                        help='Read every shard worksheet and record its customers')
+    args = parser.parse_args(argv)
+
+    # Fix Windows console encoding
+    if sys.platform == 'win32':
+        sys.stdout.reconfigure(encoding='utf-8')  # type: ignore
+    load_dotenv()
+    service = sheets_service_from_env(max_wait=120, coordinator=coordinator_from_env())
+    if not isinstance(service, ShardedSheetsService):
+        print("SHEETS_SHARDING is not enabled")
+        return
+    if args.rebuild_directory:
+        shards = service.discover_shards()
+        added = service.rebuild_directory(shards)
+        print(f"✅ Read {len(shards)} shards, added {added} customers to {service.directory.path}")
+    print(f"{service.directory.count()} customers in the directory")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,178 @@
+"""
+Sheet column layout resolved from the header row
+
+Columns are located by their header text instead of a fixed position, so
+a column inserted, moved or added by hand never makes a write land in the
+wrong cells. Writes cover only the cells being changed, grouped into the
+fewest contiguous A1 ranges.
+"""
+
+import re
+
+from gspread.utils import rowcol_to_a1
+
+
+# Header text -> customer field, in the layout of worksheets the service
+# creates (SHEET_HEADER)
+COLUMNS = (
+    ('Stripe Customer ID', 'customer_id'),
+    ('Company Name', 'company_name'),
+    ('Contact Name', 'contact_name'),
+    ('Contact Email', 'email'),
+    ('Subscription Status', 'status'),
+    ('Plan Tier', 'plan_tier'),
+    ('Setup Completed', 'setup_completed'),
+    ('Last Updated', 'timestamp'),
+    ('Currency', 'currency'),
+    ('Country', 'country'),
+)
+
+SHEET_HEADER = [header for header, _ in COLUMNS]
+
+# Other header texts accepted for a field (renamed columns)
+ALIASES = {
+    'customer_id': ('Customer ID', 'Stripe ID'),
+    'company_name': ('Company',),
+    'contact_name': ('Contact',),
+    'email': ('Email',),
+    'status': ('Status',),
+    'timestamp': ('Updated',),
+}
+
+
+def _normalize(text):
+    return re.sub(r'\s+', ' ', str(text or '')).strip().casefold()
+
+
+_FIELD_BY_HEADER = {_normalize(header): field for header, field in COLUMNS}
+for _field, _names in ALIASES.items():
+    _FIELD_BY_HEADER.update((_normalize(name), _field) for name in _names)
+
+
+class SheetSchemaError(Exception):
+    """Raised when the header row has no customer ID column"""
+
+
+class SheetSchema:
+    """
+    Field -> column map built from one header row
+
+    Fields without a column in the header are never written.
+    """
+
+    def __init__(self, header, from_header=True):
+        """
+        Args:
+            header: Values of row 1
+            from_header: False for the assumed layout of a sheet whose
+                header row is empty
+
+        Raises:
+            SheetSchemaError: no customer ID column
+        """
+        self.header = ['' if cell is None else str(cell) for cell in header]
+        self.from_header = from_header
+        self.columns = {}
+        for col, text in enumerate(self.header, 1):
+            field = _FIELD_BY_HEADER.get(_normalize(text))
+            if field and field not in self.columns:
+                self.columns[field] = col
+        if 'customer_id' not in self.columns:
+            raise SheetSchemaError(f"Header row has no '{SHEET_HEADER[0]}' column: {self.header}")
+        self.missing = [field for _, field in COLUMNS if field not in self.columns]
+        self.width = max(self.columns.values())
+
+    @classmethod
+    def default(cls):
+        """Layout of a worksheet created with SHEET_HEADER"""
+        return cls(SHEET_HEADER, from_header=False)
+
+    def column(self, field):
+        """1-based column of a field, or None if the sheet has none"""
+        return self.columns.get(field)
+
+    def column_range(self, field):
+        """Whole-column A1 range of a field, e.g. 'E:E'"""
+        letter = rowcol_to_a1(1, self.columns[field])[:-1]
+        return f'{letter}:{letter}'
+
+    def is_header(self, field, text):
+        """True if `text` is a header naming `field`"""
+        return _FIELD_BY_HEADER.get(_normalize(text)) == field
+
+    def row(self, values):
+        """
+        Lay out a new row
+
+        Args:
+            values: Dict of field -> value
+
+        Returns:
+            List up to the last known column; unknown columns are left blank
+        """
+        row = [''] * self.width
+        for field, col in self.columns.items():
+            if field in values:
+                row[col - 1] = values[field]
+        return row
+
+    def ranges(self, rows):
+        """
+        Smallest set of contiguous A1 ranges covering the given cells
+
+        Adjacent columns of a row share one range, and identical column
+        spans on consecutive rows merge into one block.
+
+        Args:
+            rows: Iterable of (row_number, {field: value}); fields without
+                a column are skipped, a later value for a cell wins
+
+        Returns:
+            List of {'range': ..., 'values': ...} dicts for batch_update
+        """
+        cells = {}
+        for row_number, values in rows:
+            row_cells = cells.setdefault(row_number, {})
+            for field, value in values.items():
+                col = self.columns.get(field)
+                if col is not None:
+                    row_cells[col] = value
+
+        # Horizontal runs of adjacent columns, in row order
+        runs = []
+        for row_number in sorted(cells):
+            row_cells = cells[row_number]
+            start = None
+            for col in sorted(row_cells):
+                if start is None or col != end + 1:
+                    if start is not None:
+                        runs.append((row_number, start, end))
+                    start = col
+                end = col
+            if start is not None:
+                runs.append((row_number, start, end))
+
+        # Stack runs with the same span on consecutive rows
+        blocks = []
+        open_blocks = {}
+        for row_number, start, end in runs:
+            block = open_blocks.get((start, end))
+            if block is not None and block['last_row'] == row_number - 1:
+                block['last_row'] = row_number
+            else:
+                block = {'first_row': row_number, 'last_row': row_number, 'start': start, 'end': end}
+                open_blocks[(start, end)] = block
+                blocks.append(block)
+
+        data = []
+        for block in blocks:
+            first = rowcol_to_a1(block['first_row'], block['start'])
+            last = rowcol_to_a1(block['last_row'], block['end'])
+            data.append({
+                'range': first if first == last else f'{first}:{last}',
+                'values': [
+                    [cells[row_number][col] for col in range(block['start'], block['end'] + 1)]
+                    for row_number in range(block['first_row'], block['last_row'] + 1)
+                ],
+            })
+        return data
@@ -0,0 +1,233 @@
+"""
+Columnar in-memory copy of the tracker worksheet
+
+Loaded by the same batch_get that rebuilds the customer ID index and kept
+current by the service's own writes, so the read-only /customers
+endpoints answer from memory without spending Sheets quota. Writes made
+by other processes (or by hand) show up only at the next full read. Each column
+is one list of strings indexed by position; repeated values (statuses,
+plan tiers, countries) are interned and share one string. Filtering by a
+column builds, on first use, a sorted list of positions per distinct
+value, so a filtered page is a slice rather than a scan.
+"""
+
+import sys
+import time
+import bisect
+import heapq
+import itertools
+import threading
+
+from sheet_schema import COLUMNS
+
+
+FIELDS = tuple(field for _, field in COLUMNS)
+
+
+def _matches(cell, target):
+    """Case-insensitive match; 'Standard' also matches 'Standard ($499)'"""
+    cell = cell.casefold()
+    return cell == target or cell.startswith(target + ' (')
+
+
+class SheetSnapshot:
+    """
+    Every customer row of one worksheet, one list per column
+
+    The first row of a customer ID wins, as in the row index. Fields the
+    sheet has no column for read as ''.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._columns = {field: [] for field in FIELDS}
+        self._row_numbers = []
+        self._positions = {}  # normalized customer ID -> position
+        self._postings = {}   # field -> {value: sorted positions}, built on demand
+        self.loaded_at = None
+
+    @staticmethod
+    def normalize_customer_id(customer_id):
+        return str(customer_id).strip().lower()
+
+    def load(self, customer_ids, values, first_row=1, keep=()):
+        """
+        Replace the contents with freshly read columns
+
+        Args:
+            customer_ids: The customer ID column, from row 1
+            values: Dict of field -> column cells, from row 1
+            first_row: First row holding a customer (2 below a header)
+            keep: Normalized IDs whose current values win over the read
+                (written while it was in flight)
+        """
+        columns = {field: [] for field in FIELDS}
+        row_numbers = []
+        positions = {}
+        for idx in range(first_row - 1, len(customer_ids)):
+            key = self.normalize_customer_id(customer_ids[idx])
+            if not key or key in positions:
+                continue
+            positions[key] = len(row_numbers)
+            row_numbers.append(idx + 1)
+            columns['customer_id'].append(str(customer_ids[idx]).strip())
+            for field in FIELDS[1:]:
+                cells = values.get(field, ())
+                columns[field].append(sys.intern(str(cells[idx]).strip()) if idx < len(cells) else '')
+
+        with self._lock:
+            for key in keep:
+                old = self._positions.get(key)
+                if old is None:
+                    continue
+                position = positions.get(key)
+                if position is None:
+                    position = positions[key] = len(row_numbers)
+                    row_numbers.append(self._row_numbers[old])
+                    for field in FIELDS:
+                        columns[field].append('')
+                for field in FIELDS:
+                    columns[field][position] = self._columns[field][old]
+            self._columns = columns
+            self._row_numbers = row_numbers
+            self._positions = positions
+            self._postings = {}
+            self.loaded_at = time.monotonic()
+
+    def update(self, customer_id, fields, row_number=None):
+        """
+        Record values written to a customer's row, adding the row if new
+
+        Args:
+            customer_id: Stripe customer ID
+            fields: Dict of field -> value written
+            row_number: Sheet row, if known
+        """
+        key = self.normalize_customer_id(customer_id)
+        with self._lock:
+            position = self._positions.get(key)
+            if position is None:
+                position = self._positions[key] = len(self._row_numbers)
+                self._row_numbers.append(row_number)
+                for field in FIELDS:
+                    self._columns[field].append('')
+                    if field in self._postings:
+                        self._postings[field].setdefault('', []).append(position)
+                self._set(position, 'customer_id', str(customer_id).strip())
+            elif row_number is not None:
+                self._row_numbers[position] = row_number
+            for field, value in fields.items():
+                if field in self._columns and field != 'customer_id' and value is not None:
+                    self._set(position, field, sys.intern(str(value).strip()))
+
+    def _set(self, position, field, value):
+        """Change one cell, moving its position between postings lists"""
+        column = self._columns[field]
+        old = column[position]
+        column[position] = value
+        postings = self._postings.get(field)
+        if postings is None or old == value:
+            return
+        positions = postings[old]
+        del positions[bisect.bisect_left(positions, position)]
+        if not positions:
+            del postings[old]
+        bisect.insort(postings.setdefault(value, []), position)
+
+    def _postings_for(self, field):
+        postings = self._postings.get(field)
+        if postings is None:
+            postings = {}
+            for position, value in enumerate(self._columns[field]):
+                postings.setdefault(value, []).append(position)
+            self._postings[field] = postings
+        return postings
+
+    def expire(self):
+        """Have the next get_snapshot() re-read the sheet"""
+        self.loaded_at = None
+
+    def is_stale(self, ttl):
+        return self.loaded_at is None or time.monotonic() - self.loaded_at > ttl
+
+    def age(self):
+        """Seconds since the last full read, or None before the first"""
+        return None if self.loaded_at is None else time.monotonic() - self.loaded_at
+
+    def __len__(self):
+        return len(self._row_numbers)
+
+    def _row(self, position):
+        row = {field: column[position] for field, column in self._columns.items()}
+        row['row'] = self._row_numbers[position]
+        return row
+
+    def get(self, customer_id):
+        """
+        One customer's row
+
+        Returns:
+            Dict of field -> value plus 'row' (sheet row number), or None
+        """
+        with self._lock:
+            position = self._positions.get(self.normalize_customer_id(customer_id))
+            return None if position is None else self._row(position)
+
+    def query(self, filters=None, offset=0, limit=100):
+        """
+        Rows matching every filter, in sheet order
+
+        Args:
+            filters: Dict of field -> value, e.g. {'status': 'Past Due'}
+                (case-insensitive; a plan tier name matches with its price)
+            offset: Matching rows to skip
+            limit: Max rows returned
+
+        Returns:
+            (number of matching rows, list of row dicts)
+        """
+        with self._lock:
+            if not filters:
+                positions = range(len(self._row_numbers))
+                return len(positions), [self._row(i) for i in positions[offset:offset + limit]]
+
+            # Positions per filter, from the values that match it
+            matches = []
+            for field, value in filters.items():
+                target = str(value).strip().casefold()
+                matches.append([positions for cell, positions in self._postings_for(field).items()
+                                if _matches(cell, target)])
+            matches.sort(key=lambda lists: sum(len(positions) for positions in lists))
+
+            lists = matches[0]
+            positions = lists[0] if len(lists) == 1 else list(heapq.merge(*lists))
+            for lists in matches[1:]:
+                # Narrow the smallest match down by the others
+                others = set(itertools.chain.from_iterable(lists))
+                positions = [i for i in positions if i in others]
+            return len(positions), [self._row(i) for i in positions[offset:offset + limit]]
+
+
+def find_customer(snapshots, customer_id):
+    """First row for a customer across several snapshots (shards), or None"""
+    for snapshot in snapshots:
+        row = snapshot.get(customer_id)
+        if row is not None:
+            return row
+    return None
+
+
+def query_snapshots(snapshots, filters=None, offset=0, limit=100):
+    """
+    SheetSnapshot.query over several snapshots, paged as one listing
+
+    Returns:
+        (number of matching rows, list of row dicts)
+    """
+    total = 0
+    rows = []
+    for snapshot in snapshots:
+        count, page = snapshot.query(filters, max(0, offset - total), limit - len(rows))
+        total += count
+        rows.extend(page)
+    return total, rows
@@ -1,40 +1,696 @@
 import os
+import json
+import time
+import threading
+import contextlib
 import gspread
+from gspread.utils import ValueInputOption, a1_to_rowcol, rowcol_to_a1
 from oauth2client.service_account import ServiceAccountCredentials
+from rate_limiter import QuotaLimiter, QuotaExceededError
+from http_clients import authorize_gspread
+import metrics
+from sinks import CustomerSink
+from sheet_schema import SheetSchema, SheetSchemaError, SHEET_HEADER
+from sheet_snapshot import SheetSnapshot
 from datetime import datetime
 
 
-class SheetsService:
-    """Service for managing Google Sheets operations with idempotency"""
+# How long the customer-ID -> row index is trusted before Column A is re-read.
+# Rows inserted, deleted or sorted by hand are picked up on the next refresh.
+INDEX_TTL_SECONDS = int(os.getenv('SHEETS_INDEX_TTL_SECONDS', '300'))
+
+# Resolved spreadsheet/worksheet metadata and the OAuth token, shared by all
+# workers on the host so each one can skip the Drive search and token fetch.
+CONNECTION_CACHE_PATH = os.getenv('SHEETS_CONNECTION_CACHE', '.sheets_cache.json')
+CONNECTION_CACHE_TTL = int(os.getenv('SHEETS_CONNECTION_CACHE_TTL', '3600'))
+
+# How long the header-derived column map is trusted by reads (index refresh,
+# reconcile snapshots); every write re-reads row 1 along with its rows
+SCHEMA_TTL_SECONDS = int(os.getenv('SHEETS_SCHEMA_TTL_SECONDS', '300'))
+
+# Fields rewritten when an existing customer changes
+UPDATE_FIELDS = ('status', 'timestamp')
+
+# A1 ranges per batch_get; they travel in the query string, so a large
+# batch of rows is checked in several requests of bounded URL length
+READ_RANGES_PER_REQUEST = 100
+
+# Skip updates that would rewrite a row's current values. Status and Last
+# Updated come back with the Customer ID check made before every write, so
+# the comparison costs no extra quota and sees writes made by other
+# processes or by hand; an unchanged row only gets a fresh Last Updated
+# once it is this old.
+SKIP_UNCHANGED_ROWS = os.getenv('SHEETS_SKIP_UNCHANGED', 'true').lower() == 'true'
+TIMESTAMP_REFRESH_HOURS = float(os.getenv('SHEETS_TIMESTAMP_REFRESH_HOURS', '24'))
+
+# Keep every column of the worksheet in memory for the read-only
+# /customers endpoints; the index refresh then reads all known columns
+SNAPSHOT_ENABLED = os.getenv('SHEETS_SNAPSHOT_ENABLED', 'false').lower() == 'true'
+
+# Last Updated as the app writes it, and as Sheets may display it back
+TIMESTAMP_FORMATS = ('%Y-%m-%d %H:%M:%S', '%m/%d/%Y %H:%M:%S')
+
+
+def parse_timestamp(value):
+    """Parse a Last Updated value, or return None if it isn't one"""
+    for fmt in TIMESTAMP_FORMATS:
+        try:
+            return datetime.strptime(str(value).strip(), fmt)
+        except ValueError:
+            continue
+    return None
+
+
+def map_subscription_status(stripe_status):
+    """Map Stripe subscription status to our status labels"""
+    status_mapping = {
+        'active': 'Active',
+        'trialing': 'Trial',
+        'past_due': 'Past Due',
+        'canceled': 'Cancelled',
+        'unpaid': 'Unpaid',
+        'incomplete': 'Incomplete',
+        'incomplete_expired': 'Expired',
+        'paused': 'Paused'
+    }
+    return status_mapping.get(stripe_status.lower(), stripe_status.title())
+
+
+class SheetsNotReadyError(Exception):
+    """Raised when the Sheets backend has not finished initializing"""
+
+
+class _CustomerLocks:
+    """One lock per customer ID within this process, created on demand"""
 
     def __init__(self):
-        """Initialize Google Sheets client"""
+        self._locks = {}
+        self._mutex = threading.Lock()
+
+    @contextlib.contextmanager
+    def hold(self, keys):
+        """Hold the locks for `keys`, taken in sorted order to avoid deadlock"""
+        acquired = []
+        try:
+            for key in sorted(set(keys)):
+                with self._mutex:
+                    entry = self._locks.setdefault(key, [threading.Lock(), 0])
+                    entry[1] += 1
+                entry[0].acquire()
+                acquired.append((key, entry))
+            yield
+        finally:
+            for key, entry in reversed(acquired):
+                entry[0].release()
+                with self._mutex:
+                    entry[1] -= 1
+                    if entry[1] == 0:
+                        del self._locks[key]
+
+
+class _PendingInsert:
+    """
+    Reservation for a new customer row that has not been sent yet
+
+    Events for the same customer that arrive while the append waits for
+    quota merge into it instead of queueing behind it.
+    """
+
+    def __init__(self, customer_data):
+        self.customer_data = dict(customer_data)
+        self.sent = False
+        self.error = None
+        self._lock = threading.Lock()
+        self._done = threading.Event()
+
+    def merge(self, customer_data):
+        """Fold a later event into the row; False once the append has gone out"""
+        with self._lock:
+            if self.sent:
+                return False
+            self.customer_data.update(
+                {field: value for field, value in customer_data.items() if value is not None}
+            )
+            return True
+
+    def seal(self):
+        """Freeze the row contents as the append request is built"""
+        with self._lock:
+            self.sent = True
+            return self.customer_data
+
+    def finish(self, error=None):
+        self.error = error
+        self._done.set()
+
+    def wait(self):
+        """Block until the append lands; re-raises its error"""
+        self._done.wait()
+        if self.error is not None:
+            raise self.error
+
+
+def _cache_suffix(title):
+    """File-name-safe form of a worksheet title"""
+    return ''.join(c if c.isalnum() else '_' for c in title)
+
+
+class ConnectionCache:
+    """Small JSON file holding resolved sheet metadata and the access token"""
+
+    def __init__(self, path=None, ttl=None):
+        self.path = path or CONNECTION_CACHE_PATH
+        self.ttl = ttl if ttl is not None else CONNECTION_CACHE_TTL
+
+    def load(self, target):
+        """
+        Read the cache for a sheet target (GOOGLE_SHEET_ID or sheet name)
+
+        Returns:
+            Dict with 'spreadsheet_id', 'worksheet' (properties) and maybe
+            'token'/'token_expiry' - or None if missing, stale or for another sheet
+        """
+        try:
+            with open(self.path) as f:
+                data = json.load(f)
+        except (OSError, ValueError):
+            return None
+
+        if data.get('target') != target or time.time() - data.get('saved_at', 0) > self.ttl:
+            return None
+        return data
+
+    def save(self, target, spreadsheet_id, worksheet_properties, token=None, token_expiry=None):
+        """Atomically replace the cache file (readable by this user only)"""
+        data = {
+            'target': target,
+            'saved_at': time.time(),
+            'spreadsheet_id': spreadsheet_id,
+            'worksheet': worksheet_properties,
+            'token': token,
+            'token_expiry': token_expiry.isoformat() if token_expiry else None,
+        }
+        tmp_path = f'{self.path}.{os.getpid()}.tmp'
+        try:
+            fd = os.open(tmp_path, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600)
+            with os.fdopen(fd, 'w') as f:
+                json.dump(data, f)
+            os.replace(tmp_path, self.path)
+        except OSError as e:
+            print(f"Could not write Sheets connection cache: {e}")
+
+    def clear(self):
+        try:
+            os.remove(self.path)
+        except OSError:
+            pass
+
+
+class SheetsService(CustomerSink):
+    """Service for managing Google Sheets operations with idempotency"""
+
+    name = 'sheets'
+
+    def __init__(self, worksheet=None, limiter=None, connect=True, coordinator=None,
+                 worksheet_title=None, spreadsheet_id=None, client=None, skip_unchanged=None,
+                 snapshot=None, create_worksheet=True):
+        """
+        Initialize Google Sheets client
+
+        Args:
+            worksheet: Optional pre-opened worksheet (skips authentication)
+            limiter: Optional QuotaLimiter shared with other services
+            connect: Connect now (blocking). Pass False and call
+                start_background_init() to serve requests while connecting
+            coordinator: Optional Coordinator shared with other processes
+                (per-customer write locks and a shared row index)
+            worksheet_title: Worksheet to use instead of the first one;
+                created with SHEET_HEADER if it doesn't exist (shards)
+            spreadsheet_id: Spreadsheet to open instead of GOOGLE_SHEET_ID
+            client: Optional authorized gspread client to share
+            skip_unchanged: Skip updates that match the row's current values
+                (defaults to SHEETS_SKIP_UNCHANGED)
+            snapshot: Keep a SheetSnapshot of the worksheet (defaults to
+                SHEETS_SNAPSHOT_ENABLED)
+            create_worksheet: Create a missing worksheet_title; when False,
+                connecting raises gspread.exceptions.WorksheetNotFound
+        """
         self.scope = [
             'https://spreadsheets.google.com/feeds',
             'https://www.googleapis.com/auth/drive'
         ]
+        self.client = client
+        self.spreadsheet = None
+        self.worksheet = None
+        self.worksheet_title = worksheet_title
+        self.spreadsheet_id = spreadsheet_id
+        self.create_worksheet = create_worksheet
+        # Shards keep their own row index in the coordinator and their own cache file
+        self.index_scope = worksheet_title or ''
+        self.connection_cache = ConnectionCache(
+            f'{CONNECTION_CACHE_PATH}.{_cache_suffix(worksheet_title)}' if worksheet_title else None
+        )
+        self.last_error = None
+        self._ready = threading.Event()
+        self._init_thread = None
+
+        if worksheet is not None:
+            self.worksheet = worksheet
+            self._ready.set()
+        elif connect:
+            self._connect()
+
+        # Every Sheets API call goes through the quota limiter
+        self.limiter = limiter or QuotaLimiter()
+        self.coordinator = coordinator
+
+        # Customer ID index (normalized ID -> row number), built lazily
+        self._row_index = None
+        self._index_loaded_at = 0.0
+        self._last_row = 0
+        self._index_lock = threading.Lock()    # guards index mutation
+        self._refresh_lock = threading.Lock()  # one Column A read at a time
+
+        self.skip_unchanged = SKIP_UNCHANGED_ROWS if skip_unchanged is None else skip_unchanged
+        self._written_at = {}  # normalized ID -> when our last write to it finished
+        self._update_counts = {'written': 0, 'timestamp_only': 0, 'unchanged': 0}
+        self.snapshot = SheetSnapshot() if (SNAPSHOT_ENABLED if snapshot is None else snapshot) else None
+
+        # Column layout from the header row, built lazily
+        self._schema = None
+        self._schema_loaded_at = 0.0
+        self._schema_lock = threading.Lock()
+
+        # Per-customer locks make find-then-append atomic within the process;
+        # new rows waiting to be appended accept later events for the customer
+        self._customer_locks = _CustomerLocks()
+        self._pending_inserts = {}
+        self._pending_lock = threading.Lock()
+
+    def _connect(self):
+        """Authenticate and open the target worksheet"""
+        client = self.client or self._authorize()
+        auth = client.http_client.auth
 
+        # Open the target sheet
+        sheet_name = os.getenv('TARGET_SHEET_NAME', 'Trucking Automation Client Tracker')
+        sheet_id = self.spreadsheet_id or os.getenv('GOOGLE_SHEET_ID')
+        target = sheet_id or sheet_name
+        if self.worksheet_title:
+            target = f'{target}#{self.worksheet_title}'
+
+        cached = self.connection_cache.load(target)
+        if cached and cached.get('token') and cached.get('token_expiry'):
+            # Reuse another worker's token; google-auth refreshes it when it expires
+            auth.token = cached['token']
+            auth.expiry = datetime.fromisoformat(cached['token_expiry'])
+
+        if cached:
+            # No Drive search or metadata fetch - the worksheet is rebuilt from cache
+            spreadsheet = None
+            worksheet = gspread.Worksheet(
+                None, cached['worksheet'], cached['spreadsheet_id'], client.http_client
+            )
+        else:
+            if sheet_id:
+                spreadsheet = client.open_by_key(sheet_id)
+            else:
+                spreadsheet = client.open(sheet_name)
+            worksheet = self._open_worksheet(spreadsheet)
+
+        if not cached or cached.get('token') != auth.token:
+            self.connection_cache.save(
+                target, worksheet.spreadsheet_id, worksheet._properties,
+                auth.token, auth.expiry
+            )
+
+        self.client = client
+        self.spreadsheet = spreadsheet
+        self.worksheet = worksheet
+        self.last_error = None
+        self._ready.set()
+
+    def _open_worksheet(self, spreadsheet):
+        """The first worksheet, or worksheet_title (created if missing and allowed)"""
+        if not self.worksheet_title:
+            return spreadsheet.sheet1
+        try:
+            return spreadsheet.worksheet(self.worksheet_title)
+        except gspread.exceptions.WorksheetNotFound:
+            if not self.create_worksheet:
+                raise
+            worksheet = spreadsheet.add_worksheet(self.worksheet_title, rows=1000, cols=len(SHEET_HEADER))
+            worksheet.append_row(SHEET_HEADER)
+            print(f"Created worksheet: {self.worksheet_title}")
+            return worksheet
+
+    def _authorize(self):
+        """Build the gspread client from the service account key file"""
         # Authenticate using service account
         creds = ServiceAccountCredentials.from_json_keyfile_name(
             'credentials.json',
             self.scope
         )
-        self.client = gspread.authorize(creds)
+        return authorize_gspread(creds)
 
-        # Open the target sheet
-        sheet_name = os.getenv('TARGET_SHEET_NAME', 'Trucking Automation Client Tracker')
-        sheet_id = os.getenv('GOOGLE_SHEET_ID')
+    def start_background_init(self, initial_delay=1.0, max_delay=60.0):
+        """
+        Connect in a daemon thread, retrying with exponential backoff
+
+        Requests made before it finishes raise SheetsNotReadyError.
+        """
+        if self._ready.is_set() or self._init_thread is not None:
+            return
+
+        def run():
+            delay = initial_delay
+            while not self._ready.is_set():
+                try:
+                    self._connect()
+                    print("Google Sheets backend ready")
+                except Exception as e:
+                    self.last_error = str(e)
+                    # A stale cache (renamed sheet, revoked token) must not wedge startup
+                    self.connection_cache.clear()
+                    print(f"Google Sheets init failed, retrying in {delay:.0f}s: {e}")
+                    time.sleep(delay)
+                    delay = min(max_delay, delay * 2)
+
+        self._init_thread = threading.Thread(target=run, name='sheets-init', daemon=True)
+        self._init_thread.start()
+
+    @property
+    def ready(self):
+        """True once the worksheet is open"""
+        return self._ready.is_set()
+
+    def wait_until_ready(self, timeout=None):
+        """Block until initialization finishes; returns readiness"""
+        return self._ready.wait(timeout)
+
+    def can_write(self):
+        """Connected and with write quota left right now"""
+        return self.ready and self.limiter.has_budget('write')
+
+    def status(self):
+        """Readiness summary for health checks"""
+        if self.ready:
+            return {'state': 'ready'}
+        return {'state': 'initializing', 'last_error': self.last_error}
+
+    def _sheet(self):
+        if self.worksheet is None:
+            raise SheetsNotReadyError('Google Sheets backend is still initializing')
+        return self.worksheet
+
+    def remaining_budget(self):
+        """Sheets requests available right now, e.g. {'read': 8, 'write': 3}"""
+        return self.limiter.remaining()
+
+    @staticmethod
+    def normalize_customer_id(customer_id):
+        """Normalize a customer ID the same way Column A is matched"""
+        return str(customer_id).strip().lower()
+
+    def get_schema(self, force=False):
+        """
+        Column layout from the header row
+
+        Row 1 is re-read at most every SCHEMA_TTL_SECONDS, or sooner after
+        invalidate_index(); writes also get it with their row check (see
+        _read_rows). An unchanged header keeps the cached map; a moved
+        customer ID column also drops the row index.
 
-        if sheet_id:
-            self.spreadsheet = self.client.open_by_key(sheet_id)
+        Raises:
+            SheetSchemaError: the header has no customer ID column
+        """
+        schema = self._schema
+        if schema is not None and not force and \
+                time.monotonic() - self._schema_loaded_at <= SCHEMA_TTL_SECONDS:
+            return schema
+
+        requested_at = time.monotonic()
+        with self._schema_lock:
+            previous = self._schema
+            if previous is not None and self._schema_loaded_at >= requested_at:
+                return previous
+            return self._use_header(self.limiter.call('read', self._sheet().row_values, 1))
+
+    def _use_header(self, header):
+        """Resolve the column map from row 1 as just read (hold _schema_lock)"""
+        previous = self._schema
+        if previous is not None and header == previous.header:
+            schema = previous
+        elif not any(str(cell or '').strip() for cell in header):
+            # Blank sheet: rows go where a created worksheet puts them
+            schema = SheetSchema.default()
         else:
-            self.spreadsheet = self.client.open(sheet_name)
+            schema = SheetSchema(header)
+            if schema.missing:
+                print(f"Sheet has no column for: {', '.join(schema.missing)}")
+        if previous is not None and schema.column('customer_id') != previous.column('customer_id'):
+            self.invalidate_index()
+        self._schema = schema
+        self._schema_loaded_at = time.monotonic()
+        return schema
+
+    def _read_index_columns(self, schema):
+        """
+        Read the ID column, together with every known column for the
+        snapshot, in one request
+
+        Returns:
+            (customer ID cells, {field: cells})
+        """
+        if self.snapshot is None:
+            return self.limiter.call('read', self._sheet().col_values, schema.column('customer_id')), {}
+        fields = [field for field in schema.columns if field != 'customer_id']
+        columns = self.limiter.call(
+            'read', self._sheet().batch_get,
+            [schema.column_range(field) for field in ('customer_id', *fields)], major_dimension='COLUMNS'
+        )
+        cells = [column[0] if column else [] for column in columns]
+        return cells[0], dict(zip(fields, cells[1:]))
+
+    def refresh_index(self):
+        """
+        Rebuild the customer ID index from a single read of the ID column
+
+        The first occurrence of an ID wins, matching the old top-down scan.
+        With a snapshot, the same request returns every known column.
+        """
+        started = time.monotonic()
+        schema = self.get_schema()
+        customer_ids, values = self._read_index_columns(schema)
+        if schema.from_header and customer_ids and not schema.is_header('customer_id', customer_ids[0]):
+            # The column moved since the header was read: free revalidation
+            schema = self.get_schema(force=True)
+            customer_ids, values = self._read_index_columns(schema)
+
+        index = {}
+        for idx, cell_value in enumerate(customer_ids):
+            key = self.normalize_customer_id(cell_value)
+            if key and key not in index:
+                index[key] = idx + 1  # gspread uses 1-based indexing
+
+        with self._index_lock:
+            # A write that finished during the read may not be in it
+            self._written_at = {key: t for key, t in self._written_at.items() if t >= started}
+            self._row_index = index
+            self._last_row = len(customer_ids)
+            self._index_loaded_at = time.monotonic()
+            if self.snapshot is not None:
+                self.snapshot.load(customer_ids, values, first_row=2 if schema.from_header else 1,
+                                   keep=self._written_at)
+
+        if self.coordinator is not None:
+            # Other processes can load this instead of reading Column A themselves
+            self.coordinator.set_rows(index, replace=True, scope=self.index_scope)
+        return index
+
+    def snapshot_statuses(self):
+        """
+        Read the Customer ID and Subscription Status columns in one request
+
+        Only the two columns are fetched, not the whole sheet. The first
+        occurrence of an ID wins, as in the row index.
+
+        Returns:
+            Dict of normalized customer ID -> (row_number, status)
+        """
+        schema = self.get_schema()
+        ranges = [schema.column_range('customer_id')]
+        if schema.column('status'):
+            ranges.append(schema.column_range('status'))
+        columns = self.limiter.call(
+            'read', self._sheet().batch_get, ranges, major_dimension='COLUMNS'
+        )
+        customer_ids = columns[0][0] if columns[0] else []
+        statuses = columns[1][0] if len(columns) > 1 and columns[1] else []
+
+        snapshot = {}
+        for idx, cell_value in enumerate(customer_ids):
+            key = self.normalize_customer_id(cell_value)
+            if key and key not in snapshot:
+                status = statuses[idx] if idx < len(statuses) else ''
+                snapshot[key] = (idx + 1, status.strip())
+        return snapshot
+
+    def _read_rows(self, rows):
+        """
+        Read the header and the Customer ID and UPDATE_FIELDS cells of
+        indexed rows in one request
+
+        Row 1 comes back with the rows, so a column inserted or moved by
+        hand is seen before every write: the column map is rebuilt from
+        it, and the rows are read again if their columns moved.
+
+        Args:
+            rows: Dict of normalized customer ID -> row number
+
+        Returns:
+            Dict of normalized customer ID -> {field: cell value} for the
+            rows that still hold their customer
+        """
+        schema = self.get_schema()
+        header, current = self._read_cells(schema, rows)
+        with self._schema_lock:
+            resolved = self._use_header(header)
+        if resolved.columns != schema.columns:
+            print("Sheet columns changed; re-reading rows under the new header")
+            _, current = self._read_cells(resolved, rows)
+        return current
+
+    def _read_cells(self, schema, rows):
+        """
+        Read row 1 and each row's cells under `schema`
+
+        Adjacent rows share one range. batch_get puts every range in the
+        URL, so they are sent at most READ_RANGES_PER_REQUEST per request.
+
+        Returns:
+            (header, {normalized customer ID: {field: cell value}}) for the
+            rows that still hold their customer
+        """
+        columns = {field: schema.column(field) for field in ('customer_id', *UPDATE_FIELDS) if schema.column(field)}
+        first, last = min(columns.values()), max(columns.values())
+
+        spans = []
+        for row_number in sorted(set(rows.values())):
+            if spans and spans[-1][1] == row_number - 1:
+                spans[-1][1] = row_number
+            else:
+                spans.append([row_number, row_number])
+        ranges = ['1:1'] + [f'{rowcol_to_a1(start, first)}:{rowcol_to_a1(end, last)}' for start, end in spans]
+        results = []
+        for offset in range(0, len(ranges), READ_RANGES_PER_REQUEST):
+            results.extend(self.limiter.call(
+                'read', self._sheet().batch_get, ranges[offset:offset + READ_RANGES_PER_REQUEST]
+            ))
+        header = results[0][0] if results and results[0] else []
+
+        cells_by_row = {}
+        for (start, _), result in zip(spans, results[1:]):
+            for offset, cells in enumerate(result or []):
+                cells_by_row[start + offset] = cells
+
+        current = {}
+        for key, row_number in rows.items():
+            cells = cells_by_row.get(row_number, [])
+            values = {field: str(cells[col - first]).strip() if col - first < len(cells) else ''
+                      for field, col in columns.items()}
+            if self.normalize_customer_id(values['customer_id']) == key:
+                current[key] = values
+        return header, current
+
+    def _check_rows(self, rows):
+        """
+        Make sure indexed rows still hold their customers before writing
+
+        A sort or rows inserted by hand move customers without the index
+        knowing. If any row moved, Column A is re-read and the rows are
+        looked up again.
+
+        Args:
+            rows: Dict of normalized customer ID -> row number, or None
+                for customers not in the sheet
+
+        Returns:
+            (rows, current): the row numbers to write, and the cells
+            each found customer's row holds now (see _read_rows)
+
+        Raises:
+            RuntimeError: rows moved again right after the re-read
+        """
+        found = {key: row_number for key, row_number in rows.items() if row_number}
+        current = self._read_rows(found)
+        if len(current) == len(found):
+            return rows, current
+
+        print(f"{len(found) - len(current)} indexed row(s) hold other customers now; re-reading Column A")
+        index, _ = self._get_index(force=True)
+        rows = {key: index.get(key) for key in rows}
+        found = {key: row_number for key, row_number in rows.items() if row_number}
+        current = self._read_rows(found)
+        if len(current) < len(found):
+            self.invalidate_index()
+            raise RuntimeError('Sheet rows are moving; not writing until they settle')
+        return rows, current
+
+    def invalidate_index(self):
+        """Drop the index so the next lookup re-reads Column A (and the header)"""
+        with self._index_lock:
+            self._row_index = None
+        self._schema_loaded_at = 0.0
+        if self.snapshot is not None:
+            self.snapshot.expire()
+        if self.coordinator is not None:
+            try:
+                self.coordinator.clear_rows(scope=self.index_scope)
+            except Exception as e:
+                print(f"Error clearing shared row index: {e}")
+
+    def _index_is_stale(self):
+        if self._row_index is None:
+            return True
+        return time.monotonic() - self._index_loaded_at > INDEX_TTL_SECONDS
 
-        self.worksheet = self.spreadsheet.sheet1
+    def _get_index(self, force=False):
+        """
+        Return a usable index, re-reading Column A when stale or forced
+
+        Concurrent callers share one read: a thread that waited for the
+        refresh lock reuses the index another thread just built.
+
+        Returns:
+            (index dict, True if this call triggered a read)
+        """
+        index = self._row_index
+        if index is not None and not force and not self._index_is_stale():
+            return index, False
+
+        requested_at = time.monotonic()
+        with self._refresh_lock:
+            index = self._row_index
+            if index is not None and self._index_loaded_at >= requested_at:
+                return index, False
+            if index is not None and not force and not self._index_is_stale():
+                return index, False
+            if not force and self.coordinator is not None:
+                shared = self.coordinator.load_index(INDEX_TTL_SECONDS, scope=self.index_scope)
+                if shared is not None:
+                    with self._index_lock:
+                        self._row_index = shared
+                        self._index_loaded_at = time.monotonic()
+                    return shared, False
+            return self.refresh_index(), True
 
     def find_customer_row(self, customer_id):
         """
-        Find row number for existing customer by searching Column A
+        Find row number for existing customer using the Column A index
+
+        A miss against an index that was not just built triggers one
+        refresh, so rows added to the sheet by hand are never duplicated.
 
         Args:
             customer_id: Stripe Customer ID to search for
@@ -42,40 +698,282 @@ class SheetsService:
         Returns:
             Row number if found, None otherwise
         """
-        try:
-            # Get all values in Column A (Customer ID column)
-            customer_ids = self.worksheet.col_values(1)
+        key = self.normalize_customer_id(customer_id)
+        with metrics.stage('sheets_lookup'):
+            try:
+                index, refreshed = self._get_index()
+                row_number = index.get(key)
+                if row_number is None and not refreshed:
+                    row_number = self._shared_row(key)
+                if row_number is None and not refreshed:
+                    index, _ = self._get_index(force=True)
+                    row_number = index.get(key)
 
-            # Search for customer_id (case-insensitive)
-            for idx, cell_value in enumerate(customer_ids):
-                if cell_value.strip().lower() == customer_id.lower():
-                    return idx + 1  # gspread uses 1-based indexing
+                return row_number
+            except (QuotaExceededError, SheetsNotReadyError, SheetSchemaError):
+                # Treating these as "not found" would append a duplicate row
+                raise
+            except Exception as e:
+                print(f"Error finding customer row: {e}")
+                self.invalidate_index()
+                return None
 
+    def prepare_lookup(self, customer_id):
+        """
+        Make sure the index is loaded, without the refresh-on-miss
+
+        Lets callers overlap the Column A read with other work (e.g. the
+        Stripe customer fetch) before upsert_customer runs.
+
+        Returns:
+            Row number if the customer is already indexed, None otherwise
+        """
+        index, _ = self._get_index()
+        return index.get(self.normalize_customer_id(customer_id))
+
+    def _shared_row(self, key):
+        """Row another process appended for `key`, if the shared index has it"""
+        if self.coordinator is None:
             return None
-        except Exception as e:
-            print(f"Error finding customer row: {e}")
-            return None
+        row_number = self.coordinator.get_rows([key], INDEX_TTL_SECONDS, scope=self.index_scope).get(key)
+        if row_number is not None:
+            with self._index_lock:
+                if self._row_index is not None:
+                    self._row_index.setdefault(key, row_number)
+        return row_number
 
-    def update_existing_customer(self, row_number, customer_data):
+    @contextlib.contextmanager
+    def _write_lock(self, customer_ids):
+        """Lock customers for a find-then-write sequence, across processes too"""
+        keys = [self.normalize_customer_id(c) for c in customer_ids]
+        with self._customer_locks.hold(keys):
+            if self.coordinator is None:
+                yield
+            else:
+                with self.coordinator.lock(keys):
+                    yield
+
+    def update_existing_customer(self, row_number, customer_data, current=None):
         """
-        Update existing customer row (Column E = Status, Column H = Timestamp)
+        Update existing customer row (Subscription Status and Last Updated)
+
+        Both cells go out in a single batch_update request. Nothing is
+        written if the row already holds these values (see changed_fields).
 
         Args:
             row_number: Row number to update
             customer_data: Dictionary with customer data
+            current: The row's cells as just read, if known
+
+        Returns:
+            'updated', or 'unchanged' if the write was skipped
         """
-        try:
-            # Update Column E (Status) - assuming E is column 5
-            self.worksheet.update_cell(row_number, 5, customer_data['status'])
+        changes = self.changed_fields(customer_data, current)
+        if changes is None:
+            return 'unchanged'
+        self.batch_update_customers([(row_number, changes)])
+        print(f"Updated existing customer at row {row_number}")
+        return 'updated'
 
-            # Update Column H (Timestamp) - assuming H is column 8
-            self.worksheet.update_cell(row_number, 8, customer_data['timestamp'])
+    def changed_fields(self, customer_data, current=None):
+        """
+        What an update must write, given the row's current values
 
-            print(f"Updated existing customer at row {row_number}")
-            return 'updated'
+        A changed field writes all UPDATE_FIELDS. If only Last Updated
+        differs, it is written once the current value is
+        SHEETS_TIMESTAMP_REFRESH_HOURS older than the new one. Without
+        the current values the update is always written.
+
+        Args:
+            customer_data: Dictionary with customer data
+            current: Dict of field -> the row's cell value, read just
+                before the write (see _check_rows)
+
+        Returns:
+            customer_data, a copy holding only the timestamp, or None if
+            nothing needs writing
+        """
+        if not self.skip_unchanged:
+            return customer_data
+        if current is None or any(
+            customer_data.get(field) is not None and str(customer_data[field]).strip() != current.get(field)
+            for field in UPDATE_FIELDS if field != 'timestamp'
+        ):
+            self._count_update('written')
+            return customer_data
+
+        new, old = parse_timestamp(customer_data.get('timestamp')), parse_timestamp(current.get('timestamp'))
+        if new is not None and old is not None and \
+                (new - old).total_seconds() < TIMESTAMP_REFRESH_HOURS * 3600:
+            self._count_update('unchanged')
+            return None
+        self._count_update('timestamp_only')
+        return {'customer_id': customer_data['customer_id'], 'timestamp': customer_data.get('timestamp')}
+
+    def _count_update(self, result):
+        with self._index_lock:
+            self._update_counts[result] += 1
+
+    def update_stats(self):
+        """
+        Updates to existing rows by result since startup
+
+        Returns:
+            Dict with 'written', 'timestamp_only', 'unchanged' counts and
+            'skip_ratio' (unchanged / all updates)
+        """
+        with self._index_lock:
+            stats = dict(self._update_counts)
+        total = sum(stats.values())
+        stats['skip_ratio'] = round(stats['unchanged'] / total, 4) if total else 0.0
+        return stats
+
+    def get_snapshot(self):
+        """
+        The worksheet snapshot, re-read once older than SHEETS_INDEX_TTL_SECONDS
+
+        A stale snapshot is served as is while the read quota is spent, so
+        readers never hold up webhook writes.
+
+        Returns:
+            SheetSnapshot, or None when the snapshot is disabled
+
+        Raises:
+            SheetsNotReadyError: nothing loaded yet and not connected
+        """
+        snapshot = self.snapshot
+        if snapshot is None or not snapshot.is_stale(INDEX_TTL_SECONDS):
+            return snapshot
+        if snapshot.loaded_at is not None and not self.limiter.has_budget('read'):
+            return snapshot
+        with self._refresh_lock:
+            if snapshot.is_stale(INDEX_TTL_SECONDS):
+                self.refresh_index()
+        return snapshot
+
+    def get_snapshots(self):
+        """Snapshots to query (one per worksheet; see ShardedSheetsService)"""
+        snapshot = self.get_snapshot()
+        return [] if snapshot is None else [snapshot]
+
+    def _remember_values(self, updates, new_rows=False):
+        """
+        Record the cells just written in the snapshot
+
+        Args:
+            updates: (row_number, customer_data) pairs
+            new_rows: The rows were appended, so every column was written
+                (row numbers come from the index)
+        """
+        if self.snapshot is None:
+            return
+        now = time.monotonic()
+        schema = self._schema
+        with self._index_lock:
+            for row_number, customer_data in updates:
+                key = self.normalize_customer_id(customer_data['customer_id'])
+                self._written_at[key] = now
+                if new_rows:
+                    fields = self.new_row_values(customer_data)
+                    row_number = (self._row_index or {}).get(key)
+                else:
+                    fields = {field: customer_data.get(field) for field in UPDATE_FIELDS}
+                if schema is not None:
+                    fields = {field: value for field, value in fields.items() if schema.column(field)}
+                self.snapshot.update(customer_data['customer_id'], fields, row_number)
+
+    def build_update_ranges(self, updates, schema=None):
+        """
+        Build the A1 ranges written when existing customers change
+
+        Only UPDATE_FIELDS are written, in the columns the header names
+        them; adjacent cells share a range (see SheetSchema.ranges).
+
+        Args:
+            updates: Iterable of (row_number, customer_data) pairs
+            schema: SheetSchema to use (defaults to get_schema())
+
+        Returns:
+            List of {'range': ..., 'values': ...} dicts for batch_update
+        """
+        schema = schema or self.get_schema()
+        return schema.ranges(
+            (row_number, {field: customer_data[field] for field in UPDATE_FIELDS
+                          if customer_data.get(field) is not None})
+            for row_number, customer_data in updates
+        )
+
+    def batch_update_customers(self, updates):
+        """
+        Update many existing customer rows with one Sheets API call
+
+        Args:
+            updates: Iterable of (row_number, customer_data) pairs
+
+        Returns:
+            Number of rows written
+        """
+        updates = list(updates)
+        if not updates:
+            return 0
+        data = self.build_update_ranges(updates)
+        if not data:
+            return 0
+
+        try:
+            # USER_ENTERED keeps the same parsing update_cell used
+            # gspread prefixes each range with the sheet title in place, so
+            # every attempt gets fresh dicts or a retry doubles the prefix
+            self.limiter.call(
+                'write', lambda: self._sheet().batch_update(
+                    [dict(entry) for entry in data],
+                    value_input_option=ValueInputOption.user_entered
+                )
+            )
         except Exception as e:
             print(f"Error updating customer: {e}")
+            # The row may have moved under us; re-read Column A next time
+            self.invalidate_index()
             raise
+        self._remember_values([(row_number, data) for row_number, data in updates if data.get('customer_id')])
+        return len(updates)
+
+    def apply_corrections(self, corrections, timestamp):
+        """
+        Write reconciliation fixes to the rows an earlier snapshot found
+
+        Stripe is streamed for minutes between the snapshot and this write,
+        so the rows are checked again under the customers' write lock, as
+        upsert_customer does: a moved customer is looked up again, and a row
+        whose status changed since the snapshot (a webhook got there first)
+        is left for the next pass.
+
+        Args:
+            corrections: List of (row_number, customer_id, sheet_status,
+                expected_status), see reconcile.compute_corrections
+            timestamp: Last Updated value for corrected rows
+
+        Returns:
+            The corrections written, with the rows they were written to
+        """
+        latest = {self.normalize_customer_id(c[1]): c for c in corrections}
+        if not latest:
+            return []
+
+        with self._write_lock(c[1] for c in latest.values()):
+            rows, current = self._check_rows({key: c[0] for key, c in latest.items()})
+            applied = []
+            for key, (_, customer_id, sheet_status, expected) in latest.items():
+                if rows[key] and current[key].get('status', '') == sheet_status:
+                    applied.append((rows[key], customer_id, sheet_status, expected))
+            self.batch_update_customers([
+                (row_number, {'customer_id': customer_id, 'status': expected, 'timestamp': timestamp})
+                for row_number, customer_id, _, expected in applied
+            ])
+
+        if len(applied) < len(latest):
+            print(f"{len(latest) - len(applied)} correction(s) skipped: row changed since the snapshot")
+        return applied
 
     def get_plan_tier(self, amount):
         """
@@ -104,51 +1002,175 @@ class SheetsService:
         else:
             return f"{tier_name} (${amount_rounded})"
 
+    def new_row_values(self, customer_data):
+        """
+        Field values of a new customer's row (see sheet_schema.COLUMNS)
+
+        Args:
+            customer_data: Dictionary with customer data
+        """
+        # Extract contact name from email (before @)
+        contact_name = customer_data.get('email', '').split('@')[0] if customer_data.get('email') else ''
+
+        return {
+            'customer_id': customer_data['customer_id'],
+            'company_name': customer_data['company_name'],
+            'contact_name': contact_name,
+            'email': customer_data['email'],
+            'status': customer_data['status'],
+            'plan_tier': self.get_plan_tier(customer_data['amount']),  # e.g. "Standard ($499)"
+            'setup_completed': 'FALSE',
+            'timestamp': customer_data['timestamp'],
+            'currency': customer_data['currency'],
+            'country': customer_data.get('country', ''),  # from Stripe metadata or empty
+        }
+
+    def build_new_row(self, customer_data, schema=None):
+        """
+        Build a sheet row for a new customer, in the header's column order
+
+        Columns the service doesn't know are left blank, and the row ends
+        at the last known column.
+
+        Args:
+            customer_data: Dictionary with customer data
+            schema: SheetSchema to use (defaults to get_schema())
+        """
+        return (schema or self.get_schema()).row(self.new_row_values(customer_data))
+
     def append_new_customer(self, customer_data):
         """
         Append new customer row with all data points
 
         Args:
-            customer_data: Dictionary with customer data
+            customer_data: Dictionary with customer data (see build_new_row)
+        """
+        self.append_new_customers([customer_data])
+        print(f"Appended new customer: {customer_data['customer_id']}")
+        return 'created'
+
+    def append_new_customers(self, customers):
+        """
+        Append many new customer rows with one Sheets API call
+
+        Args:
+            customers: List of customer data dictionaries
 
-        Sheet columns mapping (Actual Sheet Structure):
-        A: Stripe Customer ID
-        B: Company Name
-        C: Contact Name
-        D: Contact Email
-        E: Subscription Status
-        F: Plan Tier
-        G: Setup Completed
-        H: Last Updated
-        I: Currency
-        J: Country
+        Returns:
+            Number of rows appended
         """
+        if not customers:
+            return 0
+        self._append_rows(
+            [data['customer_id'] for data in customers],
+            lambda schema: [self.build_new_row(data, schema) for data in customers]
+        )
+        self._remember_values([(None, data) for data in customers], new_rows=True)
+        return len(customers)
+
+    def _append_rows(self, customer_ids, build_rows):
+        """
+        Send one append_rows request and record where the rows landed
+
+        Args:
+            customer_ids: Customer ID of each row, in order
+            build_rows: Called with the SheetSchema when the request is
+                sent (after any quota wait) to produce the row values
+        """
+        sheet = self._sheet()
+        schema = self.get_schema()
         try:
-            # Extract contact name from email (before @)
-            contact_name = customer_data.get('email', '').split('@')[0] if customer_data.get('email') else ''
-
-            # Get formatted plan tier
-            plan_tier = self.get_plan_tier(customer_data['amount'])
-
-            new_row = [
-                customer_data['customer_id'],      # Column A: Stripe Customer ID
-                customer_data['company_name'],     # Column B: Company Name
-                contact_name,                      # Column C: Contact Name (extracted from email)
-                customer_data['email'],            # Column D: Contact Email
-                customer_data['status'],           # Column E: Subscription Status
-                plan_tier,                         # Column F: Plan Tier (e.g., "Standard ($499)")
-                'FALSE',                           # Column G: Setup Completed (default FALSE)
-                customer_data['timestamp'],        # Column H: Last Updated
-                customer_data['currency'],         # Column I: Currency
-                customer_data.get('country', '')   # Column J: Country (from Stripe metadata or empty)
-            ]
-
-            self.worksheet.append_row(new_row)
-            print(f"Appended new customer: {customer_data['customer_id']}")
-            return 'created'
+            # Not retried on 5xx: the rows may already have been appended
+            response = self.limiter.call(
+                'write', lambda: sheet.append_rows(build_rows(schema)), idempotent=False
+            )
         except Exception as e:
             print(f"Error appending customer: {e}")
+            self.invalidate_index()
             raise
+        self._record_appended_rows(customer_ids, response)
+
+    @staticmethod
+    def appended_first_row(response):
+        """
+        First row number written by append_rows
+
+        Read from updates.updatedRange (e.g. "'Sheet1'!A42:J43"), which is
+        exact even when other processes append at the same time.
+
+        Returns:
+            Row number, or None if the response doesn't say
+        """
+        try:
+            updated_range = response['updates']['updatedRange']
+        except (TypeError, KeyError):
+            return None
+        start_cell = updated_range.rsplit('!', 1)[-1].split(':')[0]
+        try:
+            return a1_to_rowcol(start_cell)[0]
+        except Exception:
+            return None
+
+    def _record_appended_rows(self, customer_ids, response):
+        keys = [self.normalize_customer_id(c) for c in customer_ids]
+        first_row = self.appended_first_row(response)
+
+        if first_row is None:
+            if self.coordinator is not None:
+                # Other processes append too, so _last_row can't locate the
+                # new rows; the next lookup for these customers refreshes
+                return
+            # append_rows writes directly below the last filled row
+            first_row = self._last_row + 1
+
+        rows = {}
+        for offset, key in enumerate(keys):
+            rows.setdefault(key, first_row + offset)
+        with self._index_lock:
+            self._last_row = max(self._last_row, first_row + len(keys) - 1)
+            if self._row_index is not None:
+                for key, row_number in rows.items():
+                    self._row_index.setdefault(key, row_number)
+        if self.coordinator is not None:
+            self.coordinator.set_rows(rows, scope=self.index_scope)
+
+    def _merge_into_pending_insert(self, key, customer_data):
+        """
+        Fold an event into a new row that is still waiting to be sent
+
+        Returns:
+            True once the merged row has been appended, False if there is
+            no such row (the caller goes through the normal path)
+        """
+        with self._pending_lock:
+            pending = self._pending_inserts.get(key)
+        if pending is None or not pending.merge(customer_data):
+            return False
+        pending.wait()
+        return True
+
+    def _insert_reserved(self, key, customer_data):
+        """Append a new customer behind a reservation later events can merge into"""
+        pending = _PendingInsert(customer_data)
+        with self._pending_lock:
+            self._pending_inserts[key] = pending
+        try:
+            self._append_rows(
+                [customer_data['customer_id']],
+                lambda schema: [self.build_new_row(pending.seal(), schema)]
+            )
+        except Exception as e:
+            pending.finish(e)
+            raise
+        else:
+            pending.finish()
+            self._remember_values([(None, pending.customer_data)], new_rows=True)
+        finally:
+            with self._pending_lock:
+                if self._pending_inserts.get(key) is pending:
+                    del self._pending_inserts[key]
+        print(f"Appended new customer: {customer_data['customer_id']}")
+        return 'created'
 
     def upsert_customer(self, customer_data):
         """
@@ -166,16 +1188,78 @@ class SheetsService:
                 - timestamp
 
         Returns:
-            'updated' if customer was updated, 'created' if new customer was added
+            'updated' if customer was updated, 'created' if new customer was added,
+            'unchanged' if the row already held these values
         """
         customer_id = customer_data['customer_id']
+        key = self.normalize_customer_id(customer_id)
 
-        # Check if customer already exists
-        existing_row = self.find_customer_row(customer_id)
+        # A new row for this customer is still waiting for quota: ride along
+        if self._merge_into_pending_insert(key, customer_data):
+            print(f"Merged into pending insert: {customer_id}")
+            return 'updated'
 
-        if existing_row:
-            # Update existing customer
-            return self.update_existing_customer(existing_row, customer_data)
-        else:
-            # Append new customer
-            return self.append_new_customer(customer_data)
+        # No other thread (or, with a coordinator, process) can append this
+        # customer between the lookup and the write
+        with self._write_lock([customer_id]):
+            # Check if customer already exists, and is still on that row
+            rows, current = self._check_rows({key: self.find_customer_row(customer_id)})
+            existing_row = rows[key]
+
+            if existing_row:
+                # Update existing customer
+                return self.update_existing_customer(existing_row, customer_data, current[key])
+            else:
+                # Append new customer
+                return self._insert_reserved(key, customer_data)
+
+    def upsert_customers(self, customers):
+        """
+        Batched upsert: one write for all updates and one for all new rows
+
+        Several entries for the same customer collapse into the last one.
+
+        Args:
+            customers: List of customer data dictionaries (see upsert_customer)
+
+        Returns:
+            Dictionary mapping customer_id to 'updated', 'created' or 'unchanged'
+        """
+        latest = {}
+        for customer_data in customers:
+            latest[self.normalize_customer_id(customer_data['customer_id'])] = customer_data
+
+        with self._write_lock(data['customer_id'] for data in latest.values()):
+            index, refreshed = self._get_index()
+            rows = {key: index.get(key) for key in latest}
+            missing = [key for key, row_number in rows.items() if row_number is None]
+            if missing and not refreshed and self.coordinator is not None:
+                rows.update(self.coordinator.get_rows(missing, INDEX_TTL_SECONDS, scope=self.index_scope))
+                missing = [key for key, row_number in rows.items() if row_number is None]
+            if missing and not refreshed:
+                # Same miss rule as find_customer_row, but one read for the batch
+                index, _ = self._get_index(force=True)
+                rows = {key: index.get(key) for key in latest}
+            rows, current = self._check_rows(rows)
+
+            updates = []
+            new_customers = []
+            results = {}
+            for key, customer_data in latest.items():
+                row_number = rows[key]
+                if row_number:
+                    changes = self.changed_fields(customer_data, current[key])
+                    if changes is None:
+                        results[customer_data['customer_id']] = 'unchanged'
+                        continue
+                    updates.append((row_number, changes))
+                    results[customer_data['customer_id']] = 'updated'
+                else:
+                    new_customers.append(customer_data)
+                    results[customer_data['customer_id']] = 'created'
+
+            self.batch_update_customers(updates)
+            self.append_new_customers(new_customers)
+        unchanged = len(results) - len(updates) - len(new_customers)
+        print(f"Batch upsert: {len(updates)} updated, {len(new_customers)} created, {unchanged} unchanged")
+        return results
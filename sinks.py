@@ -0,0 +1,451 @@
+"""
+Customer sinks: where upserted customer rows are written
+
+CUSTOMER_SINKS=sheets (default) writes every event straight to Google
+Sheets, as before. CUSTOMER_SINKS=local,sheets keeps the authoritative
+record in a local SQLite file at disk speed and lets the Sheet follow as
+a downstream view: each downstream sink has its own sync thread, batch
+and retry state, so a slow or failing Sheet never holds up the webhook
+or the other sinks.
+"""
+
+import os
+import time
+import uuid
+import sqlite3
+import logging
+import threading
+from abc import ABC, abstractmethod
+
+import metrics
+
+
+logger = logging.getLogger(__name__)
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS customer_records (
+    customer_key TEXT PRIMARY KEY,
+    customer_id TEXT NOT NULL,
+    company_name TEXT,
+    email TEXT,
+    subscription_id TEXT,
+    status TEXT,
+    amount REAL,
+    currency TEXT,
+    country TEXT,
+    last_updated TEXT,
+    version INTEGER NOT NULL,
+    created_at REAL NOT NULL
+);
+CREATE TABLE IF NOT EXISTS sink_outbox (
+    sink TEXT NOT NULL,
+    customer_key TEXT NOT NULL,
+    version INTEGER NOT NULL,
+    claimed_by TEXT,
+    claimed_until REAL NOT NULL DEFAULT 0,
+    PRIMARY KEY (sink, customer_key)
+);
+"""
+
+# customer_data key -> customer_records column
+_FIELDS = (
+    ('customer_id', 'customer_id'),
+    ('company_name', 'company_name'),
+    ('email', 'email'),
+    ('subscription_id', 'subscription_id'),
+    ('status', 'status'),
+    ('amount', 'amount'),
+    ('currency', 'currency'),
+    ('country', 'country'),
+    ('timestamp', 'last_updated'),
+)
+
+SYNC_FAILURES = metrics.registry.counter(
+    'sink_sync_failures_total',
+    'Failed batches pushed to a downstream customer sink',
+    ('sink',)
+)
+
+
+class CustomerSink(ABC):
+    """
+    Destination for upserted customer rows
+
+    Implementations: SheetsService, ShardedSheetsService, LocalSink and
+    FanOutSink. Results are 'created' or 'updated' per customer, or
+    'unchanged' when the row already held the values (Sheets only).
+    """
+
+    name = 'sink'
+
+    def upsert_customer(self, customer_data):
+        """Write one customer; returns 'created', 'updated' or 'unchanged'"""
+        return self.upsert_customers([customer_data])[customer_data['customer_id']]
+
+    @abstractmethod
+    def upsert_customers(self, customers):
+        """Write many customers; returns {customer_id: 'created' | 'updated' | 'unchanged'}"""
+
+    @property
+    def ready(self):
+        return True
+
+    def can_write(self):
+        """False while writes would only wait or fail (not connected, no quota)"""
+        return self.ready
+
+
+class LocalSink(CustomerSink):
+    """
+    SQLite table holding the latest state of every customer
+
+    Each write bumps the row's version and, in the same transaction, marks
+    the customer in the outbox of every downstream sink, so a crash can
+    never lose a change the Sheet hasn't seen yet. Sync threads claim
+    outbox batches before sending them, so every worker process can drain
+    the same file without two of them sending one customer at once.
+    """
+
+    name = 'local'
+
+    def __init__(self, path=None, outbox_sinks=(), claim_ttl=None):
+        """
+        Args:
+            path: SQLite file path (defaults to LOCAL_SINK_PATH)
+            outbox_sinks: Names of the downstream sinks fed from this record
+            claim_ttl: Seconds before a batch claimed by a crashed process
+                is handed out again (SINK_SYNC_CLAIM_TTL); must exceed the
+                longest downstream write
+        """
+        self.path = path or os.getenv('LOCAL_SINK_PATH', 'customer_records.db')
+        self.outbox_sinks = list(outbox_sinks)
+        self.claim_ttl = claim_ttl or float(os.getenv('SINK_SYNC_CLAIM_TTL', '300'))
+        self._local = threading.local()
+        self._conn().executescript(SCHEMA)
+
+    def _conn(self):
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=30, isolation_level=None)
+            conn.execute('PRAGMA journal_mode=WAL')
+            conn.execute('PRAGMA synchronous=NORMAL')
+            self._local.conn = conn
+        return conn
+
+    @staticmethod
+    def normalize_customer_id(customer_id):
+        return str(customer_id).strip().lower()
+
+    def upsert_customers(self, customers):
+        """
+        Store many customers in one transaction
+
+        Fields that are None keep their stored value.
+        """
+        results = {}
+        if not customers:
+            return results
+        columns = [column for _, column in _FIELDS]
+        assignments = ', '.join(f'{column} = COALESCE(excluded.{column}, {column})' for column in columns)
+        now = time.time()
+
+        conn = self._conn()
+        conn.execute('BEGIN IMMEDIATE')
+        try:
+            for customer_data in customers:
+                key = self.normalize_customer_id(customer_data['customer_id'])
+                existed = conn.execute(
+                    'SELECT 1 FROM customer_records WHERE customer_key = ?', (key,)
+                ).fetchone() is not None
+                conn.execute(
+                    f'INSERT INTO customer_records (customer_key, {", ".join(columns)}, version, created_at) '
+                    f'VALUES (?, {", ".join("?" * len(columns))}, 1, ?) '
+                    f'ON CONFLICT (customer_key) DO UPDATE SET {assignments}, version = version + 1',
+                    (key, *[customer_data.get(field) for field, _ in _FIELDS], now)
+                )
+                # A claimed entry keeps its claim, so no other process sends
+                # the new version while the old one is still on its way
+                conn.executemany(
+                    'INSERT INTO sink_outbox (sink, customer_key, version) '
+                    'SELECT ?, customer_key, version FROM customer_records WHERE customer_key = ? '
+                    'ON CONFLICT (sink, customer_key) DO UPDATE SET version = excluded.version',
+                    [(sink, key) for sink in self.outbox_sinks]
+                )
+                results[customer_data['customer_id']] = 'updated' if existed else 'created'
+            conn.execute('COMMIT')
+        except Exception:
+            conn.execute('ROLLBACK')
+            raise
+        return results
+
+    @staticmethod
+    def _to_customer_data(row):
+        return {field: row[i] for i, (field, _) in enumerate(_FIELDS)}
+
+    def get(self, customer_id):
+        """Latest customer_data for a customer, or None"""
+        row = self._conn().execute(
+            f'SELECT {", ".join(column for _, column in _FIELDS)} FROM customer_records WHERE customer_key = ?',
+            (self.normalize_customer_id(customer_id),)
+        ).fetchone()
+        return self._to_customer_data(row) if row else None
+
+    def _select_pending(self, conn, sink, limit, now=None):
+        unclaimed = '' if now is None else 'AND o.claimed_until <= ? '
+        rows = conn.execute(
+            f'SELECT {", ".join("r." + column for _, column in _FIELDS)}, o.customer_key, o.version '
+            f'FROM sink_outbox o JOIN customer_records r ON r.customer_key = o.customer_key '
+            f'WHERE o.sink = ? {unclaimed}ORDER BY o.rowid LIMIT ?',
+            (sink, limit) if now is None else (sink, now, limit)
+        ).fetchall()
+        width = len(_FIELDS)
+        return [(self._to_customer_data(row), (row[width], row[width + 1])) for row in rows]
+
+    def pending(self, sink, limit=500):
+        """
+        Customers changed since `sink` last received them, claimed or not
+
+        Returns:
+            List of (customer_data, (customer_key, version)) in change order
+        """
+        return self._select_pending(self._conn(), sink, limit)
+
+    def claim(self, sink, limit=500):
+        """
+        Take the oldest unclaimed outbox entries of `sink` for sending
+
+        Entries claimed by another process stay invisible until it calls
+        mark_synced or release, or until claim_ttl passes.
+
+        Returns:
+            (token, batch): batch as from pending(); pass the token to
+            mark_synced or release
+        """
+        token = uuid.uuid4().hex
+        conn = self._conn()
+        now = time.time()
+        conn.execute('BEGIN IMMEDIATE')
+        try:
+            batch = self._select_pending(conn, sink, limit, now)
+            conn.executemany(
+                'UPDATE sink_outbox SET claimed_by = ?, claimed_until = ? WHERE sink = ? AND customer_key = ?',
+                [(token, now + self.claim_ttl, sink, key) for _, (key, _) in batch]
+            )
+            conn.execute('COMMIT')
+        except Exception:
+            conn.execute('ROLLBACK')
+            raise
+        return token, batch
+
+    def mark_synced(self, sink, entries, token=None):
+        """
+        Clear outbox entries a sink has applied
+
+        Entries whose customer changed again meanwhile stay queued (and
+        are released for the next claim).
+
+        Args:
+            entries: (customer_key, version) pairs from pending() or claim()
+            token: The claim() token, if the entries were claimed
+        """
+        conn = self._conn()
+        conn.execute('BEGIN IMMEDIATE')
+        try:
+            conn.executemany(
+                'DELETE FROM sink_outbox WHERE sink = ? AND customer_key = ? AND version = ?',
+                [(sink, key, version) for key, version in entries]
+            )
+            if token is not None:
+                self._release(conn, sink, entries, token)
+            conn.execute('COMMIT')
+        except Exception:
+            conn.execute('ROLLBACK')
+            raise
+
+    def release(self, sink, entries, token):
+        """Give up a claim without syncing, so any process can retry the entries"""
+        self._release(self._conn(), sink, entries, token)
+
+    @staticmethod
+    def _release(conn, sink, entries, token):
+        conn.executemany(
+            'UPDATE sink_outbox SET claimed_by = NULL, claimed_until = 0 '
+            'WHERE sink = ? AND customer_key = ? AND claimed_by = ?',
+            [(sink, key, token) for key, _ in entries]
+        )
+
+    def backlog(self):
+        """Changes not yet applied, per downstream sink"""
+        counts = {sink: 0 for sink in self.outbox_sinks}
+        counts.update(self._conn().execute('SELECT sink, COUNT(*) FROM sink_outbox GROUP BY sink').fetchall())
+        return counts
+
+    def count(self):
+        """Number of customers in the record"""
+        return self._conn().execute('SELECT COUNT(*) FROM customer_records').fetchone()[0]
+
+
+class FanOutSink(CustomerSink):
+    """
+    Write to a LocalSink, then replicate to downstream sinks in the background
+
+    upsert_customer returns as soon as the local record is committed. One
+    thread per downstream sink drains that sink's outbox in batches with
+    its own retry backoff, so one failing sink doesn't delay the others;
+    each batch carries the latest state of its customers, so the sinks
+    converge even when batches are retried. Every worker process runs
+    these threads; a batch is claimed (LocalSink.claim) before it is sent,
+    so the processes split the outbox instead of repeating each other.
+    """
+
+    name = 'fanout'
+
+    def __init__(self, local, downstream, batch_size=None, poll_interval=None, max_backoff=60):
+        """
+        Args:
+            local: LocalSink holding the authoritative record
+            downstream: Sinks fed from it (e.g. [SheetsService])
+            batch_size: Customers per downstream write (SINK_SYNC_BATCH_SIZE)
+            poll_interval: Seconds between outbox checks when idle
+                (SINK_SYNC_INTERVAL)
+            max_backoff: Upper bound on retry delay after a failure
+        """
+        self.local = local
+        self.downstream = list(downstream)
+        self.local.outbox_sinks = [sink.name for sink in self.downstream]
+        self.batch_size = batch_size or int(os.getenv('SINK_SYNC_BATCH_SIZE', '200'))
+        self.poll_interval = poll_interval or float(os.getenv('SINK_SYNC_INTERVAL', '1'))
+        self.max_backoff = max_backoff
+        self.last_errors = {sink.name: None for sink in self.downstream}
+        self._wakeups = {sink.name: threading.Event() for sink in self.downstream}
+        self._stopping = threading.Event()
+        self._threads = []
+
+    @property
+    def ready(self):
+        return self.local.ready
+
+    def upsert_customer(self, customer_data):
+        result = self.local.upsert_customer(customer_data)
+        self.notify()
+        return result
+
+    def upsert_customers(self, customers):
+        results = self.local.upsert_customers(customers)
+        self.notify()
+        return results
+
+    def notify(self):
+        """Wake every sync thread"""
+        for wakeup in self._wakeups.values():
+            wakeup.set()
+
+    def sync_once(self, sink):
+        """
+        Push one batch of the sink's outbox
+
+        Returns:
+            Number of customers written (raises if the sink failed)
+        """
+        token, batch = self.local.claim(sink.name, self.batch_size)
+        if not batch:
+            return 0
+        entries = [entry for _, entry in batch]
+        try:
+            sink.upsert_customers([customer_data for customer_data, _ in batch])
+        except Exception:
+            self.local.release(sink.name, entries, token)
+            raise
+        self.local.mark_synced(sink.name, entries, token)
+        return len(batch)
+
+    def start(self):
+        """Start one sync thread per downstream sink (idempotent)"""
+        if self._threads:
+            return
+        self._stopping.clear()
+        for sink in self.downstream:
+            thread = threading.Thread(target=self._run, args=(sink,), name=f'sink-sync-{sink.name}', daemon=True)
+            thread.start()
+            self._threads.append(thread)
+
+    def stop(self, timeout=5):
+        self._stopping.set()
+        self.notify()
+        for thread in self._threads:
+            thread.join(timeout)
+        self._threads = []
+
+    def _run(self, sink):
+        wakeup = self._wakeups[sink.name]
+        failures = 0
+        while not self._stopping.is_set():
+            # Cleared before reading the outbox, so a write landing during
+            # the sync wakes the next round instead of being missed
+            wakeup.clear()
+            delay = self.poll_interval
+            if sink.can_write():
+                try:
+                    if self.sync_once(sink) == self.batch_size:
+                        delay = 0  # more waiting
+                    failures = 0
+                    self.last_errors[sink.name] = None
+                except Exception as e:
+                    failures += 1
+                    delay = getattr(e, 'retry_after', None) or min(self.max_backoff, 2 ** failures)
+                    self.last_errors[sink.name] = str(e)
+                    SYNC_FAILURES.inc(sink=sink.name)
+                    logger.warning(f"Sync to {sink.name} failed, retrying in {delay}s: {e}")
+            if failures:
+                # Back off even while new writes keep arriving
+                self._stopping.wait(delay)
+            elif delay:
+                wakeup.wait(delay)
+
+    def status(self):
+        """Backlog and last error per downstream sink"""
+        backlog = self.local.backlog()
+        return {name: {'backlog': backlog.get(name, 0), 'last_error': error}
+                for name, error in self.last_errors.items()}
+
+
+def sink_names():
+    """
+    CUSTOMER_SINKS as a list, e.g. ['sheets'] or ['local', 'sheets']
+
+    Raises:
+        ValueError: not 'sheets' and not starting with 'local', or an
+            unknown downstream sink
+    """
+    names = [name.strip() for name in os.getenv('CUSTOMER_SINKS', 'sheets').split(',') if name.strip()]
+    if names == ['sheets']:
+        return names
+    if not names or names[0] != 'local':
+        raise ValueError(f"CUSTOMER_SINKS must be 'sheets' or start with 'local', got {names}")
+    unknown = [name for name in names[1:] if name != 'sheets']
+    if unknown:
+        raise ValueError(f'Unknown customer sinks: {unknown}')
+    return names
+
+
+def sink_from_env(sheets):
+    """
+    Build the sink selected by CUSTOMER_SINKS
+
+    'sheets' (default) writes straight to Sheets. A list starting with
+    'local' (e.g. 'local,sheets') makes the local record authoritative and
+    replicates it to the rest; 'local' alone keeps only the local record.
+
+    Args:
+        sheets: The SheetsService (or ShardedSheetsService) to use for 'sheets'
+    """
+    names = sink_names()
+    if names == ['sheets']:
+        return sheets
+    available = {'sheets': sheets}
+    downstream = [available[name] for name in names[1:]]
+    if not downstream:
+        return LocalSink()
+    fan_out = FanOutSink(LocalSink(), downstream)
+    fan_out.start()
+    return fan_out
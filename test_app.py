@@ -0,0 +1,338 @@
+"""
+Endpoint tests for app.py through Flask's test client
+State lives in a throwaway directory, customer lookups go to the
+FakeStripe stand-in (fake_apis.py) and rows to an in-memory worksheet.
+The real Sheets backend never connects (there is no credentials.json),
+which is what a worker sees before Google answers.
+"""
+
+import os
+import sys
+import json
+import time
+import uuid
+import tempfile
+import contextlib
+
+STATE_DIR = tempfile.mkdtemp()
+WEBHOOK_SECRET = 'whsec_test'
+CUSTOMER_API_TOKEN = 'test-token'
+for name, filename in (
+    ('PROCESSED_EVENTS_PATH', 'processed_events.db'),
+    ('DEAD_LETTERS_PATH', 'dead_letters.db'),
+    ('EVENT_ORDER_PATH', 'event_order.db'),
+    ('CUSTOMER_STORE_PATH', 'customer_store.db'),
+    ('LOCAL_SINK_PATH', 'customer_records.db'),
+    ('SHEETS_CONNECTION_CACHE', 'sheets_cache.json'),
+):
+    os.environ[name] = os.path.join(STATE_DIR, filename)
+os.environ['STRIPE_WEBHOOK_SECRET'] = WEBHOOK_SECRET
+os.environ['STRIPE_API_KEY'] = 'sk_test_fake'
+os.environ['CUSTOMER_API_TOKEN'] = CUSTOMER_API_TOKEN
+
+import stripe
+
+import app as webhook_app
+from coordination import MemoryCoordinator
+from event_queue import EventQueue, EventWorkerPool
+from fake_apis import FakeStripe, generate_stripe_signature
+from webhook_signature import MAX_WEBHOOK_BYTES
+from sheets_service import SheetsService, SHEET_HEADER
+from test_sheets_service import FakeWorksheet
+
+# Fix Windows console encoding
+if sys.platform == 'win32':
+    sys.stdout.reconfigure(encoding='utf-8')  # type: ignore
+
+fake_stripe = FakeStripe().start()
+stripe.api_base = fake_stripe.url
+client = webhook_app.app.test_client()
+
+
+def subscription_event(customer_id, status='active', created=None, event_id=None):
+    """A customer.subscription.updated event for `customer_id`"""
+    return {
+        'id': event_id or f'evt_{uuid.uuid4().hex[:16]}',
+        'object': 'event',
+        'type': 'customer.subscription.updated',
+        'created': created or int(time.time()),
+        'data': {'object': {
+            'id': f'sub_{customer_id}', 'object': 'subscription', 'customer': customer_id, 'status': status,
+            'items': {'data': [{'price': {'unit_amount': 49900, 'currency': 'usd'}}]},
+        }},
+    }
+
+
+def post_event(event, headers=None):
+    payload = json.dumps(event)
+    headers = dict({'Stripe-Signature': generate_stripe_signature(payload, WEBHOOK_SECRET)}, **(headers or {}))
+    return client.post('/webhook', data=payload, headers=headers, content_type='application/json')
+
+
+def sheet_row(sheet, customer_id):
+    rows = [dict(zip(SHEET_HEADER, row)) for row in sheet.rows[1:] if row[0] == customer_id]
+    assert len(rows) <= 1, f'{customer_id} has {len(rows)} rows'
+    return rows[0] if rows else None
+
+
+@contextlib.contextmanager
+def swapped(**attributes):
+    """Replace app.py module attributes (and the handlers' sink) for one test"""
+    saved = {name: getattr(webhook_app, name) for name in attributes}
+    saved_sink = webhook_app.handlers.customer_sink
+    for name, value in attributes.items():
+        setattr(webhook_app, name, value)
+    if 'customer_sink' in attributes:
+        webhook_app.handlers.customer_sink = attributes['customer_sink']
+    try:
+        yield
+    finally:
+        for name, value in saved.items():
+            setattr(webhook_app, name, value)
+        webhook_app.handlers.customer_sink = saved_sink
+
+
+@contextlib.contextmanager
+def connected_sheet(**kwargs):
+    """Route row writes to a worksheet that is connected and ready"""
+    sheet = FakeWorksheet([SHEET_HEADER])
+    with swapped(customer_sink=SheetsService(worksheet=sheet, **kwargs)):
+        yield sheet
+
+
+@contextlib.contextmanager
+def event_queue():
+    """Run with EVENT_QUEUE_ENABLED; the test drives the worker itself"""
+    queue = EventQueue(path=os.path.join(STATE_DIR, f'queue-{uuid.uuid4().hex}.db'))
+    workers = EventWorkerPool(queue, webhook_app.process_queued_event, workers=1)
+    with swapped(event_queue=queue, event_workers=workers):
+        yield queue, workers
+
+
+def test_queued_event_is_acked_then_written():
+    """With the queue on, a webhook is acknowledged before any Sheets call"""
+    print("\n" + "="*60)
+    print("Testing Webhook Endpoints")
+    print("="*60)
+
+    with connected_sheet() as sheet, event_queue() as (queue, workers):
+        response = post_event(subscription_event('cus_queued', 'past_due'))
+        assert response.status_code == 200
+        assert response.get_json()['action'] == 'queued'
+        assert queue.depth()['pending'] == 1
+        assert sheet.calls == []
+
+        assert workers.run_once() is True
+        assert queue.depth() == {'pending': 0, 'processing': 0, 'failed': 0}
+    row = sheet_row(sheet, 'cus_queued')
+    assert row['Subscription Status'] == 'Past Due'
+    assert row['Company Name'] == 'Company cus_queued'  # looked up in FakeStripe
+    print("✅ Queued events get 200 at once and are written by the worker")
+
+
+def test_redelivered_event_is_skipped():
+    """Stripe sending the same event ID again writes nothing"""
+    event = subscription_event('cus_redelivered')
+    with connected_sheet() as sheet:
+        first = post_event(event)
+        second = post_event(event)
+
+    assert first.status_code == 200 and first.get_json()['action'] == 'created'
+    assert second.status_code == 200 and second.get_json()['action'] == 'duplicate'
+    assert sheet.calls.count('append_rows') == 1
+    print("✅ Redelivered event IDs are answered as duplicates")
+
+
+def test_503_until_sheets_is_ready():
+    """Before Sheets connects, events get 503 and are taken once it has"""
+    assert not webhook_app.sheets_service.ready
+    event = subscription_event('cus_early')
+
+    assert client.get('/ready').status_code == 503
+    response = post_event(event)
+    assert response.status_code == 503
+
+    # Stripe's retry of the same event goes through once Sheets is up
+    with connected_sheet() as sheet:
+        assert client.get('/ready').status_code == 200
+        retry = post_event(event)
+    assert retry.status_code == 200 and retry.get_json()['action'] == 'created'
+    assert sheet_row(sheet, 'cus_early')['Subscription Status'] == 'Active'
+    print("✅ Not-ready answers 503 and the retry is processed")
+
+
+def test_transient_503s_are_not_dead_lettered():
+    """Not-ready and lock-timeout 503s are left to Stripe's retry"""
+    dead_letters = webhook_app.dead_letters.count()
+
+    assert post_event(subscription_event('cus_not_ready')).status_code == 503
+
+    coordinator = MemoryCoordinator(lock_timeout=0.1)
+    assert coordinator.try_acquire(['cus_locked'], 'other-worker', ttl=60)
+    with connected_sheet(coordinator=coordinator) as sheet:
+        response = post_event(subscription_event('cus_locked'))
+    assert response.status_code == 503
+    assert sheet_row(sheet, 'cus_locked') is None
+
+    assert webhook_app.dead_letters.count() == dead_letters
+    print("✅ Stripe retries not-ready and lock-timeout 503s; nothing is dead-lettered")
+
+
+def failing_writes(sheet):
+    """Make every row write to `sheet` fail the way a Sheets API error would"""
+    def fail(*args, **kwargs):
+        raise RuntimeError('Sheets API error 500')
+    sheet.append_rows = sheet.batch_update = fail
+
+
+def test_failed_event_can_be_retried():
+    """An event that failed is not remembered as processed; a successful one is"""
+    event = subscription_event('cus_retried', 'unpaid')
+    with connected_sheet() as sheet:
+        failing_writes(sheet)
+        assert post_event(event).status_code == 500
+    assert not webhook_app.processed_events.is_processed(event['id'])
+
+    with connected_sheet() as sheet:
+        assert post_event(event).get_json()['action'] == 'created'
+    assert webhook_app.processed_events.is_processed(event['id'])
+    assert sheet_row(sheet, 'cus_retried')['Subscription Status'] == 'Unpaid'
+    print("✅ Only handled event IDs are recorded, so Stripe's retries get through")
+
+
+def test_failed_write_is_dead_lettered():
+    """A write that fails with 500 keeps the raw event for replay.py"""
+    event = subscription_event('cus_dead_letter', 'past_due')
+    stored = webhook_app.dead_letters.count()
+    with connected_sheet() as sheet:
+        failing_writes(sheet)
+        response = post_event(event)
+
+    assert response.status_code == 500
+    assert webhook_app.dead_letters.count() == stored + 1
+    entry = [entry for entry in webhook_app.dead_letters.pending(1000) if entry['event_id'] == event['id']][0]
+    assert entry['customer_id'] == 'cus_dead_letter'
+    assert 'Sheets API error 500' in entry['error']
+    assert json.loads(entry['payload']) == event
+    print("✅ Failed writes are kept in the dead-letter store")
+
+
+def test_stale_event_is_dropped():
+    """An event older than the one already applied leaves the row alone"""
+    event_type = 'customer.subscription.updated'
+    dropped = metric('stale_events_dropped_total', event_type=event_type)
+    now = int(time.time())
+    with connected_sheet() as sheet:
+        newer = post_event(subscription_event('cus_reordered', 'canceled', created=now))
+        older = post_event(subscription_event('cus_reordered', 'active', created=now - 60))
+
+    assert newer.get_json()['action'] == 'created'
+    assert older.status_code == 200 and older.get_json()['action'] == 'stale'
+    assert sheet.calls.count('append_rows') == 1 and 'batch_update' not in sheet.calls
+    assert sheet_row(sheet, 'cus_reordered')['Subscription Status'] == 'Cancelled'
+    assert metric('stale_events_dropped_total', event_type=event_type) == dropped + 1
+    print("✅ Out-of-order events are dropped before they reach Sheets")
+
+
+def metric(name, **labels):
+    """Current value of one sample on /metrics (0 when it isn't there yet)"""
+    prefix = name + ('{' + ','.join(f'{key}="{value}"' for key, value in labels.items()) + '}' if labels else '') + ' '
+    for line in client.get('/metrics').get_data(as_text=True).splitlines():
+        if line.startswith(prefix):
+            return float(line[len(prefix):])
+    return 0.0
+
+
+def test_metrics_count_each_stage():
+    """/metrics reports the outcome, stage timings and Stripe calls of a webhook"""
+    event_type = 'customer.subscription.updated'
+    before = {
+        'processed': metric('webhook_events_total', event_type=event_type, outcome='processed'),
+        'upserts': metric('webhook_stage_seconds_count', stage='sheets_upsert', event_type=event_type),
+        'stripe': metric('external_api_calls_total', api='stripe', kind='customer_retrieve', status='200'),
+    }
+    with connected_sheet():
+        post_event(subscription_event('cus_metrics'))
+
+    response = client.get('/metrics')
+    assert response.status_code == 200
+    assert response.content_type.startswith('text/plain; version=0.0.4')
+    assert '# TYPE webhook_stage_seconds histogram' in response.get_data(as_text=True)
+    assert metric('webhook_events_total', event_type=event_type, outcome='processed') == before['processed'] + 1
+    assert metric('webhook_stage_seconds_count', stage='sheets_upsert', event_type=event_type) == before['upserts'] + 1
+    assert metric('external_api_calls_total', api='stripe', kind='customer_retrieve', status='200') == \
+        before['stripe'] + 1
+    assert metric('sheets_ready') == 0
+    print("✅ /metrics counts outcomes, stage timings and upstream calls")
+
+
+def test_unhandled_types_are_acked_early():
+    """Event types with no handler get 200 without a dedupe record or a write"""
+    event = dict(subscription_event('cus_ignored'), type='charge.refunded')
+    with connected_sheet() as sheet:
+        response = post_event(event)
+
+    assert response.status_code == 200
+    assert response.get_json() == {'success': True, 'event': 'charge.refunded', 'action': 'ignored'}
+    assert not webhook_app.processed_events.is_processed(event['id'])
+    assert sheet.calls == []
+    print("✅ Unhandled event types are acknowledged without any store or Sheets work")
+
+
+def test_oversized_body_is_refused():
+    """A body over MAX_WEBHOOK_BYTES gets 413 before it is verified"""
+    event = subscription_event('cus_oversized')
+    event['data']['object']['metadata'] = {'padding': 'x' * MAX_WEBHOOK_BYTES}
+    with connected_sheet() as sheet:
+        response = post_event(event)
+
+    assert response.status_code == 413
+    assert response.get_json() == {'error': 'Payload too large'}
+    assert not webhook_app.processed_events.is_processed(event['id'])
+    assert sheet.calls == []
+    print("✅ Oversized bodies are refused with 413")
+
+
+def test_customer_api_needs_the_token():
+    """/customers answers 401 without the bearer token and the row with it"""
+    with connected_sheet(snapshot=True) as sheet:
+        assert post_event(subscription_event('cus_lookup', 'past_due')).status_code == 200
+        calls = len(sheet.calls)
+        with swapped(sheets_service=webhook_app.handlers.customer_sink):
+            missing = client.get('/customers/cus_lookup')
+            wrong = client.get('/customers/cus_lookup', headers={'Authorization': 'Bearer wrong-token'})
+            found = client.get('/customers/cus_lookup',
+                               headers={'Authorization': f'Bearer {CUSTOMER_API_TOKEN}'})
+            listing = client.get('/customers?status=Past%20Due',
+                                 headers={'Authorization': f'Bearer {CUSTOMER_API_TOKEN}'})
+
+    assert missing.status_code == 401 and wrong.status_code == 401
+    assert found.status_code == 200
+    assert found.get_json()['customer_id'] == 'cus_lookup'
+    assert found.get_json()['status'] == 'Past Due'
+    assert listing.status_code == 200
+    assert [row['customer_id'] for row in listing.get_json()['customers']] == ['cus_lookup']
+    assert len(sheet.calls) == calls  # answered from the snapshot
+    print("✅ /customers needs the bearer token and answers from the snapshot")
+
+
+if __name__ == "__main__":
+    tests = [
+        test_queued_event_is_acked_then_written,
+        test_redelivered_event_is_skipped,
+        test_503_until_sheets_is_ready,
+        test_transient_503s_are_not_dead_lettered,
+        test_failed_event_can_be_retried,
+        test_failed_write_is_dead_lettered,
+        test_stale_event_is_dropped,
+        test_metrics_count_each_stage,
+        test_unhandled_types_are_acked_early,
+        test_oversized_body_is_refused,
+        test_customer_api_needs_the_token,
+    ]
+    for test in tests:
+        test()
+
+    print("\n" + "="*60)
+    print(f"All {len(tests)} endpoint tests passed!")
+    print("="*60)
@@ -0,0 +1,166 @@
+"""
+Tests for asgi.py, driven with ASGI scope/receive/send messages
+Shares test_app.py's setup (throwaway state directory, FakeStripe and
+in-memory worksheets), so the same requests can be sent to both apps.
+"""
+
+import sys
+import json
+import asyncio
+
+from test_app import (
+    client, connected_sheet, post_event, subscription_event, sheet_row, swapped,
+    CUSTOMER_API_TOKEN, WEBHOOK_SECRET,
+)
+import asgi
+import app as webhook_app
+from fake_apis import generate_stripe_signature
+from webhook_signature import MAX_WEBHOOK_BYTES
+
+# Fix Windows console encoding
+if sys.platform == 'win32':
+    sys.stdout.reconfigure(encoding='utf-8')  # type: ignore
+
+
+def call(method, path, body=b'', headers=None, chunks=None):
+    """
+    Send one request through asgi.app
+
+    Args:
+        headers: Dict of request headers; Content-Length is added for
+            `body` unless given
+        chunks: Body messages to send instead of `body` (no Content-Length)
+
+    Returns:
+        (status, headers dict, body bytes)
+    """
+    path, _, query = path.partition('?')
+    headers = dict(headers or {})
+    if chunks is None:
+        headers.setdefault('Content-Length', str(len(body)))
+        chunks = [body]
+    messages = [{'type': 'http.request', 'body': chunk, 'more_body': i < len(chunks) - 1}
+                for i, chunk in enumerate(chunks)]
+    scope = {
+        'type': 'http', 'method': method, 'path': path, 'query_string': query.encode('latin-1'),
+        'headers': [(name.lower().encode('latin-1'), value.encode('latin-1')) for name, value in headers.items()],
+    }
+    sent = []
+
+    async def receive():
+        return messages.pop(0) if messages else {'type': 'http.disconnect'}
+
+    async def send(message):
+        sent.append(message)
+
+    asyncio.run(asgi.app(scope, receive, send))
+    assert [message['type'] for message in sent] == ['http.response.start', 'http.response.body']
+    return sent[0]['status'], dict(sent[0]['headers']), sent[1]['body']
+
+
+def post_asgi_event(event):
+    payload = json.dumps(event)
+    headers = {'Stripe-Signature': generate_stripe_signature(payload, WEBHOOK_SECRET),
+               'Content-Type': 'application/json'}
+    return call('POST', '/webhook', payload.encode('utf-8'), headers)
+
+
+def test_routing():
+    """Unknown paths get 404, known paths with the wrong method 405"""
+    print("\n" + "="*60)
+    print("Testing ASGI Entry Point")
+    print("="*60)
+
+    assert call('GET', '/nope')[0] == 404
+    assert call('GET', '/webhook')[0] == 405
+    assert call('POST', '/health')[0] == 405
+    assert call('DELETE', '/customers/cus_1')[0] == 405
+    assert call('GET', '/health')[0] == 200
+    print("✅ 404 for unknown paths, 405 for the wrong method")
+
+
+def test_oversized_body_is_refused():
+    """Bodies past MAX_WEBHOOK_BYTES get 413, by header or while streaming"""
+    async def must_not_read():
+        raise AssertionError('body read despite Content-Length')
+
+    scope = {'type': 'http', 'method': 'POST', 'path': '/webhook', 'query_string': b'',
+             'headers': [(b'content-length', str(MAX_WEBHOOK_BYTES + 1).encode())]}
+    sent = []
+
+    async def send(message):
+        sent.append(message)
+
+    asyncio.run(asgi.app(scope, must_not_read, send))
+    assert sent[0]['status'] == 413
+    assert json.loads(sent[1]['body']) == {'error': 'Payload too large'}
+
+    # Chunked upload with no Content-Length: cut off once it grows too large
+    chunk = b'x' * (MAX_WEBHOOK_BYTES // 2 + 1)
+    status, _, body = call('POST', '/webhook', chunks=[chunk, chunk, chunk])
+    assert status == 413 and json.loads(body) == {'error': 'Payload too large'}
+    print("✅ Oversized bodies get 413 before the body is read")
+
+
+def test_malformed_content_length():
+    """A Content-Length that isn't a non-negative integer gets 400"""
+    for value in ('abc', '-5', '1.5'):
+        status, _, body = call('POST', '/webhook', b'{}', {'Content-Length': value})
+        assert status == 400, value
+        assert json.loads(body) == {'error': 'Invalid Content-Length'}
+    print("✅ Malformed Content-Length gets 400")
+
+
+def test_responses_match_flask():
+    """Webhooks, bad signatures, /metrics and /customers answer as in Flask"""
+    with connected_sheet(snapshot=True) as sheet:
+        status, headers, body = post_asgi_event(subscription_event('cus_asgi', 'past_due'))
+        flask = post_event(subscription_event('cus_flask', 'past_due'))
+        assert (status, json.loads(body)) == (flask.status_code, flask.get_json())
+        assert json.loads(body)['action'] == 'created'
+        assert headers[b'content-type'] == flask.headers['Content-Type'].encode('latin-1')
+        assert sheet_row(sheet, 'cus_asgi')['Subscription Status'] == 'Past Due'
+
+        event = subscription_event('cus_unsigned')
+        status, _, body = call('POST', '/webhook', json.dumps(event).encode('utf-8'),
+                               {'Stripe-Signature': 't=1,v1=bad'})
+        flask = client.post('/webhook', data=json.dumps(event), headers={'Stripe-Signature': 't=1,v1=bad'})
+        assert (status, json.loads(body)) == (flask.status_code, flask.get_json()) == (400, {'error': 'Invalid signature'})
+
+        status, headers, body = call('GET', '/metrics')
+        flask = client.get('/metrics')
+        assert status == flask.status_code == 200
+        assert headers[b'content-type'] == flask.headers['Content-Type'].encode('latin-1')
+        assert b'webhook_stage_seconds_bucket' in body
+
+        answers = []
+        with swapped(sheets_service=webhook_app.handlers.customer_sink):
+            for path, auth in (('/customers/cus_asgi', None), ('/customers/cus_asgi', CUSTOMER_API_TOKEN),
+                               ('/customers/cus_missing', CUSTOMER_API_TOKEN),
+                               ('/customers?status=Past%20Due', CUSTOMER_API_TOKEN),
+                               ('/customers?bogus=1', CUSTOMER_API_TOKEN)):
+                headers = {'Authorization': f'Bearer {auth}'} if auth else {}
+                status, _, body = call('GET', path, headers=headers)
+                flask = client.get(path, headers=headers)
+                answer, flask_answer = json.loads(body), flask.get_json()
+                for snapshot_age in (answer, flask_answer):
+                    snapshot_age.pop('stale_up_to_seconds', None)  # the clock moved between the two
+                assert (status, answer) == (flask.status_code, flask_answer), path
+                answers.append(status)
+        assert answers == [401, 200, 404, 200, 400]
+    print("✅ ASGI answers match the Flask app's")
+
+
+if __name__ == "__main__":
+    tests = [
+        test_routing,
+        test_oversized_body_is_refused,
+        test_malformed_content_length,
+        test_responses_match_flask,
+    ]
+    for test in tests:
+        test()
+
+    print("\n" + "="*60)
+    print(f"All {len(tests)} ASGI tests passed!")
+    print("="*60)
@@ -0,0 +1,118 @@
+"""
+Offline tests for the Stripe -> Sheets backfill
+"""
+
+import os
+import sys
+import tempfile
+
+from backfill import Checkpoint, run_backfill, subscription_to_customer_data
+from sheets_service import SheetsService, SHEET_HEADER
+from test_sheets_service import FakeWorksheet
+
+# Fix Windows console encoding
+if sys.platform == 'win32':
+    sys.stdout.reconfigure(encoding='utf-8')  # type: ignore
+
+
+def make_subscription(subscription_id, customer_id, status='active', deleted=False):
+    customer = {'id': customer_id, 'deleted': True} if deleted else {
+        'id': customer_id,
+        'email': f'{customer_id}@example.com',
+        'metadata': {'company_name': f'Company {customer_id}', 'country': 'DE'},
+    }
+    return {
+        'id': subscription_id,
+        'customer': customer,
+        'status': status,
+        'items': {'data': [{'price': {'unit_amount': 79900, 'currency': 'eur'}}]},
+    }
+
+
+def temp_checkpoint():
+    handle, path = tempfile.mkstemp(suffix='.json')
+    os.close(handle)
+    os.remove(path)
+    return Checkpoint(path)
+
+
+def test_rows_match_webhook_layout():
+    """Backfilled rows use the same fields and labels as the webhook handlers"""
+    print("\n" + "="*60)
+    print("Testing Backfill")
+    print("="*60)
+
+    data = subscription_to_customer_data(make_subscription('sub_1', 'cus_1', 'past_due'), 'T')
+    assert data == {
+        'customer_id': 'cus_1',
+        'company_name': 'Company cus_1',
+        'email': 'cus_1@example.com',
+        'subscription_id': 'sub_1',
+        'status': 'Past Due',
+        'amount': 799.0,
+        'currency': 'EUR',
+        'timestamp': 'T',
+        'country': 'DE',
+    }
+    assert subscription_to_customer_data(make_subscription('sub_2', 'cus_2', deleted=True)) is None
+    print("✅ Subscriptions map to webhook-style customer data")
+
+
+def test_chunks_are_batched_and_newest_wins():
+    """Each chunk costs one batch write; older subscriptions are skipped"""
+    sheet = FakeWorksheet([SHEET_HEADER, ['cus_1', 'Existing']])
+    service = SheetsService(worksheet=sheet)
+    checkpoint = temp_checkpoint()
+    subscriptions = [
+        make_subscription('sub_5', 'cus_1', 'past_due'),
+        make_subscription('sub_4', 'cus_2'),
+        make_subscription('sub_3', 'cus_3'),
+        make_subscription('sub_2', 'cus_1', 'canceled'),
+        make_subscription('sub_1', 'cus_4', deleted=True),
+    ]
+
+    totals = run_backfill(service, subscriptions, checkpoint, chunk_size=2)
+
+    assert totals == {'updated': 1, 'created': 2, 'skipped': 2}
+    assert sheet.rows[1][4] == 'Past Due'
+    assert [row[0] for row in sheet.rows[2:]] == ['cus_2', 'cus_3']
+    assert sheet.calls.count('append_rows') == 2
+    assert Checkpoint(checkpoint.path).load().starting_after == 'sub_1'
+    checkpoint.clear()
+    print("✅ Backfill writes in chunks and keeps each customer's newest subscription")
+
+
+def test_resume_skips_written_customers():
+    """A resumed run does not rewrite customers saved before the interruption"""
+    checkpoint = temp_checkpoint()
+    checkpoint.seen = {'cus_1'}
+    checkpoint.written = 1
+    checkpoint.save('sub_9')
+
+    resumed = Checkpoint(checkpoint.path).load()
+    assert resumed.starting_after == 'sub_9'
+    sheet = FakeWorksheet([['Stripe Customer ID']])
+    totals = run_backfill(SheetsService(worksheet=sheet), [
+        make_subscription('sub_8', 'cus_1', 'canceled'),
+        make_subscription('sub_7', 'cus_2'),
+    ], resumed)
+
+    assert totals == {'updated': 0, 'created': 1, 'skipped': 1}
+    assert [row[0] for row in sheet.rows[1:]] == ['cus_2']
+    assert resumed.written == 2
+    checkpoint.clear()
+    print("✅ Resumed backfill continues from the checkpoint")
+
+
+if __name__ == "__main__":
+    tests = [
+        test_rows_match_webhook_layout,
+        test_chunks_are_batched_and_newest_wins,
+        test_resume_skips_written_customers,
+    ]
+    for test in tests:
+        test()
+
+    print("\n" + "="*60)
+    print(f"All {len(tests)} backfill tests passed!")
+    print("="*60)
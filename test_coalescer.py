@@ -0,0 +1,140 @@
+"""
+Offline tests for per-customer event coalescing
+"""
+
+import sys
+import json
+import time
+import threading
+
+from coalescer import EventCoalescer
+from event_queue import EventWorkerPool
+from test_event_queue import make_queue
+
+# Fix Windows console encoding
+if sys.platform == 'win32':
+    sys.stdout.reconfigure(encoding='utf-8')  # type: ignore
+
+
+class RecordingWriter:
+    def __init__(self, fail=False):
+        self.batches = []
+        self.fail = fail
+
+    def __call__(self, customers):
+        self.batches.append(customers)
+        if self.fail:
+            raise RuntimeError('quota exceeded')
+        return {c['customer_id']: 'updated' for c in customers}
+
+
+def submit_all(coalescer, submissions):
+    results = [None] * len(submissions)
+
+    def run(i, data, created):
+        try:
+            results[i] = coalescer.submit(data, created)
+        except Exception as e:
+            results[i] = e
+
+    threads = [
+        threading.Thread(target=run, args=(i, data, created))
+        for i, (data, created) in enumerate(submissions)
+    ]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return results
+
+
+def test_burst_becomes_one_write():
+    """Events for one customer inside the window produce a single write"""
+    print("\n" + "="*60)
+    print("Testing Event Coalescer")
+    print("="*60)
+
+    writer = RecordingWriter()
+    coalescer = EventCoalescer(writer, window=0.2)
+    results = submit_all(coalescer, [
+        ({'customer_id': 'cus_A', 'status': 'Active', 'amount': 499}, 30),
+        ({'customer_id': 'cus_A', 'status': 'Past Due', 'amount': None}, 10),
+        ({'customer_id': 'cus_A', 'status': 'Trial', 'amount': 0}, 20),
+    ])
+
+    assert results == ['updated'] * 3
+    assert len(writer.batches) == 1
+    assert writer.batches[0] == [{'customer_id': 'cus_A', 'status': 'Active', 'amount': 499}]
+    print("✅ Burst merged in event.created order into one write")
+
+
+def test_errors_reach_every_submitter():
+    """A failed merged write is raised to every waiting caller"""
+    writer = RecordingWriter(fail=True)
+    coalescer = EventCoalescer(writer, window=0.1)
+    results = submit_all(coalescer, [
+        ({'customer_id': 'cus_A', 'status': 'Active'}, 1),
+        ({'customer_id': 'cus_A', 'status': 'Active'}, 2),
+    ])
+
+    assert all(isinstance(r, RuntimeError) for r in results)
+    print("✅ Write failures propagate so events are retried")
+
+
+def test_queue_workers_do_not_wait_out_the_window():
+    """One queue worker feeds a whole window and settles events after the flush"""
+    queue = make_queue()
+    for created, status in [(1, 'Trial'), (3, 'Past Due'), (2, 'Active')]:
+        payload = json.dumps({'customer_id': 'cus_A', 'status': status, 'created': created})
+        queue.enqueue(payload, f'evt_{created}', 'invoice.payment_succeeded')
+    queue.enqueue(json.dumps({'customer_id': 'cus_B', 'status': 'Active', 'created': 1}), 'evt_b')
+
+    writer = RecordingWriter()
+    coalescer = EventCoalescer(writer, window=0.3)
+
+    def submit(item):
+        data = json.loads(item['payload'])
+        return coalescer.submit_async(data, data.pop('created'))
+
+    pool = EventWorkerPool(queue, submit, workers=1)
+    started = time.monotonic()
+    while pool.run_once():
+        pass
+    assert time.monotonic() - started < 0.3  # all four claimed inside one window
+    assert queue.depth()['processing'] == 4
+    assert pool._in_flight  # still renewed while the window is open
+
+    deadline = time.monotonic() + 5
+    while queue.depth()['processing'] and time.monotonic() < deadline:
+        time.sleep(0.05)
+    written = [customer for batch in writer.batches for customer in batch]
+    assert written == [
+        {'customer_id': 'cus_A', 'status': 'Past Due'},
+        {'customer_id': 'cus_B', 'status': 'Active'},
+    ]
+    assert queue.depth() == {'pending': 0, 'processing': 0, 'failed': 0}
+    assert not pool._in_flight
+
+    # A failed merged write puts every event back for a retry
+    queue.enqueue(json.dumps({'customer_id': 'cus_A', 'status': 'Unpaid', 'created': 4}), 'evt_4')
+    writer.fail = True
+    assert pool.run_once() is True
+    deadline = time.monotonic() + 5
+    while queue.depth()['processing'] and time.monotonic() < deadline:
+        time.sleep(0.05)
+    assert queue.depth() == {'pending': 1, 'processing': 0, 'failed': 0}
+    print("✅ Queue workers submit without blocking and ack or retry on the flush")
+
+
+if __name__ == "__main__":
+    tests = [
+        test_burst_becomes_one_write,
+        test_errors_reach_every_submitter,
+        test_queue_workers_do_not_wait_out_the_window,
+    ]
+    for test in tests:
+        test()
+
+    print("\n" + "="*60)
+    print(f"All {len(tests)} coalescer tests passed!")
+    print("="*60)
@@ -0,0 +1,127 @@
+"""
+Offline tests for cross-process write coordination
+"""
+
+import os
+import sys
+import time
+import tempfile
+import threading
+
+from coordination import MemoryCoordinator, SQLiteCoordinator, LockTimeoutError
+from sheets_service import SheetsService
+from test_sheets_service import FakeWorksheet, sample_customer
+
+# Fix Windows console encoding
+if sys.platform == 'win32':
+    sys.stdout.reconfigure(encoding='utf-8')  # type: ignore
+
+
+def make_sqlite_coordinator(**kwargs):
+    handle, path = tempfile.mkstemp(suffix='.db')
+    os.close(handle)
+    return SQLiteCoordinator(path, **kwargs)
+
+
+def test_leases_are_all_or_nothing():
+    """A batch lock waits for any overlapping lease and expires crashed holders"""
+    print("\n" + "="*60)
+    print("Testing Write Coordination")
+    print("="*60)
+
+    for coordinator in (MemoryCoordinator(lock_timeout=0.2), make_sqlite_coordinator(lock_timeout=0.2)):
+        assert coordinator.try_acquire(['cus_b'], 'other-process', ttl=60)
+        try:
+            with coordinator.lock(['cus_a', 'cus_b']):
+                assert False, 'expected LockTimeoutError'
+        except LockTimeoutError:
+            pass
+        # cus_a was not left locked by the failed batch
+        with coordinator.lock(['cus_a']):
+            pass
+        coordinator.release(['cus_b'], 'other-process')
+
+        assert coordinator.try_acquire(['cus_c'], 'crashed', ttl=0)
+        with coordinator.lock(['cus_c']):
+            pass
+    print("✅ Leases are taken together, released, and expire")
+
+
+def test_leases_outlive_their_ttl_while_held():
+    """A write that takes longer than the lease TTL keeps its customers locked"""
+    memory = MemoryCoordinator(lease_ttl=0.3, lock_timeout=0.1)
+    sqlite = make_sqlite_coordinator(lease_ttl=0.3, lock_timeout=0.1)
+    # The SQLite holder competes with a second process on the same file
+    for holder, other in ((memory, memory), (sqlite, SQLiteCoordinator(sqlite.path))):
+        with holder.lock(['cus_a']):
+            time.sleep(1.0)  # e.g. waiting out quota and a Sheets 429
+            assert not other.try_acquire(['cus_a'], 'other-process', ttl=0.3)
+        assert other.try_acquire(['cus_a'], 'other-process', ttl=0.3)
+    print("✅ Held leases are renewed and released afterwards")
+
+
+def test_shared_row_index():
+    """Full snapshots and single rows are shared; clearing drops both"""
+    coordinator = make_sqlite_coordinator()
+    assert coordinator.load_index(300) is None
+
+    coordinator.set_rows({'cus_a': 2, 'cus_b': 3}, replace=True)
+    coordinator.set_rows({'cus_c': 4})
+    assert coordinator.load_index(300) == {'cus_a': 2, 'cus_b': 3, 'cus_c': 4}
+    assert coordinator.get_rows(['cus_c', 'cus_x'], 300) == {'cus_c': 4}
+
+    # Shard worksheets keep separate indexes
+    coordinator.set_rows({'cus_d': 2}, replace=True, scope='Customers 2')
+    assert coordinator.load_index(300, scope='Customers 2') == {'cus_d': 2}
+    assert coordinator.get_rows(['cus_d'], 300) == {}
+    coordinator.clear_rows(scope='Customers 2')
+    assert coordinator.load_index(300) == {'cus_a': 2, 'cus_b': 3, 'cus_c': 4}
+
+    coordinator.clear_rows()
+    assert coordinator.load_index(300) is None
+    assert coordinator.get_rows(['cus_a'], 300) == {}
+    print("✅ Row index is shared between processes")
+
+
+def test_services_sharing_a_coordinator_never_duplicate():
+    """Two services (stand-ins for two workers) race on the same new customer"""
+    sheet = FakeWorksheet([['Stripe Customer ID']])
+    sheet.latency = 0.05
+    append_rows = sheet.append_rows
+
+    def slow_append(values, **kwargs):
+        time.sleep(0.05)  # the window in which another worker also misses
+        append_rows(values, **kwargs)
+
+    sheet.append_rows = slow_append
+    coordinator = MemoryCoordinator()
+    services = [SheetsService(worksheet=sheet, coordinator=coordinator) for _ in range(2)]
+
+    results = []
+    threads = [
+        threading.Thread(target=lambda s=s: results.append(s.upsert_customer(sample_customer('cus_new'))))
+        for s in services for _ in range(3)
+    ]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert sorted(results) == ['created'] + ['updated'] * 5
+    assert [row[0] for row in sheet.rows].count('cus_new') == 1
+    print("✅ Concurrent workers append a new customer once")
+
+
+if __name__ == "__main__":
+    tests = [
+        test_leases_are_all_or_nothing,
+        test_leases_outlive_their_ttl_while_held,
+        test_shared_row_index,
+        test_services_sharing_a_coordinator_never_duplicate,
+    ]
+    for test in tests:
+        test()
+
+    print("\n" + "="*60)
+    print(f"All {len(tests)} coordination tests passed!")
+    print("="*60)
@@ -0,0 +1,91 @@
+"""
+Offline tests for the Stripe customer lookup cache
+"""
+
+import sys
+import time
+import threading
+
+from customer_cache import CustomerCache
+
+# Fix Windows console encoding
+if sys.platform == 'win32':
+    sys.stdout.reconfigure(encoding='utf-8')  # type: ignore
+
+
+class CountingFetch:
+    def __init__(self, delay=0):
+        self.delay = delay
+        self.calls = 0
+
+    def __call__(self, customer_id):
+        self.calls += 1
+        time.sleep(self.delay)
+        return {'id': customer_id, 'version': self.calls}
+
+
+def test_hits_and_invalidation():
+    """Repeat lookups are served from cache until invalidated"""
+    print("\n" + "="*60)
+    print("Testing Customer Cache")
+    print("="*60)
+
+    fetch = CountingFetch()
+    cache = CustomerCache(fetch, max_size=10, ttl=60)
+
+    assert cache.get('cus_A')['version'] == 1
+    assert cache.get('cus_A')['version'] == 1
+    cache.invalidate('cus_A')
+    assert cache.get('cus_A')['version'] == 2
+    assert cache.stats()['hits'] == 1
+    print("✅ Cached lookups skip Stripe until customer.updated")
+
+
+def test_lru_eviction_and_ttl():
+    """Oldest entries are evicted and expired entries are refetched"""
+    fetch = CountingFetch()
+    cache = CustomerCache(fetch, max_size=2, ttl=60)
+    cache.get('cus_A')
+    cache.get('cus_B')
+    cache.get('cus_A')
+    cache.get('cus_C')  # evicts cus_B, the least recently used
+    calls = fetch.calls
+    cache.get('cus_A')
+    assert fetch.calls == calls
+    cache.get('cus_B')
+    assert fetch.calls == calls + 1
+
+    expiring = CustomerCache(fetch, max_size=2, ttl=0)
+    expiring.get('cus_D')
+    expiring.get('cus_D')
+    assert fetch.calls == calls + 3
+    print("✅ LRU bound and TTL are enforced")
+
+
+def test_single_flight():
+    """Concurrent misses for one customer share a single fetch"""
+    fetch = CountingFetch(delay=0.1)
+    cache = CustomerCache(fetch, max_size=10, ttl=60)
+
+    threads = [threading.Thread(target=cache.get, args=('cus_A',)) for _ in range(8)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert fetch.calls == 1
+    print("✅ Concurrent misses collapse into one Stripe request")
+
+
+if __name__ == "__main__":
+    tests = [
+        test_hits_and_invalidation,
+        test_lru_eviction_and_ttl,
+        test_single_flight,
+    ]
+    for test in tests:
+        test()
+
+    print("\n" + "="*60)
+    print(f"All {len(tests)} customer cache tests passed!")
+    print("="*60)
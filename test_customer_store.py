@@ -0,0 +1,84 @@
+"""
+Offline tests for the local Stripe customer projection
+"""
+
+import os
+import sys
+import tempfile
+
+from customer_store import CustomerProjectionStore
+
+# Fix Windows console encoding
+if sys.platform == 'win32':
+    sys.stdout.reconfigure(encoding='utf-8')  # type: ignore
+
+
+def make_store():
+    handle, path = tempfile.mkstemp(suffix='.db')
+    os.close(handle)
+    return CustomerProjectionStore(path)
+
+
+def customer(company, email='ops@acme.example', customer_id='cus_A'):
+    return {'id': customer_id, 'email': email, 'metadata': {'company_name': company, 'country': 'US'}}
+
+
+def test_newer_versions_win():
+    """An older customer.updated delivered late does not overwrite a newer one"""
+    print("\n" + "="*60)
+    print("Testing Customer Projection Store")
+    print("="*60)
+
+    store = make_store()
+    assert store.get('cus_A') is None
+    assert store.upsert(customer('Acme v2'), version=200)
+    assert not store.upsert(customer('Acme v1'), version=100)
+
+    stored = store.get('cus_A')
+    assert stored.metadata['company_name'] == 'Acme v2'
+    assert stored.email == 'ops@acme.example'
+    print("✅ Out-of-order customer updates are ignored")
+
+
+def test_deleted_customers_keep_details():
+    """customer.deleted keeps the last known details for late invoice events"""
+    store = make_store()
+    store.upsert(customer('Acme'), version=100)
+    store.upsert(customer('Acme'), version=300, deleted=True)
+
+    stored = store.get('cus_A')
+    assert stored.deleted
+    assert stored.metadata['company_name'] == 'Acme'
+    print("✅ Deleted customers stay resolvable")
+
+
+def test_api_reads_never_override_webhooks():
+    """Warm-up and read-through (version 0) fill gaps but leave webhook data alone"""
+    store = make_store()
+    store.upsert(customer('From webhook'), version=500)
+
+    written = store.warm_up([
+        customer('From API', customer_id='cus_A'),
+        customer('Other', customer_id='cus_B'),
+    ])
+
+    assert written == 1
+    assert store.get('cus_A').metadata['company_name'] == 'From webhook'
+    assert store.get('cus_B').metadata['company_name'] == 'Other'
+    assert store.upsert(customer('Webhook after warm-up', customer_id='cus_B'), version=1)
+    assert store.count() == 2
+    print("✅ Warm-up fills missing customers only")
+
+
+if __name__ == "__main__":
+    tests = [
+        test_newer_versions_win,
+        test_deleted_customers_keep_details,
+        test_api_reads_never_override_webhooks,
+    ]
+    for test in tests:
+        test()
+
+    print("\n" + "="*60)
+    print(f"All {len(tests)} customer store tests passed!")
+    print("="*60)
@@ -0,0 +1,120 @@
+"""
+Offline tests for the durable webhook event queue
+These tests use a throwaway SQLite file and need no credentials
+"""
+
+import os
+import sys
+import time
+import tempfile
+import threading
+
+from event_queue import EventQueue, EventWorkerPool
+
+# Fix Windows console encoding
+if sys.platform == 'win32':
+    sys.stdout.reconfigure(encoding='utf-8')  # type: ignore
+
+
+def make_queue():
+    path = os.path.join(tempfile.mkdtemp(), 'queue.db')
+    return EventQueue(path=path)
+
+
+def test_enqueue_and_drain():
+    """Queued payloads reach the handler and leave the queue"""
+    print("\n" + "="*60)
+    print("Testing Event Queue")
+    print("="*60)
+
+    queue = make_queue()
+    queue.enqueue(b'{"id": "evt_1"}', 'evt_1', 'invoice.payment_succeeded')
+    assert queue.depth()['pending'] == 1
+
+    seen = []
+    pool = EventWorkerPool(queue, lambda item: seen.append(item['payload']))
+    assert pool.run_once() is True
+    assert pool.run_once() is False
+    assert seen == ['{"id": "evt_1"}']
+    assert queue.depth() == {'pending': 0, 'processing': 0, 'failed': 0}
+    print("✅ Events are drained in order and removed on success")
+
+
+def test_failures_retry_then_park():
+    """Handler errors are retried with backoff, then parked as failed"""
+    queue = make_queue()
+    queue.enqueue('{}', 'evt_2', 'invoice.payment_failed')
+
+    def boom(item):
+        raise RuntimeError('Sheets unavailable')
+
+    pool = EventWorkerPool(queue, boom, max_attempts=2)
+    pool.backoff = lambda attempts: 0
+    pool.run_once()
+    assert queue.depth()['pending'] == 1
+    pool.run_once()
+    assert queue.depth()['failed'] == 1
+    assert pool.run_once() is False
+    print("✅ Failed events retry and are parked after max attempts")
+
+    # With a give-up hook (the dead-letter store) they leave the queue instead
+    queue.enqueue('{}', 'evt_3', 'invoice.payment_failed')
+    given_up = []
+    pool = EventWorkerPool(queue, boom, max_attempts=1,
+                           on_give_up=lambda item, error: given_up.append((item['event_id'], str(error))))
+    pool.run_once()
+    assert given_up == [('evt_3', 'Sheets unavailable')]
+    assert queue.depth() == {'pending': 0, 'processing': 0, 'failed': 1}
+    print("✅ Events out of attempts are handed to the give-up hook")
+
+
+def test_abandoned_claim_is_recovered():
+    """An event claimed by a crashed worker is handed out again"""
+    queue = make_queue()
+    queue.visibility_timeout = 0
+    queue.enqueue('{}', 'evt_3', 'customer.subscription.updated')
+
+    assert queue.claim()['attempts'] == 1
+    item = queue.claim()
+    assert item is not None and item['attempts'] == 2
+    print("✅ Stale claims become visible again")
+
+
+def test_running_handler_keeps_its_claim():
+    """A handler slower than the visibility timeout is not handed out twice"""
+    queue = make_queue()
+    queue.visibility_timeout = 0.3
+    queue.enqueue('{}', 'evt_4', 'invoice.payment_failed')
+
+    started = threading.Event()
+    release = threading.Event()
+
+    def slow(item):
+        started.set()
+        release.wait(5)
+
+    pool = EventWorkerPool(queue, slow, workers=1)
+    pool.start()
+    assert started.wait(5)
+    time.sleep(0.8)
+    other_process = EventQueue(path=queue.path, visibility_timeout=0.3)
+    assert other_process.claim() is None
+    release.set()
+    pool.stop()
+    assert queue.depth() == {'pending': 0, 'processing': 0, 'failed': 0}
+    print("✅ Claims are renewed while the handler runs")
+
+
+if __name__ == "__main__":
+    tests = [
+        test_enqueue_and_drain,
+        test_failures_retry_then_park,
+        test_abandoned_claim_is_recovered,
+        test_running_handler_keeps_its_claim,
+    ]
+    for test in tests:
+        test()
+
+    print("\n" + "="*60)
+    print(f"All {len(tests)} event queue tests passed!")
+    print("="*60)
@@ -0,0 +1,84 @@
+"""
+Offline tests for the Prometheus metrics registry
+"""
+
+import sys
+
+import metrics
+from metrics import MetricsRegistry
+
+# Fix Windows console encoding
+if sys.platform == 'win32':
+    sys.stdout.reconfigure(encoding='utf-8')  # type: ignore
+
+
+def test_histogram_renders_cumulative_buckets():
+    """Buckets are cumulative and end in +Inf, with _sum and _count"""
+    print("\n" + "="*60)
+    print("Testing Metrics Registry")
+    print("="*60)
+
+    registry = MetricsRegistry()
+    histogram = registry.histogram('stage_seconds', 'Stage time', ('stage',), buckets=(0.1, 1.0))
+    histogram.observe(0.05, stage='verify')
+    histogram.observe(0.5, stage='verify')
+    histogram.observe(5, stage='verify')
+
+    text = registry.render()
+    assert '# TYPE stage_seconds histogram' in text
+    assert 'stage_seconds_bucket{stage="verify",le="0.1"} 1' in text
+    assert 'stage_seconds_bucket{stage="verify",le="1"} 2' in text
+    assert 'stage_seconds_bucket{stage="verify",le="+Inf"} 3' in text
+    assert 'stage_seconds_count{stage="verify"} 3' in text
+    assert 'stage_seconds_sum{stage="verify"} 5.55' in text
+    print("✅ Histogram exposition matches the Prometheus format")
+
+
+def test_stage_is_labeled_with_event_type():
+    """Stages timed inside event_context carry the event type, errors are counted"""
+    with metrics.event_context('invoice.payment_failed'):
+        with metrics.stage('test_stage'):
+            pass
+        try:
+            with metrics.stage('test_stage'):
+                raise RuntimeError('boom')
+        except RuntimeError:
+            pass
+
+    assert metrics.STAGE_SECONDS.count(stage='test_stage', event_type='invoice.payment_failed') == 2
+    assert metrics.STAGE_ERRORS.value(stage='test_stage', event_type='invoice.payment_failed') == 1
+    assert metrics.current_event_type.get() == 'none'
+    print("✅ Stage timings are labeled per event type")
+
+
+def test_counters_and_gauges():
+    """Counters escape labels; a failing gauge callback is skipped, not fatal"""
+    registry = MetricsRegistry()
+    counter = registry.counter('calls_total', 'Calls', ('api', 'status'))
+    counter.inc(api='sheets', status=429)
+    counter.inc(2, api='sheets', status=429)
+    counter.inc(api='say "hi"', status=200)
+    registry.gauge('queue_depth', 'Depth', lambda: {('pending',): 4}, ('status',))
+    registry.gauge('broken', 'Broken', lambda: 1 / 0)
+
+    text = registry.render()
+    assert 'calls_total{api="sheets",status="429"} 3' in text
+    assert 'calls_total{api="say \\"hi\\"",status="200"} 1' in text
+    assert 'queue_depth{status="pending"} 4' in text
+    assert 'broken' not in text
+    assert text.endswith('\n')
+    print("✅ Counters and gauges render; broken gauges are dropped")
+
+
+if __name__ == "__main__":
+    tests = [
+        test_histogram_renders_cumulative_buckets,
+        test_stage_is_labeled_with_event_type,
+        test_counters_and_gauges,
+    ]
+    for test in tests:
+        test()
+
+    print("\n" + "="*60)
+    print(f"All {len(tests)} metrics tests passed!")
+    print("="*60)
@@ -0,0 +1,73 @@
+"""
+Offline tests for the processed Stripe event ID store
+"""
+
+import os
+import sys
+import time
+import tempfile
+
+from processed_events import ProcessedEventStore
+
+# Fix Windows console encoding
+if sys.platform == 'win32':
+    sys.stdout.reconfigure(encoding='utf-8')  # type: ignore
+
+
+def make_store(**kwargs):
+    path = os.path.join(tempfile.mkdtemp(), 'processed.db')
+    return ProcessedEventStore(path=path, **kwargs)
+
+
+def test_duplicates_are_rejected():
+    """A finished event is a duplicate, also for a second process"""
+    print("\n" + "="*60)
+    print("Testing Processed Event Store")
+    print("="*60)
+
+    store = make_store()
+    assert store.begin('evt_1') is True
+    assert store.begin('evt_1') is False  # in flight elsewhere
+    store.finish('evt_1')
+    assert store.is_processed('evt_1')
+
+    other_worker = ProcessedEventStore(path=store.path)
+    assert other_worker.begin('evt_1') is False
+    print("✅ Duplicate deliveries are skipped across workers")
+
+
+def test_release_allows_retry():
+    """A failed event can be processed again on Stripe's retry"""
+    store = make_store()
+    assert store.begin('evt_2') is True
+    store.release('evt_2')
+    assert store.begin('evt_2') is True
+    print("✅ Released claims are retried")
+
+
+def test_abandoned_claim_and_pruning():
+    """Stale claims expire and old entries are pruned"""
+    store = make_store(retention=60, lease=1)
+    store.begin('evt_3')
+    assert store.begin('evt_3') is False
+    time.sleep(1.1)
+    assert store.begin('evt_3') is True
+    store.finish('evt_3')
+
+    assert store.prune(now=time.time() + 120) == 1
+    assert not store.is_processed('evt_3')
+    print("✅ Abandoned claims expire and old IDs are pruned")
+
+
+if __name__ == "__main__":
+    tests = [
+        test_duplicates_are_rejected,
+        test_release_allows_retry,
+        test_abandoned_claim_and_pruning,
+    ]
+    for test in tests:
+        test()
+
+    print("\n" + "="*60)
+    print(f"All {len(tests)} processed event tests passed!")
+    print("="*60)
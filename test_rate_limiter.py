@@ -0,0 +1,138 @@
+"""
+Offline tests for the Sheets quota limiter
+"""
+
+import os
+import sys
+import tempfile
+
+from rate_limiter import QuotaLimiter, QuotaExceededError, TokenBucket
+
+# Fix Windows console encoding
+if sys.platform == 'win32':
+    sys.stdout.reconfigure(encoding='utf-8')  # type: ignore
+
+
+class FakeResponse:
+    def __init__(self, status_code, retry_after=None):
+        self.status_code = status_code
+        self.headers = {'Retry-After': str(retry_after)} if retry_after is not None else {}
+
+
+class FakeAPIError(Exception):
+    def __init__(self, status_code, retry_after=None):
+        super().__init__(f'HTTP {status_code}')
+        self.response = FakeResponse(status_code, retry_after)
+
+
+class Flaky:
+    def __init__(self, errors):
+        self.errors = list(errors)
+        self.calls = 0
+
+    def __call__(self):
+        self.calls += 1
+        if self.errors:
+            raise self.errors.pop(0)
+        return 'ok'
+
+
+def make_limiter(**kwargs):
+    options = dict(read_per_minute=6000, write_per_minute=6000, burst=5,
+                   max_retries=3, max_wait=1, base_delay=0.01, max_delay=0.02)
+    options.update(kwargs)
+    return QuotaLimiter(**options)
+
+
+def test_retries_429_with_retry_after():
+    """429s are retried, waiting at least Retry-After"""
+    print("\n" + "="*60)
+    print("Testing Quota Limiter")
+    print("="*60)
+
+    limiter = make_limiter()
+    delays = []
+    limiter.backoff = lambda attempt, retry_after=None: delays.append(retry_after) or 0
+    fn = Flaky([FakeAPIError(429, retry_after=0), FakeAPIError(503)])
+
+    assert limiter.call('write', fn) == 'ok'
+    assert fn.calls == 3
+    assert delays == [0.0, None]
+    assert limiter.throttled == 1
+    print("✅ Throttled calls back off and succeed")
+
+
+def test_non_idempotent_calls_skip_5xx_retry():
+    """Appends are not repeated after a server error"""
+    limiter = make_limiter()
+    fn = Flaky([FakeAPIError(500)])
+    try:
+        limiter.call('write', fn, idempotent=False)
+        assert False, 'expected the 500 to propagate'
+    except FakeAPIError:
+        pass
+    assert fn.calls == 1
+    print("✅ Appends are only retried on 429")
+
+
+def test_budget_exhaustion():
+    """An empty bucket is reported and raises QuotaExceededError"""
+    limiter = make_limiter(write_per_minute=1, burst=1, max_wait=0)
+    assert limiter.remaining()['write'] == 1
+    limiter.call('write', lambda: None)
+    assert not limiter.has_budget('write')
+    try:
+        limiter.call('write', lambda: None)
+        assert False, 'expected QuotaExceededError'
+    except QuotaExceededError as e:
+        assert e.retry_after > 0
+    assert limiter.has_budget('read')
+    print("✅ Remaining budget is exposed and enforced")
+
+
+def test_bucket_pause():
+    """A 429 pause empties the bucket for every caller"""
+    bucket = TokenBucket(rate_per_minute=60000, burst=3)
+    bucket.pause(60)
+    assert bucket.remaining() == 0
+    assert not bucket.try_acquire()
+    print("✅ Pausing a bucket blocks all callers")
+
+
+def test_shared_budget_across_processes():
+    """Limiters on one SQLite file (one per process) draw from one budget"""
+    handle, path = tempfile.mkstemp(suffix='.db')
+    os.close(handle)
+    worker_a = make_limiter(write_per_minute=1, burst=2, max_wait=0, path=path)
+    worker_b = make_limiter(write_per_minute=1, burst=2, max_wait=0, path=path)
+
+    worker_a.call('write', lambda: None)
+    assert worker_b.remaining()['write'] == 1
+    worker_b.call('write', lambda: None)
+    assert not worker_a.has_budget('write')
+    try:
+        worker_a.call('write', lambda: None)
+        assert False, 'expected QuotaExceededError'
+    except QuotaExceededError:
+        pass
+
+    # A 429 seen by one process pauses the others
+    worker_a.buckets['read'].pause(60)
+    assert worker_b.remaining()['read'] == 0
+    print("✅ Worker processes share one Sheets quota")
+
+
+if __name__ == "__main__":
+    tests = [
+        test_retries_429_with_retry_after,
+        test_non_idempotent_calls_skip_5xx_retry,
+        test_budget_exhaustion,
+        test_bucket_pause,
+        test_shared_budget_across_processes,
+    ]
+    for test in tests:
+        test()
+
+    print("\n" + "="*60)
+    print(f"All {len(tests)} quota limiter tests passed!")
+    print("="*60)
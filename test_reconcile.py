@@ -0,0 +1,101 @@
+"""
+Offline tests for Stripe <-> Sheets status reconciliation
+"""
+
+import sys
+
+from reconcile import compute_corrections, reconcile
+from sheets_service import SheetsService, SHEET_HEADER
+from test_sheets_service import FakeWorksheet
+
+# Fix Windows console encoding
+if sys.platform == 'win32':
+    sys.stdout.reconfigure(encoding='utf-8')  # type: ignore
+
+
+def make_sheet():
+    return FakeWorksheet([
+        SHEET_HEADER,
+        ['cus_A', 'Alpha', '', '', 'Active'],
+        ['cus_B', 'Bravo', '', '', 'Active'],
+        ['cus_C', 'Charlie', '', '', 'Past Due'],
+        ['cus_D', 'Delta', '', '', 'Active'],
+    ])
+
+
+def test_newest_subscription_decides():
+    """Each customer is judged by its newest subscription only"""
+    print("\n" + "="*60)
+    print("Testing Reconciliation")
+    print("="*60)
+
+    snapshot = SheetsService(worksheet=make_sheet()).snapshot_statuses()
+    corrections, counts = compute_corrections(snapshot, [
+        ('cus_B', 'canceled'),
+        ('cus_A', 'active'),
+        ('cus_X', 'active'),
+        ('cus_A', 'canceled'),
+        ('cus_C', 'past_due'),
+    ])
+
+    assert corrections == [(3, 'cus_B', 'Active', 'Cancelled')]
+    assert counts == {'checked': 3, 'skipped': 2, 'no_subscription': 1}
+    print("✅ Drift is computed from the newest subscription per customer")
+
+
+def test_corrections_are_one_batch_write():
+    """A pass costs a snapshot, a row check and one write however many rows drifted"""
+    sheet = make_sheet()
+    service = SheetsService(worksheet=sheet)
+
+    report = reconcile(service, [
+        ('cus_A', 'past_due'), ('cus_B', 'unpaid'), ('cus_C', 'active'), ('cus_D', 'active'),
+    ], timestamp='2024-02-01 00:00:00')
+
+    assert report['fixed'] == 3
+    assert sheet.calls == ['row_values', 'batch_get', 'batch_get', 'batch_update']
+    assert [row[4] for row in sheet.rows[1:]] == ['Past Due', 'Unpaid', 'Active', 'Active']
+    assert sheet.rows[1][7] == '2024-02-01 00:00:00'
+
+    dry = reconcile(service, [('cus_D', 'canceled')], dry_run=True)
+    assert dry['fixed'] == 0 and len(dry['corrections']) == 1
+    assert sheet.rows[4][4] == 'Active'
+    print("✅ All corrections go out in a single batch_update")
+
+
+def test_rows_moved_during_the_stripe_stream():
+    """Corrections land on the customer's current row, never on whoever took its old one"""
+    sheet = make_sheet()
+    service = SheetsService(worksheet=sheet)
+
+    def stream():
+        yield 'cus_A', 'past_due'
+        # Sorted by hand while Stripe is being paged, and cus_D updated by a webhook
+        sheet.rows[1:] = [sheet.rows[4], sheet.rows[3], sheet.rows[2], sheet.rows[1]]
+        service.upsert_customer({'customer_id': 'cus_D', 'status': 'Cancelled', 'timestamp': 't'})
+        yield 'cus_B', 'unpaid'
+        yield 'cus_D', 'active'
+
+    report = reconcile(service, stream(), timestamp='2024-02-01 00:00:00')
+
+    rows = {row[0]: row[4] for row in sheet.rows[1:]}
+    assert rows == {'cus_D': 'Cancelled', 'cus_C': 'Past Due', 'cus_B': 'Unpaid', 'cus_A': 'Past Due'}
+    assert report['fixed'] == 2
+    assert [(row, customer_id) for row, customer_id, _, _ in report['corrections']] == [
+        (5, 'cus_A'), (4, 'cus_B'),
+    ]
+    print("✅ Moved rows are found again and newer writes are not overwritten")
+
+
+if __name__ == "__main__":
+    tests = [
+        test_newest_subscription_decides,
+        test_corrections_are_one_batch_write,
+        test_rows_moved_during_the_stripe_stream,
+    ]
+    for test in tests:
+        test()
+
+    print("\n" + "="*60)
+    print(f"All {len(tests)} reconciliation tests passed!")
+    print("="*60)
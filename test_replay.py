@@ -0,0 +1,177 @@
+"""
+Offline tests for the dead-letter store and replay
+"""
+
+import os
+import sys
+import json
+import tempfile
+import threading
+
+import replay as replay_script
+from customer_store import CustomerProjectionStore
+from dead_letters import DeadLetterStore
+from processed_events import ProcessedEventStore
+from replay import replay, replay_batch
+from sinks import LocalSink
+
+# Fix Windows console encoding
+if sys.platform == 'win32':
+    sys.stdout.reconfigure(encoding='utf-8')  # type: ignore
+
+
+def temp_path():
+    handle, path = tempfile.mkstemp(suffix='.db')
+    os.close(handle)
+    return path
+
+
+def make_event(event_id, customer_id, status, created, event_type='customer.subscription.updated'):
+    obj = {'id': customer_id} if event_type == 'customer.updated' else {'customer': customer_id, 'status': status}
+    return {'id': event_id, 'type': event_type, 'created': created, 'data': {'object': obj}}
+
+
+def store_events(store, events):
+    for event in events:
+        store.record(json.dumps(event).encode('utf-8'), event, RuntimeError('Sheets down'))
+
+
+def build(event):
+    obj = event['data']['object']
+    if event['type'] == 'customer.updated':
+        return None
+    return {'customer_id': obj['customer'], 'status': obj['status'], 'email': None}
+
+
+class Writer:
+    def __init__(self):
+        self.batches = []
+        self.failing = False
+
+    def __call__(self, customers):
+        if self.failing:
+            raise RuntimeError('Sheets still down')
+        self.batches.append(customers)
+        return {data['customer_id']: 'updated' for data in customers}
+
+
+def test_failures_are_recorded_once_per_event():
+    """Repeat failures of one event update a single entry"""
+    print("\n" + "="*60)
+    print("Testing Dead-Letter Replay")
+    print("="*60)
+
+    store = DeadLetterStore(temp_path())
+    event = make_event('evt_1', 'cus_1', 'active', 100)
+    store_events(store, [event, event, make_event('evt_2', 'cus_2', None, 101, 'customer.updated')])
+
+    entries = store.pending()
+    assert store.count() == 2
+    assert [e['attempts'] for e in entries] == [2, 1]
+    assert [e['customer_id'] for e in entries] == ['cus_1', 'cus_2']
+    assert entries[0]['error'] == 'Sheets down'
+    assert json.loads(entries[0]['payload']) == event
+
+    store.resolve([entries[0]['id']])
+    assert [e['event_id'] for e in store.pending()] == ['evt_2']
+    print("✅ Failed events are stored with payload, error and attempt count")
+
+
+def test_batch_merges_events_per_customer():
+    """One write per batch, one row per customer, newest event.created wins"""
+    store = DeadLetterStore(temp_path())
+    processed = ProcessedEventStore(temp_path())
+    store_events(store, [
+        make_event('evt_3', 'cus_1', 'past_due', 300),
+        make_event('evt_1', 'cus_1', 'active', 100),
+        make_event('evt_2', 'cus_2', 'canceled', 200),
+        make_event('evt_4', 'cus_1', 'unpaid', 250),
+        make_event('evt_5', 'cus_3', 'active', 400),
+        make_event('evt_6', 'cus_3', None, 500, 'customer.updated'),
+    ])
+    # A Stripe retry already got evt_5 through
+    processed.begin('evt_5')
+    processed.finish('evt_5')
+
+    dispatched = []
+    writer = Writer()
+    report = replay_batch(store.pending(), build, dispatched.append, writer, processed)
+
+    assert len(writer.batches) == 1
+    assert sorted((d['customer_id'], d['status']) for d in writer.batches[0]) == [
+        ('cus_1', 'past_due'), ('cus_2', 'canceled')
+    ]
+    assert [event['id'] for event in dispatched] == ['evt_6']
+    assert report['replayed'] == 5 and report['rows'] == 2 and report['skipped'] == 1
+    assert len(report['resolved']) == 6 and not report['failed']
+    assert all(processed.is_processed(f'evt_{i}') for i in range(1, 7))
+    print("✅ A batch becomes one write with one merged row per customer")
+
+
+def test_replay_is_paced_and_stops_while_down():
+    """Batches are spaced by --rate, and a failed write leaves events stored"""
+    store = DeadLetterStore(temp_path())
+    store_events(store, [make_event(f'evt_{i}', f'cus_{i % 3}', 'active', i) for i in range(10)])
+    sleeps = []
+    writer = Writer()
+    writer.failing = True
+
+    totals = replay(store, build, lambda event: None, writer, rate=5, batch_size=4, sleep=sleeps.append)
+    assert totals['stopped'] is not None
+    assert totals['remaining'] == 10 and totals['failed'] == 4
+    assert [e['attempts'] for e in store.pending()][:5] == [2, 2, 2, 2, 1]
+
+    writer.failing = False
+    totals = replay(store, build, lambda event: None, writer, rate=5, batch_size=4, sleep=sleeps.append)
+    assert totals['replayed'] == 10 and totals['remaining'] == 0
+    assert [len(batch) for batch in writer.batches] == [3, 3, 2]
+    assert len(sleeps) == 3 and 0.7 < sleeps[0] <= 0.8
+    print("✅ Replay keeps to its rate and stops while the Sheet is down")
+
+
+def test_local_replay_needs_neither_app_nor_sheets():
+    """With CUSTOMER_SINKS=local,sheets replay writes the local record and starts nothing"""
+    env = {name: temp_path() for name in (
+        'DEAD_LETTERS_PATH', 'PROCESSED_EVENTS_PATH', 'EVENT_ORDER_PATH',
+        'CUSTOMER_STORE_PATH', 'LOCAL_SINK_PATH',
+    )}
+    env['CUSTOMER_SINKS'] = 'local,sheets'
+    saved = {name: os.environ.get(name) for name in env}
+    os.environ.update(env)
+    try:
+        CustomerProjectionStore().upsert({'id': 'cus_1', 'email': 'a@example.com',
+                                          'metadata': {'company_name': 'Acme'}})
+        store_events(DeadLetterStore(), [make_event('evt_1', 'cus_1', 'past_due', 10)])
+        threads = set(threading.enumerate())
+        app_loaded = 'app' in sys.modules
+
+        totals = replay_script.main(['--rate', '0'])
+
+        assert totals['replayed'] == 1 and totals['remaining'] == 0
+        local = LocalSink(outbox_sinks=['sheets'])
+        assert local.get('cus_1')['status'] == 'Past Due'
+        assert local.backlog() == {'sheets': 1}  # left for the webhook server's sync
+        assert app_loaded or 'app' not in sys.modules
+        assert not set(threading.enumerate()) - threads
+    finally:
+        for name, value in saved.items():
+            if value is None:
+                os.environ.pop(name, None)
+            else:
+                os.environ[name] = value
+    print("✅ Replay into the local record skips app.py and the Sheets connection")
+
+
+if __name__ == "__main__":
+    tests = [
+        test_failures_are_recorded_once_per_event,
+        test_batch_merges_events_per_customer,
+        test_replay_is_paced_and_stops_while_down,
+        test_local_replay_needs_neither_app_nor_sheets,
+    ]
+    for test in tests:
+        test()
+
+    print("\n" + "="*60)
+    print(f"All {len(tests)} replay tests passed!")
+    print("="*60)
@@ -0,0 +1,172 @@
+"""
+Offline tests for sharded worksheet routing
+"""
+
+import os
+import sys
+import time
+import tempfile
+import threading
+
+import gspread
+
+from reconcile import reconcile
+from sharding import ShardRouter, ShardDirectory, ShardedSheetsService
+from sheets_service import SHEET_HEADER
+from test_sheets_service import FakeWorksheet, sample_customer
+
+# Fix Windows console encoding
+if sys.platform == 'win32':
+    sys.stdout.reconfigure(encoding='utf-8')  # type: ignore
+
+
+def temp_directory():
+    handle, path = tempfile.mkstemp(suffix='.db')
+    os.close(handle)
+    return ShardDirectory(path)
+
+
+def make_service(strategy='country'):
+    sheets = {}
+
+    def open_shard(name, create):
+        if name not in sheets:
+            if not create:
+                raise gspread.exceptions.WorksheetNotFound(name)
+            sheets[name] = FakeWorksheet([SHEET_HEADER])
+        return sheets[name]
+
+    service = ShardedSheetsService(ShardRouter(strategy, shard_count=3), temp_directory(),
+                                   worksheet_factory=open_shard)
+    return service, sheets
+
+
+def customer(customer_id, country, status='Active'):
+    return dict(sample_customer(customer_id, status), country=country)
+
+
+def test_router_and_directory():
+    """Strategies pick stable shard names; the first directory entry wins"""
+    print("\n" + "="*60)
+    print("Testing Sharded Worksheets")
+    print("="*60)
+
+    hashed = ShardRouter('hash', shard_count=3)
+    assert hashed.shard_for(customer('cus_1', 'US')) == hashed.shard_for(customer(' CUS_1 ', 'DE'))
+    assert hashed.known_shards() == ['Customers 1', 'Customers 2', 'Customers 3']
+    assert ShardRouter('country').shard_for(customer('cus_1', 'de')) == 'Customers DE'
+    assert ShardRouter('country').shard_for(customer('cus_1', '')) == 'Customers Unknown'
+    assert ShardRouter('year').shard_for(customer('cus_1', 'US')) == 'Customers 2024'
+    try:
+        ShardRouter('none')
+        assert False, 'a router needs a sharding strategy'
+    except ValueError:
+        pass
+
+    directory = temp_directory()
+    assert directory.assign_many({'cus_1': 'Customers US'}) == {'cus_1': 'Customers US'}
+    # A later event with different routing data keeps the stored shard
+    assert directory.assign_many({'cus_1': 'Customers DE', 'cus_2': 'Customers DE'}) == {
+        'cus_1': 'Customers US', 'cus_2': 'Customers DE'
+    }
+    assert sorted(directory.shards()) == ['Customers DE', 'Customers US']
+    print("✅ Customers are routed once and stay in their shard")
+
+
+def test_writes_touch_one_shard():
+    """Lookups and appends go only to the customer's shard"""
+    service, sheets = make_service()
+
+    assert service.upsert_customer(customer('cus_us', 'US')) == 'created'
+    assert service.upsert_customer(customer('cus_de', 'DE')) == 'created'
+    # Country metadata changed, but the customer keeps their row
+    assert service.upsert_customer(customer('cus_us', 'DE', 'Past Due')) == 'updated'
+
+    assert [row[0] for row in sheets['Customers US'].rows[1:]] == ['cus_us']
+    assert [row[0] for row in sheets['Customers DE'].rows[1:]] == ['cus_de']
+    assert sheets['Customers US'].rows[1][4] == 'Past Due'
+    assert 'batch_update' not in sheets['Customers DE'].calls
+
+    results = service.upsert_customers([customer('cus_fr', 'FR'), customer('cus_de2', 'DE'), customer('cus_de', 'DE')])
+    assert results == {'cus_fr': 'created', 'cus_de2': 'created', 'cus_de': 'unchanged'}
+    assert sheets['Customers DE'].calls.count('append_rows') == 2
+    assert service.find_customer_row('cus_de2') == 3
+    assert service.locate_customer('cus_de2') == ('Customers DE', 3)
+    assert service.locate_customer('cus_nobody') is None
+    print("✅ Each write touches a single shard worksheet")
+
+
+def test_snapshots_only_open_used_shards():
+    """Listing customers never creates the hash shards nobody was routed to"""
+    service, sheets = make_service('hash')
+    service.upsert_customer(customer('cus_1', 'US'))
+    used = list(sheets)
+
+    service.get_snapshots()
+    report = reconcile(service, [('cus_1', 'canceled')], timestamp='T')
+    service.rebuild_directory()
+
+    assert list(sheets) == used and len(used) == 1
+    assert report['fixed'] == 1
+    print("✅ Snapshots and reconciliation read only shards that already exist")
+
+
+def test_slow_shard_does_not_block_others():
+    """Opening one shard's worksheet doesn't hold up lookups in another"""
+    service, sheets = make_service()
+    service.upsert_customer(customer('cus_us', 'US'))
+    factory = service.worksheet_factory
+    opening = threading.Event()
+    proceed = threading.Event()
+
+    def slow_factory(name, create):
+        if name == 'Customers DE':
+            opening.set()
+            proceed.wait(5)
+        return factory(name, create)
+
+    service.worksheet_factory = slow_factory
+    thread = threading.Thread(target=service.upsert_customer, args=(customer('cus_de', 'DE'),))
+    thread.start()
+    assert opening.wait(5)
+    started = time.monotonic()
+    assert service.find_customer_row('cus_us') == 2
+    assert service.shard('Customers FR') is service.shard('Customers FR')
+    assert time.monotonic() - started < 1
+    proceed.set()
+    thread.join()
+    assert [row[0] for row in sheets['Customers DE'].rows[1:]] == ['cus_de']
+    print("✅ Shards are opened outside the shared lock")
+
+
+def test_reconcile_routes_corrections_by_shard():
+    """Snapshots span shards; rows added by hand are adopted into the directory"""
+    service, sheets = make_service()
+    service.upsert_customer(customer('cus_us', 'US'))
+    service.upsert_customer(customer('cus_de', 'DE'))
+    sheets['Customers DE'].rows.append(['cus_manual', 'Added by hand', '', '', 'Active'])
+
+    report = reconcile(service, [('cus_us', 'canceled'), ('cus_manual', 'past_due'), ('cus_de', 'active')],
+                       timestamp='T')
+
+    assert report['fixed'] == 2
+    assert sheets['Customers US'].rows[1][4] == 'Cancelled'
+    assert sheets['Customers DE'].rows[2][4] == 'Past Due'
+    assert service.directory.get_many(['cus_manual']) == {'cus_manual': 'Customers DE'}
+    print("✅ Reconciliation reads every shard and writes each fix to its shard")
+
+
+if __name__ == "__main__":
+    tests = [
+        test_router_and_directory,
+        test_writes_touch_one_shard,
+        test_snapshots_only_open_used_shards,
+        test_slow_shard_does_not_block_others,
+        test_reconcile_routes_corrections_by_shard,
+    ]
+    for test in tests:
+        test()
+
+    print("\n" + "="*60)
+    print(f"All {len(tests)} sharding tests passed!")
+    print("="*60)
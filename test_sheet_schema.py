@@ -0,0 +1,139 @@
+"""
+Offline tests for the header-driven column layout
+"""
+
+import sys
+
+from sheet_schema import SheetSchema, SheetSchemaError, SHEET_HEADER
+from sheets_service import SheetsService
+from test_sheets_service import FakeWorksheet, sample_customer
+
+# Fix Windows console encoding
+if sys.platform == 'win32':
+    sys.stdout.reconfigure(encoding='utf-8')  # type: ignore
+
+
+def test_ranges_cover_only_changed_cells():
+    """Adjacent cells share a range and identical spans stack across rows"""
+    print("\n" + "="*60)
+    print("Testing Sheet Schema")
+    print("="*60)
+
+    schema = SheetSchema(SHEET_HEADER)
+    assert schema.ranges([(5, {'status': 'Active', 'timestamp': 'now'})]) == [
+        {'range': 'E5', 'values': [['Active']]},
+        {'range': 'H5', 'values': [['now']]},
+    ]
+    assert schema.ranges([(5, {'status': 'Active', 'plan_tier': 'Elite ($999)'})]) == [
+        {'range': 'E5:F5', 'values': [['Active', 'Elite ($999)']]},
+    ]
+
+    moved = SheetSchema(['Stripe Customer ID', 'Status', 'Last Updated', 'Notes'])
+    assert moved.ranges([
+        (3, {'status': 'Active', 'timestamp': 't3'}),
+        (2, {'status': 'Unpaid', 'timestamp': 't2'}),
+        (4, {'status': 'Trial', 'timestamp': 't4', 'country': 'US'}),
+        (7, {'status': 'Paused'}),
+    ]) == [
+        {'range': 'B2:C4', 'values': [['Unpaid', 't2'], ['Active', 't3'], ['Trial', 't4']]},
+        {'range': 'B7', 'values': [['Paused']]},
+    ]
+    assert moved.missing == ['company_name', 'contact_name', 'email', 'plan_tier',
+                             'setup_completed', 'currency', 'country']
+
+    try:
+        SheetSchema(['Name', 'Status'])
+        raise AssertionError('Accepted a header without a customer ID column')
+    except SheetSchemaError:
+        pass
+    print("✅ Writes are the fewest contiguous ranges")
+
+
+def test_writes_follow_inserted_columns():
+    """A column inserted by hand shifts every write with it"""
+    header = SHEET_HEADER[:4] + ['Account Manager'] + SHEET_HEADER[4:]
+    sheet = FakeWorksheet([header, ['cus_A', 'Alpha', '', '', 'Dana', 'Active']])
+    service = SheetsService(worksheet=sheet)
+
+    assert service.upsert_customer(sample_customer('cus_A', 'Past Due')) == 'updated'
+    assert sheet.rows[1][4] == 'Dana'
+    assert sheet.rows[1][5] == 'Past Due'
+    assert sheet.rows[1][8] == '2024-01-01 00:00:00'
+
+    assert service.upsert_customer(sample_customer('cus_new')) == 'created'
+    new_row = dict(zip(header, sheet.rows[2]))
+    assert new_row['Stripe Customer ID'] == 'cus_new'
+    assert new_row['Account Manager'] == ''
+    assert new_row['Subscription Status'] == 'Active'
+    assert new_row['Country'] == 'US'
+    assert sheet.calls.count('row_values') == 1
+    print("✅ Updates and new rows land under their headers")
+
+
+def test_column_inserted_between_writes():
+    """A column inserted by hand after the header was read is never written over"""
+    sheet = FakeWorksheet([SHEET_HEADER, ['cus_A', 'Alpha', '', '', 'Active']])
+    service = SheetsService(worksheet=sheet)
+    assert service.upsert_customer(sample_customer('cus_A', 'Past Due')) == 'updated'
+
+    # "Notes" goes in before Subscription Status while the header is cached
+    for row in sheet.rows:
+        row.insert(4, 'Notes' if row is sheet.rows[0] else 'Call back Monday')
+    later = dict(sample_customer('cus_A', 'Cancelled'), timestamp='2024-02-01 00:00:00')
+    assert service.upsert_customer(later) == 'updated'
+
+    row = dict(zip(sheet.rows[0], sheet.rows[1]))
+    assert row['Notes'] == 'Call back Monday'
+    assert row['Subscription Status'] == 'Cancelled'
+    assert row['Setup Completed'] == ''
+    assert row['Last Updated'] == '2024-02-01 00:00:00'
+
+    assert service.upsert_customer(sample_customer('cus_new')) == 'created'
+    new_row = dict(zip(sheet.rows[0], sheet.rows[2]))
+    assert new_row['Notes'] == '' and new_row['Subscription Status'] == 'Active'
+    assert sheet.calls.count('row_values') == 1
+    print("✅ The header read before each write catches inserted columns")
+
+
+def test_layout_changes_are_picked_up():
+    """The header is re-read after invalidation, and a moved ID column is caught on refresh"""
+    sheet = FakeWorksheet([SHEET_HEADER, ['cus_A', 'Alpha']])
+    service = SheetsService(worksheet=sheet)
+    assert service.find_customer_row('cus_A') == 2
+
+    # Someone inserts a column in front of the Customer ID
+    for row in sheet.rows:
+        row.insert(0, 'Region' if row is sheet.rows[0] else 'EU')
+    service._index_loaded_at = 0.0  # index TTL expired
+    assert service.find_customer_row('cus_A') == 2
+    assert service.get_schema().column('customer_id') == 2
+
+    service.upsert_customer(sample_customer('cus_A', 'Unpaid'))
+    assert sheet.rows[1][:2] == ['EU', 'cus_A']
+    assert sheet.rows[1][5] == 'Unpaid'
+
+    # Without a customer ID column nothing is written, not even a new row
+    sheet.rows[0] = ['Region', 'Customer', 'Company Name']
+    service.invalidate_index()
+    try:
+        service.upsert_customer(sample_customer('cus_B'))
+        raise AssertionError('Wrote to a sheet without a customer ID column')
+    except SheetSchemaError:
+        pass
+    assert len(sheet.rows) == 2
+    print("✅ Moved columns are detected without a full re-sync")
+
+
+if __name__ == "__main__":
+    tests = [
+        test_ranges_cover_only_changed_cells,
+        test_writes_follow_inserted_columns,
+        test_column_inserted_between_writes,
+        test_layout_changes_are_picked_up,
+    ]
+    for test in tests:
+        test()
+
+    print("\n" + "="*60)
+    print(f"All {len(tests)} sheet schema tests passed!")
+    print("="*60)
@@ -0,0 +1,140 @@
+"""
+Offline tests for the in-memory sheet snapshot behind /customers
+"""
+
+import sys
+
+from sheet_schema import SHEET_HEADER
+from sheet_snapshot import SheetSnapshot, find_customer, query_snapshots
+from sheets_service import SheetsService
+from test_sheets_service import FakeWorksheet, sample_customer
+
+# Fix Windows console encoding
+if sys.platform == 'win32':
+    sys.stdout.reconfigure(encoding='utf-8')  # type: ignore
+
+
+def make_sheet():
+    return FakeWorksheet([
+        SHEET_HEADER,
+        ['cus_A', 'Alpha', 'ann', 'ann@alpha.example', 'Active', 'Standard ($499)', 'TRUE',
+         '2024-01-01 00:00:00', 'USD', 'US'],
+        ['cus_B', 'Bravo', 'bob', 'bob@bravo.example', 'Past Due', 'Elite ($999)', 'FALSE',
+         '2024-01-01 00:00:00', 'USD', 'DE'],
+        ['', 'Notes row'],
+        [' CUS_A ', 'Alpha duplicate', '', '', 'Cancelled'],
+        ['cus_C', 'Charlie', 'cy', 'cy@charlie.example', 'Active', 'Elite ($999)'],
+    ])
+
+
+def test_snapshot_loads_with_the_index():
+    """One batch_get fills the index and every column; queries need no reads"""
+    print("\n" + "="*60)
+    print("Testing Sheet Snapshot")
+    print("="*60)
+
+    sheet = make_sheet()
+    service = SheetsService(worksheet=sheet, snapshot=True)
+    snapshot = service.get_snapshot()
+    assert sheet.calls == ['row_values', 'batch_get']
+    assert len(snapshot) == 3
+
+    row = snapshot.get('CUS_A')
+    assert row['company_name'] == 'Alpha' and row['status'] == 'Active' and row['row'] == 2
+    assert snapshot.get('cus_C')['country'] == ''
+    assert snapshot.get('cus_missing') is None
+
+    assert snapshot.query({'status': 'active'}) == (2, [snapshot.get('cus_A'), snapshot.get('cus_C')])
+    total, rows = snapshot.query({'plan_tier': 'Elite'}, offset=1, limit=5)
+    assert total == 2 and [r['customer_id'] for r in rows] == ['cus_C']
+    assert snapshot.query({'plan_tier': 'Elite', 'status': 'Past Due'})[0] == 1
+    assert snapshot.query({'status': 'Paused'}) == (0, [])
+
+    # Filters stay correct as cells change after their lookup lists are built
+    snapshot.update('cus_C', {'status': 'Past Due'})
+    snapshot.update('cus_D', {'status': 'Active', 'plan_tier': 'Elite ($999)'}, row_number=7)
+    assert [r['customer_id'] for r in snapshot.query({'status': 'active'})[1]] == ['cus_A', 'cus_D']
+    assert [r['customer_id'] for r in snapshot.query({'status': 'past due'})[1]] == ['cus_B', 'cus_C']
+    assert snapshot.query({'plan_tier': 'Elite', 'status': 'Active'})[1][0]['row'] == 7
+
+    assert service.find_customer_row('cus_B') == 3
+    assert service.get_snapshot() is snapshot
+    assert sheet.calls == ['row_values', 'batch_get']
+    print("✅ Lookups and filtered listings are served from memory")
+
+
+def test_writes_keep_snapshot_current():
+    """Updates and appends show up in the snapshot as they are written"""
+    sheet = make_sheet()
+    service = SheetsService(worksheet=sheet, snapshot=True)
+    snapshot = service.get_snapshot()
+
+    assert service.upsert_customer(sample_customer('cus_A', 'Unpaid')) == 'updated'
+    assert snapshot.get('cus_A')['status'] == 'Unpaid'
+    assert sheet.calls.count('batch_get') == 2  # the index, then the row's ID check
+
+    # The new customer's index miss re-reads the sheet once, as before
+    changed = dict(sample_customer('cus_B', 'Active'), company_name='Renamed')
+    service.upsert_customers([changed, sample_customer('cus_new', 'Trial')])
+    assert sheet.calls.count('batch_get') == 4
+    row = snapshot.get('cus_B')
+    assert row['status'] == 'Active' and row['timestamp'] == '2024-01-01 00:00:00'
+    assert row['company_name'] == 'Bravo'  # updates only write Status and Last Updated
+    new = snapshot.get('cus_new')
+    assert new['row'] == 7 and new['plan_tier'] == 'Standard ($499)' and new['status'] == 'Trial'
+    assert snapshot.get('cus_A')['status'] == 'Unpaid'
+    assert snapshot.query({'status': 'Active'})[0] == 2
+
+    # After a failed write the next read reloads it
+    service.invalidate_index()
+    assert snapshot.is_stale(300)
+    service.get_snapshot()
+    assert sheet.calls.count('batch_get') == 5
+    assert snapshot.get('cus_new')['email'] == 'ops@acme.example'
+
+    # A write landing while the sheet is being re-read is not undone by the read
+    read = sheet.batch_get
+
+    def read_racing_write(*args, **kwargs):
+        columns = read(*args, **kwargs)
+        service.batch_update_customers([(2, sample_customer('cus_A', 'Active'))])
+        return columns
+
+    sheet.batch_get = read_racing_write
+    service.invalidate_index()
+    service.get_snapshot()
+    assert snapshot.get('cus_A')['status'] == 'Active'
+    assert snapshot.query({'status': 'Unpaid'}) == (0, [])
+    print("✅ The service's own writes keep the snapshot current")
+
+
+def test_listing_spans_shards():
+    """Paging runs across the snapshots of several worksheets as one list"""
+    us, de = SheetSnapshot(), SheetSnapshot()
+    us.load(['Stripe Customer ID', 'cus_1', 'cus_2', 'cus_3'],
+            {'status': ['Subscription Status', 'Active', 'Active', 'Cancelled']}, first_row=2)
+    de.load(['Stripe Customer ID', 'cus_4', 'cus_5'],
+            {'status': ['Subscription Status', 'Active', 'Active']}, first_row=2)
+
+    total, rows = query_snapshots([us, de], {'status': 'Active'}, offset=1, limit=2)
+    assert total == 4
+    assert [row['customer_id'] for row in rows] == ['cus_2', 'cus_4']
+    total, rows = query_snapshots([us, de], {'status': 'Active'}, offset=3, limit=10)
+    assert [row['customer_id'] for row in rows] == ['cus_5']
+    assert find_customer([us, de], 'CUS_5')['row'] == 3
+    assert find_customer([us, de], 'cus_9') is None
+    print("✅ Sharded worksheets are listed as one")
+
+
+if __name__ == "__main__":
+    tests = [
+        test_snapshot_loads_with_the_index,
+        test_writes_keep_snapshot_current,
+        test_listing_spans_shards,
+    ]
+    for test in tests:
+        test()
+
+    print("\n" + "="*60)
+    print(f"All {len(tests)} sheet snapshot tests passed!")
+    print("="*60)
@@ -0,0 +1,483 @@
+"""
+Offline tests for SheetsService using an in-memory worksheet
+These tests don't require Google credentials or network access
+"""
+
+import sys
+import time
+import threading
+
+from gspread.utils import a1_to_rowcol
+
+from sheets_service import SheetsService, SheetsNotReadyError, SHEET_HEADER
+from test_rate_limiter import FakeAPIError, make_limiter
+
+# Fix Windows console encoding
+if sys.platform == 'win32':
+    sys.stdout.reconfigure(encoding='utf-8')  # type: ignore
+
+
+class FakeWorksheet:
+    """Minimal stand-in for gspread.Worksheet that records API calls"""
+
+    def __init__(self, rows=None):
+        self.rows = [list(row) for row in (rows or [])]
+        self.calls = []
+        self.read_ranges = []  # ranges sent by each batch_get
+        self.latency = 0
+
+    def col_values(self, col):
+        self.calls.append('col_values')
+        time.sleep(self.latency)
+        return [row[col - 1] if len(row) >= col else '' for row in self.rows]
+
+    def row_values(self, row):
+        self.calls.append('row_values')
+        return list(self.rows[row - 1]) if len(self.rows) >= row else []
+
+    def batch_get(self, ranges, major_dimension='ROWS', **kwargs):
+        self.calls.append('batch_get')
+        self.read_ranges.append(list(ranges))
+        results = []
+        for a1 in ranges:
+            start, _, end = a1.partition(':')
+            if start.isdigit():
+                # Whole row, e.g. '1:1'
+                values = list(self.rows[int(start) - 1]) if len(self.rows) >= int(start) else []
+                results.append([values] if values else [])
+                continue
+            if start.isalpha():
+                # Whole column, e.g. 'E:E' (read with major_dimension='COLUMNS')
+                col = a1_to_rowcol(start + '1')[1]
+                values = [row[col - 1] if len(row) >= col else '' for row in self.rows]
+                results.append([values] if values else [])
+                continue
+            first_row, first_col = a1_to_rowcol(start)
+            last_row, last_col = a1_to_rowcol(end or start)
+            results.append([
+                [self.rows[r - 1][c - 1] if r <= len(self.rows) and c <= len(self.rows[r - 1]) else ''
+                 for c in range(first_col, last_col + 1)]
+                for r in range(first_row, last_row + 1)
+            ])
+        return results
+
+    def _set(self, row, col, value):
+        while len(self.rows) < row:
+            self.rows.append([])
+        cells = self.rows[row - 1]
+        while len(cells) < col:
+            cells.append('')
+        cells[col - 1] = value
+
+    def batch_update(self, data, **kwargs):
+        self.calls.append('batch_update')
+        for entry in data:
+            row, col = a1_to_rowcol(entry['range'].split(':')[0])
+            for r, values in enumerate(entry['values']):
+                for c, value in enumerate(values):
+                    self._set(row + r, col + c, value)
+
+    def append_rows(self, values, **kwargs):
+        self.calls.append('append_rows')
+        first_row = len(self.rows) + 1
+        for row in values:
+            self.rows.append(list(row))
+        return {'updates': {'updatedRange': f"'Sheet1'!A{first_row}:J{len(self.rows)}"}}
+
+
+def sample_customer(customer_id, status='Active'):
+    return {
+        'customer_id': customer_id,
+        'company_name': 'Acme Freight',
+        'email': 'ops@acme.example',
+        'subscription_id': 'sub_1',
+        'status': status,
+        'amount': 499,
+        'currency': 'USD',
+        'timestamp': '2024-01-01 00:00:00',
+        'country': 'US'
+    }
+
+
+def make_sheet():
+    return FakeWorksheet([
+        SHEET_HEADER,
+        ['cus_A', 'Alpha'],
+        [' CUS_B ', 'Bravo'],
+    ])
+
+
+def test_index_lookup_needs_one_read():
+    """Repeated lookups for known customers only read Column A once"""
+    print("\n" + "="*60)
+    print("Testing Customer Row Index")
+    print("="*60)
+
+    sheet = make_sheet()
+    service = SheetsService(worksheet=sheet)
+
+    assert service.find_customer_row('cus_a') == 2
+    assert service.find_customer_row('cus_B') == 3
+    assert service.find_customer_row('CUS_A') == 2
+    assert sheet.calls.count('col_values') == 1
+    print("✅ Steady-state lookups use the in-memory index")
+
+
+def test_append_updates_index():
+    """A newly appended customer is found without re-reading Column A"""
+    sheet = make_sheet()
+    service = SheetsService(worksheet=sheet)
+
+    assert service.upsert_customer(sample_customer('cus_C')) == 'created'
+    reads = sheet.calls.count('col_values')
+    assert service.find_customer_row('cus_C') == 4
+    assert sheet.calls.count('col_values') == reads
+    print("✅ append_new_customer keeps the index current")
+
+
+def test_miss_refreshes_for_external_rows():
+    """Rows added outside the service are seen before appending"""
+    sheet = make_sheet()
+    service = SheetsService(worksheet=sheet)
+    service.find_customer_row('cus_A')
+
+    sheet.rows.append(['cus_manual', 'Added by hand'])
+    assert service.upsert_customer(sample_customer('cus_manual')) == 'updated'
+    assert sheet.rows[3][4] == 'Active'
+    assert len(sheet.rows) == 4
+    print("✅ Index miss re-reads Column A instead of duplicating a row")
+
+
+def test_invalidate_index():
+    """invalidate_index forces a fresh read after external sorts/deletes"""
+    sheet = make_sheet()
+    service = SheetsService(worksheet=sheet)
+    service.find_customer_row('cus_A')
+
+    sheet.rows[1], sheet.rows[2] = sheet.rows[2], sheet.rows[1]
+    service.invalidate_index()
+    assert service.find_customer_row('cus_A') == 3
+    print("✅ Invalidated index picks up moved rows")
+
+
+def test_moved_rows_are_checked_before_writing():
+    """A sort since the index was read never sends a write to another customer's row"""
+    sheet = make_sheet()
+    service = SheetsService(worksheet=sheet)
+    service.find_customer_row('cus_A')
+
+    # Sorted by hand: the index still says cus_A is on row 2
+    sheet.rows[1], sheet.rows[2] = sheet.rows[2], sheet.rows[1]
+    assert service.upsert_customer(sample_customer('cus_A', 'Past Due')) == 'updated'
+    assert sheet.rows[2][0] == 'cus_A' and sheet.rows[2][4] == 'Past Due'
+    assert len(sheet.rows[1]) == 2
+    assert service.find_customer_row('cus_A') == 3
+
+    sheet.rows.insert(1, ['cus_inserted'])
+    assert service.upsert_customers([sample_customer('cus_B', 'Cancelled')]) == {'cus_B': 'updated'}
+    assert sheet.rows[2][4] == 'Cancelled' and len(sheet.rows[1]) == 1
+    print("✅ Moved rows are found again before the write")
+
+
+def test_update_is_single_request():
+    """Status and timestamp go out in one batch_update call"""
+    print("\n" + "="*60)
+    print("Testing Batched Writes")
+    print("="*60)
+
+    sheet = make_sheet()
+    service = SheetsService(worksheet=sheet)
+
+    assert service.upsert_customer(sample_customer('cus_A', 'Past Due')) == 'updated'
+    # Header, index, the row's ID check, then the write
+    assert sheet.calls == ['row_values', 'col_values', 'batch_get', 'batch_update']
+    assert sheet.rows[1][4] == 'Past Due'
+    assert sheet.rows[1][7] == '2024-01-01 00:00:00'
+    print("✅ update_existing_customer makes one API call")
+
+
+def test_upsert_customers_batches_burst():
+    """A burst of events costs one update call and one append call"""
+    sheet = make_sheet()
+    service = SheetsService(worksheet=sheet)
+
+    results = service.upsert_customers([
+        sample_customer('cus_A', 'Past Due'),
+        sample_customer('cus_B', 'Cancelled'),
+        sample_customer('cus_new'),
+        sample_customer('cus_A', 'Active'),
+    ])
+
+    assert results == {'cus_A': 'updated', 'cus_B': 'updated', 'cus_new': 'created'}
+    assert sheet.calls == ['row_values', 'col_values', 'batch_get', 'batch_update', 'append_rows']
+    assert sheet.rows[1][4] == 'Active'
+    assert sheet.rows[2][4] == 'Cancelled'
+    assert service.find_customer_row('cus_new') == 4
+    print("✅ upsert_customers writes N events in two API calls")
+
+
+def test_large_batch_reads_in_bounded_requests():
+    """Checking a 1000-row batch never puts more than 100 ranges in one URL"""
+    sheet = FakeWorksheet([SHEET_HEADER])
+    for i in range(1000):
+        sheet.rows.append([f'cus_{i}', '', '', '', 'Active'])
+        sheet.rows.append(['cus_other'])
+    service = SheetsService(worksheet=sheet, limiter=make_limiter())
+    customers = [sample_customer(f'cus_{i}', 'Past Due') for i in range(1000)]
+
+    assert set(service.upsert_customers(customers).values()) == {'updated'}
+    # Header plus 1000 scattered rows: 11 requests of at most 100 ranges
+    assert [len(ranges) for ranges in sheet.read_ranges] == [100] * 10 + [1]
+    assert max(len(','.join(ranges)) for ranges in sheet.read_ranges) < 2000
+    assert sheet.rows[1999][4] == 'Past Due' and sheet.rows[2000][0] == 'cus_other'
+
+    # Rows next to each other are read as one block
+    packed = FakeWorksheet([SHEET_HEADER] + [[f'cus_{i}', '', '', '', 'Active'] for i in range(1000)])
+    service = SheetsService(worksheet=packed, limiter=make_limiter())
+    service.upsert_customers(customers)
+    assert packed.read_ranges == [['1:1', 'A2:H1001']]
+    print("✅ Large batches are checked in bounded requests")
+
+
+def test_retried_batch_update_resends_clean_ranges():
+    """A 429 retry sends the same ranges, even though gspread edits them in place"""
+    sheet = make_sheet()
+    sent = []
+
+    def batch_update(data, **kwargs):
+        for entry in data:
+            # What gspread.Worksheet.batch_update does before sending
+            entry['range'] = f"'Sheet1'!{entry['range']}"
+        sent.append([entry['range'] for entry in data])
+        if len(sent) == 1:
+            raise FakeAPIError(429, retry_after=0)
+
+    sheet.batch_update = batch_update
+    service = SheetsService(worksheet=sheet, limiter=make_limiter())
+    service.batch_update_customers([(2, sample_customer('cus_A', 'Past Due'))])
+
+    assert sent[0] == sent[1] == ["'Sheet1'!E2", "'Sheet1'!H2"]
+    print("✅ Retries do not double the sheet-name prefix")
+
+
+def test_unchanged_rows_skip_writes():
+    """Updates matching the row cost no write; Last Updated is refreshed at most daily"""
+    sheet = FakeWorksheet([
+        SHEET_HEADER,
+        ['cus_A', 'Alpha', '', '', 'Active', '', '', '2024-01-01 00:00:00'],
+        ['cus_B', 'Bravo', '', '', 'Active', '', '', 'not a date'],
+    ])
+    service = SheetsService(worksheet=sheet)
+
+    later = dict(sample_customer('cus_A'), timestamp='2024-01-01 06:00:00')
+    assert service.upsert_customer(later) == 'unchanged'
+    # The row's ID check returns its Status and Last Updated too
+    assert sheet.calls == ['row_values', 'col_values', 'batch_get']
+
+    next_day = dict(sample_customer('cus_A'), timestamp='2024-01-02 00:00:00')
+    assert service.upsert_customers([next_day, sample_customer('cus_B')]) == {
+        'cus_A': 'updated', 'cus_B': 'updated'
+    }
+    assert sheet.rows[1][4:8] == ['Active', '', '', '2024-01-02 00:00:00']
+    assert sheet.rows[2][7] == '2024-01-01 00:00:00'
+
+    assert service.upsert_customer(dict(next_day, timestamp='2024-01-02 01:00:00')) == 'unchanged'
+    assert service.upsert_customer(sample_customer('cus_A', 'Past Due')) == 'updated'
+    assert sheet.rows[1][4] == 'Past Due'
+    assert sheet.calls.count('batch_update') == 2
+    assert service.update_stats() == {
+        'written': 1, 'timestamp_only': 2, 'unchanged': 2, 'skip_ratio': 0.4
+    }
+
+    always = SheetsService(worksheet=make_sheet(), skip_unchanged=False)
+    assert always.upsert_customer(sample_customer('cus_A')) == 'updated'
+    assert always.upsert_customer(sample_customer('cus_A')) == 'updated'
+    assert always.worksheet.calls.count('batch_update') == 2
+    print("✅ No-op updates are skipped without extra reads")
+
+
+def test_skip_sees_writes_from_other_processes():
+    """A row another worker (or a person) changed is never skipped as unchanged"""
+    sheet = FakeWorksheet([
+        SHEET_HEADER,
+        ['cus_A', 'Alpha', '', '', 'Active', '', '', '2024-01-01 00:00:00'],
+    ])
+    worker_a = SheetsService(worksheet=sheet)
+    worker_b = SheetsService(worksheet=sheet)
+    assert worker_a.upsert_customer(sample_customer('cus_A', 'Active')) == 'unchanged'
+
+    assert worker_b.upsert_customer(sample_customer('cus_A', 'Past Due')) == 'updated'
+    assert worker_a.upsert_customer(sample_customer('cus_A', 'Active')) == 'updated'
+    assert sheet.rows[1][4] == 'Active'
+
+    sheet.rows[1][4] = 'Cancelled'  # edited by hand
+    assert worker_b.upsert_customer(sample_customer('cus_A', 'Active')) == 'updated'
+    assert sheet.rows[1][4] == 'Active'
+    print("✅ Skips compare against the row as it is now")
+
+
+def test_not_ready_until_connected():
+    """A lazily created service refuses work instead of guessing"""
+    print("\n" + "="*60)
+    print("Testing Lazy Initialization")
+    print("="*60)
+
+    service = SheetsService(connect=False)
+    assert not service.ready
+    assert service.status()['state'] == 'initializing'
+    try:
+        service.upsert_customer(sample_customer('cus_A'))
+        assert False, 'expected SheetsNotReadyError'
+    except SheetsNotReadyError:
+        pass
+    print("✅ Writes before initialization raise SheetsNotReadyError")
+
+
+def test_concurrent_lookups_share_one_read():
+    """Threads hitting a cold index trigger a single Column A read"""
+    sheet = make_sheet()
+    sheet.latency = 0.1
+    service = SheetsService(worksheet=sheet)
+
+    results = []
+    threads = [
+        threading.Thread(target=lambda: results.append(service.find_customer_row('cus_B')))
+        for _ in range(8)
+    ]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert results == [3] * 8
+    assert sheet.calls.count('col_values') == 1
+    print("✅ Index refresh is shared between threads")
+
+
+class GatedLimiter:
+    """Holds write calls until released, like a write waiting for quota"""
+
+    def __init__(self):
+        self.limiter = make_limiter()
+        self.waiting = threading.Event()
+        self.release = threading.Event()
+
+    def call(self, kind, fn, *args, **kwargs):
+        if kind == 'write':
+            self.waiting.set()
+            self.release.wait(5)
+        return self.limiter.call(kind, fn, *args, **kwargs)
+
+
+def test_concurrent_upserts_create_one_row():
+    """Threads racing on a new customer append it once, without a re-read"""
+    sheet = make_sheet()
+    limiter = GatedLimiter()
+    service = SheetsService(worksheet=sheet, limiter=limiter)
+    service.find_customer_row('cus_A')
+    refreshes = []
+    refresh_index = service.refresh_index
+    service.refresh_index = lambda: refreshes.append(1) or refresh_index()
+
+    results = []
+    threads = [
+        threading.Thread(target=lambda: results.append(service.upsert_customer(sample_customer('cus_new'))))
+        for _ in range(6)
+    ]
+    threads[0].start()
+    assert limiter.waiting.wait(5)  # the first thread holds the append
+
+    # Count the others into the pending row before letting the append go
+    pending = service._pending_inserts['cus_new']
+    merged = threading.Semaphore(0)
+    merge = pending.merge
+    pending.merge = lambda customer_data: merge(customer_data) and (merged.release() or True)
+    for thread in threads[1:]:
+        thread.start()
+    for _ in threads[1:]:
+        assert merged.acquire(timeout=5)
+    limiter.release.set()
+    for thread in threads:
+        thread.join()
+
+    assert sorted(results) == ['created'] + ['updated'] * 5
+    assert [row[0] for row in sheet.rows].count('cus_new') == 1
+    assert sheet.calls.count('append_rows') == 1
+    assert sheet.calls.count('batch_update') == 0
+    # The initial miss re-reads Column A once; the rest never look
+    assert len(refreshes) == 1
+    print("✅ Per-customer locks serialize find-then-append")
+
+
+def test_later_event_merges_into_pending_insert():
+    """An event arriving while the new row waits for quota rides along with it"""
+    sheet = make_sheet()
+    limiter = GatedLimiter()
+    service = SheetsService(worksheet=sheet, limiter=limiter)
+    service.find_customer_row('cus_A')
+
+    results = []
+    first = threading.Thread(target=lambda: results.append(service.upsert_customer(sample_customer('cus_new'))))
+    first.start()
+    assert limiter.waiting.wait(5)
+
+    later = dict(sample_customer('cus_new', 'Past Due'), company_name=None)
+    second = threading.Thread(target=lambda: results.append(service.upsert_customer(later)))
+    second.start()
+    time.sleep(0.05)
+    limiter.release.set()
+    first.join()
+    second.join()
+
+    assert sorted(results) == ['created', 'updated']
+    assert sheet.calls.count('append_rows') == 1
+    assert sheet.calls.count('batch_update') == 0
+    row = sheet.rows[3]
+    assert row[0] == 'cus_new' and row[4] == 'Past Due' and row[1] == 'Acme Freight'
+    print("✅ Pending insert absorbs later events for the same customer")
+
+
+def test_append_row_read_from_response():
+    """The appended row number comes from updatedRange, not a local guess"""
+    sheet = make_sheet()
+    service = SheetsService(worksheet=sheet)
+    service.find_customer_row('cus_A')
+
+    # Another process appended a row this service hasn't seen
+    sheet.rows.append(['cus_elsewhere'])
+    service.append_new_customer(sample_customer('cus_C'))
+
+    assert sheet.rows[4][0] == 'cus_C'
+    reads = sheet.calls.count('batch_get')
+    assert service.find_customer_row('cus_C') == 5
+    assert sheet.calls.count('batch_get') == reads
+    assert SheetsService.appended_first_row({'updates': {'updatedRange': "'Q1 Data'!A12:J14"}}) == 12
+    assert SheetsService.appended_first_row(None) is None
+    print("✅ Appended rows are indexed at the row Sheets reports")
+
+
+if __name__ == "__main__":
+    tests = [
+        test_index_lookup_needs_one_read,
+        test_append_updates_index,
+        test_miss_refreshes_for_external_rows,
+        test_invalidate_index,
+        test_moved_rows_are_checked_before_writing,
+        test_update_is_single_request,
+        test_upsert_customers_batches_burst,
+        test_large_batch_reads_in_bounded_requests,
+        test_retried_batch_update_resends_clean_ranges,
+        test_unchanged_rows_skip_writes,
+        test_skip_sees_writes_from_other_processes,
+        test_not_ready_until_connected,
+        test_concurrent_lookups_share_one_read,
+        test_concurrent_upserts_create_one_row,
+        test_later_event_merges_into_pending_insert,
+        test_append_row_read_from_response,
+    ]
+    for test in tests:
+        test()
+
+    print("\n" + "="*60)
+    print(f"All {len(tests)} SheetsService tests passed!")
+    print("="*60)
@@ -0,0 +1,145 @@
+"""
+Offline tests for the local sink and downstream fan-out
+"""
+
+import os
+import sys
+import time
+import tempfile
+
+from sinks import LocalSink, FanOutSink, CustomerSink
+from sheets_service import SheetsService
+from test_sheets_service import FakeWorksheet, sample_customer
+
+# Fix Windows console encoding
+if sys.platform == 'win32':
+    sys.stdout.reconfigure(encoding='utf-8')  # type: ignore
+
+
+def temp_local_sink(**kwargs):
+    handle, path = tempfile.mkstemp(suffix='.db')
+    os.close(handle)
+    return LocalSink(path, **kwargs)
+
+
+class FlakySink(CustomerSink):
+    """Records batches; fails while `failing` is set"""
+
+    def __init__(self, name):
+        self.name = name
+        self.failing = False
+        self.batches = []
+
+    def upsert_customers(self, customers):
+        if self.failing:
+            raise RuntimeError(f'{self.name} is down')
+        self.batches.append([dict(data) for data in customers])
+        return {data['customer_id']: 'updated' for data in customers}
+
+
+def test_local_record_and_outbox():
+    """Writes merge into one record per customer and queue it for each sink"""
+    print("\n" + "="*60)
+    print("Testing Customer Sinks")
+    print("="*60)
+
+    local = temp_local_sink(outbox_sinks=['sheets'])
+    assert local.upsert_customer(sample_customer('cus_1')) == 'created'
+    later = dict(sample_customer('CUS_1 ', 'Past Due'), company_name=None)
+    assert local.upsert_customer(later) == 'updated'
+
+    record = local.get('cus_1')
+    assert record['status'] == 'Past Due' and record['company_name'] == 'Acme Freight'
+    pending = local.pending('sheets')
+    assert len(pending) == 1 and pending[0][0]['status'] == 'Past Due'
+
+    # A change that lands after the batch was read stays queued
+    local.upsert_customer(sample_customer('cus_1', 'Cancelled'))
+    local.mark_synced('sheets', [entry for _, entry in pending])
+    assert local.backlog() == {'sheets': 1}
+    print("✅ Local record keeps the latest state and an outbox per sink")
+
+
+def test_fan_out_isolates_failing_sinks():
+    """A failing downstream sink neither blocks the webhook nor the other sinks"""
+    sheets, archive = FlakySink('sheets'), FlakySink('archive')
+    fan_out = FanOutSink(temp_local_sink(), [sheets, archive], batch_size=10)
+    sheets.failing = True
+
+    assert fan_out.upsert_customer(sample_customer('cus_1')) == 'created'
+    assert fan_out.upsert_customer(sample_customer('cus_1', 'Past Due')) == 'updated'
+
+    assert fan_out.sync_once(archive) == 1
+    try:
+        fan_out.sync_once(sheets)
+        assert False, 'expected the sheets sink to fail'
+    except RuntimeError:
+        pass
+    assert fan_out.local.backlog() == {'sheets': 1, 'archive': 0}
+
+    # Once it recovers, the sheet gets the latest state in one batch
+    sheets.failing = False
+    assert fan_out.sync_once(sheets) == 1
+    assert [data['status'] for data in sheets.batches[0]] == ['Past Due']
+    assert fan_out.local.backlog() == {'sheets': 0, 'archive': 0}
+    print("✅ Downstream sinks sync independently and catch up")
+
+
+def test_processes_split_the_outbox():
+    """Claimed batches are invisible to other processes until synced or released"""
+    first = temp_local_sink(outbox_sinks=['sheets'])
+    second = LocalSink(first.path, outbox_sinks=['sheets'])
+    for i in range(3):
+        first.upsert_customer(sample_customer(f'cus_{i}'))
+
+    token, batch = first.claim('sheets', 2)
+    assert [key for _, (key, _) in batch] == ['cus_0', 'cus_1']
+    other_token, other = second.claim('sheets', 10)
+    assert [key for _, (key, _) in other] == ['cus_2']
+    assert second.claim('sheets', 10)[1] == []
+
+    # A change to a claimed customer waits for the claim, then goes out
+    second.upsert_customer(sample_customer('cus_0', 'Past Due'))
+    assert second.claim('sheets', 10)[1] == []
+    first.mark_synced('sheets', [entry for _, entry in batch], token)
+    second.release('sheets', [entry for _, entry in other], other_token)
+    _, retry = second.claim('sheets', 10)
+    assert [(data['customer_id'], data['status']) for data, _ in retry] == [
+        ('cus_0', 'Past Due'), ('cus_2', 'Active')
+    ]
+    print("✅ Worker processes never send the same outbox entry at once")
+
+
+def test_background_sync_batches_sheet_writes():
+    """The sync thread turns a burst of local writes into batched Sheets calls"""
+    sheet = FakeWorksheet([['Stripe Customer ID']])
+    fan_out = FanOutSink(temp_local_sink(), [SheetsService(worksheet=sheet)], poll_interval=0.05)
+    for i in range(20):
+        fan_out.upsert_customer(sample_customer(f'cus_{i}'))
+    fan_out.start()
+    try:
+        deadline = time.monotonic() + 5
+        while fan_out.local.backlog()['sheets'] and time.monotonic() < deadline:
+            time.sleep(0.02)
+    finally:
+        fan_out.stop()
+
+    assert fan_out.local.backlog() == {'sheets': 0}
+    assert sorted(row[0] for row in sheet.rows[1:]) == sorted(f'cus_{i}' for i in range(20))
+    assert sheet.calls.count('append_rows') == 1
+    print("✅ Sheets follows the local record in batches")
+
+
+if __name__ == "__main__":
+    tests = [
+        test_local_record_and_outbox,
+        test_fan_out_isolates_failing_sinks,
+        test_processes_split_the_outbox,
+        test_background_sync_batches_sheet_writes,
+    ]
+    for test in tests:
+        test()
+
+    print("\n" + "="*60)
+    print(f"All {len(tests)} sink tests passed!")
+    print("="*60)
@@ -0,0 +1,115 @@
+"""
+Lean Stripe webhook verification: HMAC over the raw body, one JSON parse
+
+stripe.Webhook.construct_event decodes the body, verifies it, parses it
+with an OrderedDict hook and wraps every nested object in a StripeObject.
+The handlers only read a few fields, so the event is kept as the plain
+dict the JSON parser returns (orjson when installed).
+"""
+
+import os
+import hmac
+import time
+import json
+import hashlib
+
+import stripe
+
+try:
+    import orjson
+except ImportError:  # optional speedup
+    orjson = None
+
+
+# Largest body accepted before any verification work (Stripe events are
+# well below this; anything bigger is not from Stripe)
+MAX_WEBHOOK_BYTES = int(os.getenv('WEBHOOK_MAX_BYTES', str(512 * 1024)))
+
+# Same replay window as stripe.Webhook.construct_event
+TOLERANCE_SECONDS = int(os.getenv('WEBHOOK_TOLERANCE_SECONDS', '300'))
+
+
+class PayloadTooLargeError(ValueError):
+    """Raised for bodies over MAX_WEBHOOK_BYTES"""
+
+
+def verify_signature(payload, sig_header, secret, tolerance=None, now=None):
+    """
+    Check a Stripe-Signature header against the raw request body
+
+    Args:
+        payload: Raw body bytes, exactly as received
+        sig_header: Stripe-Signature header ("t=...,v1=...,v1=...")
+        secret: Endpoint signing secret (whsec_...)
+        tolerance: Max age of the timestamp in seconds (TOLERANCE_SECONDS)
+
+    Raises:
+        stripe.error.SignatureVerificationError: missing, malformed,
+            mismatched or expired signature
+    """
+    tolerance = TOLERANCE_SECONDS if tolerance is None else tolerance
+    if isinstance(payload, str):
+        payload = payload.encode('utf-8')
+    timestamp = None
+    signatures = []
+    for item in (sig_header or '').split(','):
+        key, _, value = item.strip().partition('=')
+        if key == 't':
+            timestamp = value
+        elif key == 'v1':
+            signatures.append(value)
+
+    try:
+        timestamp_value = int(timestamp)
+    except (TypeError, ValueError):
+        raise stripe.error.SignatureVerificationError(
+            'Unable to extract timestamp and signatures from header', sig_header, payload
+        )
+    if not signatures:
+        raise stripe.error.SignatureVerificationError(
+            'No signatures found with expected scheme v1', sig_header, payload
+        )
+
+    expected = hmac.new(
+        secret.encode('utf-8'), timestamp.encode('ascii') + b'.' + payload, hashlib.sha256
+    ).hexdigest()
+    if not any(hmac.compare_digest(expected, signature) for signature in signatures):
+        raise stripe.error.SignatureVerificationError(
+            'No signatures found matching the expected signature for payload', sig_header, payload
+        )
+
+    if tolerance and timestamp_value < (now or time.time()) - tolerance:
+        raise stripe.error.SignatureVerificationError(
+            f'Timestamp outside the tolerance zone ({timestamp_value})', sig_header, payload
+        )
+
+
+def parse_event(payload):
+    """
+    Parse an event body into plain dicts and lists
+
+    Raises:
+        ValueError: not a JSON object with a type
+    """
+    event = orjson.loads(payload) if orjson is not None else json.loads(payload)
+    if not isinstance(event, dict) or not isinstance(event.get('type'), str):
+        raise ValueError('Event has no type')
+    return event
+
+
+def construct_event(payload, sig_header, secret):
+    """
+    Size check, signature check, then a single parse
+
+    Returns:
+        Event as a dict (event['data']['object'] is a dict too)
+
+    Raises:
+        PayloadTooLargeError: body over MAX_WEBHOOK_BYTES
+        stripe.error.SignatureVerificationError: bad signature
+        ValueError: invalid JSON
+    """
+    if len(payload) > MAX_WEBHOOK_BYTES:
+        raise PayloadTooLargeError(f'Payload of {len(payload)} bytes exceeds {MAX_WEBHOOK_BYTES}')
+    verify_signature(payload, sig_header, secret)
+    return parse_event(payload)